@@ -0,0 +1,152 @@
+""" Synthetic Test Data
+    bench/generate.py
+    Generates a TEMPLATE.xlsx, a data workbook and a template PDF of any size, for the
+    benchmarks. The files follow the layout of the files in test/.
+    Usage: python bench/generate.py FOLDER [--records 1000] [--rows 1000] [--columns 8]
+                                          [--pages 1] [--page-size A4] [--password secret]
+    Author: vipulasrilanka@yahoo.com
+    (c) 2024 """
+
+import argparse
+import io
+import json
+import os
+import sys
+
+SRC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+if not SRC_FOLDER in sys.path:
+    sys.path.insert(0, SRC_FOLDER)
+
+from constants.templatedata import TEMPLATE_SHEET_NAME, RECORD_LIST_SHEET_NAME
+
+DATA_FILE_NAME = "DATA01.xlsx"
+DATA_SHEET_NAME = "BENCH DATA"
+TEMPLATE_FILE_NAME = "TEMPLATE.xlsx"
+PDF_FILE_NAME = "Master.pdf"
+PAGE_SIZE_LIST = ("letter", "legal", "A4")
+DEFAULT_RECORDS = 1000
+DEFAULT_COLUMNS = 8
+DEFAULT_PAGES = 1
+DEFAULT_PAGE_SIZE = "A4"
+
+def getColumnLetter(columnIndex):
+    """ Column letter of a one based column index, e.g. 1 = A"""
+    from openpyxl.utils import get_column_letter
+    return get_column_letter(columnIndex)
+
+def makeDataWorkbook(fileName, rowCount, columnCount, password=None):
+    """ Write a data workbook with a header row and rowCount rows. Column A is the primary
+        key (1 to rowCount), column B a number, and the other columns text.
+    Args:   fileName (string) : workbook file name
+            rowCount (int) : number of data rows
+            columnCount (int) : number of columns, at least 3
+            password (string) : encrypt the workbook with this password, None for no password"""
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(DATA_SHEET_NAME)
+    sheet.append(["Key", "Amount"] + [f"Text {column}" for column in range(3, columnCount + 1)])
+    for rowKey in range(1, rowCount + 1):
+        sheet.append([rowKey, rowKey * 37 % 100000 + 0.25] +
+                     [f"Value {rowKey} of column {column}" for column in range(3, columnCount + 1)])
+    workbookByteIO = io.BytesIO()
+    workbook.save(workbookByteIO)
+    with open(fileName, 'wb') as f:
+        if None == password:
+            f.write(workbookByteIO.getvalue())
+        else:
+            from msoffcrypto.format.ooxml import OOXMLFile
+            workbookByteIO.seek(0)
+            OOXMLFile(workbookByteIO).encrypt(password, f)
+
+def getOverlayRows(columnCount):
+    """ Overlay sheet rows: immediate text, a lookup of each data column, the text
+        preprocessors, a concatenation and a SrinkToFit line."""
+    lookup = "<Type=File><File=%s><Sheet=%s><PrimeryKey=A><Value=%%s>" % (DATA_FILE_NAME, DATA_SHEET_NAME)
+    rowList = [["Date", "<Type=Text><Text=2024-10-25>", "<X=160><Y=742>", None],
+               ["Title", "<Type=Text><Text=Benchmark>", "<X=25mm><Y=250mm><Font=Courier><FontSize=10>", None],
+               ["Amount", lookup % "B", "<X=100mm><Y=215mm><Font=Helvetica><FontSize=12>", "<Function=FormatNumber(text,2,USD,ONLY)>"],
+               ["Amount in Words", lookup % "B", "<X=1.01in><Y=8.2in><Font=Helvetica><FontSize=12><LineSpace=1.2X><Function=SrinkToFit(4.2in,2,0.5in)>",
+                "<Function=NumberToText(text,Float)>"]]
+    for column in range(3, columnCount + 1):
+        rowList.append([f"Text {column}", lookup % getColumnLetter(column), f"<X=72><Y={700 - column * 14}><FontSize=9>", None])
+    rowList.append(["!<CONCAT><Title>", "<Type=Text><Text=run>", None, "<Function=AddSpace(text,1)>"])
+    return rowList
+
+def makeTemplateWorkbook(fileName, recordCount, rowCount, columnCount):
+    """ Write a TEMPLATE.xlsx with the overlays of getOverlayRows, and recordCount records
+        in the Data sheet. The record keys repeat when there are more records than rows."""
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    overlaySheet = workbook.create_sheet(TEMPLATE_SHEET_NAME)
+    overlaySheet.append(["#", "Name", "Content", "Params", "PreProcess"])
+    for rowIndex, overlayRow in enumerate(getOverlayRows(columnCount), 1):
+        overlaySheet.append([rowIndex] + overlayRow)
+    recordSheet = workbook.create_sheet(RECORD_LIST_SHEET_NAME)
+    recordSheet.append(["#", "Primary Key", "First Name", "Last Name", "Identifier"])
+    for recordIndex in range(1, recordCount + 1):
+        recordKey = (recordIndex - 1) % rowCount + 1
+        recordSheet.append([recordIndex, recordKey, "Name", str(recordIndex), f"Name {recordIndex}"])
+    workbook.save(fileName)
+
+def makeTemplatePdf(fileName, pageCount, pageSize=DEFAULT_PAGE_SIZE):
+    """ Write a template PDF with pageCount pages of ruled lines and labels.
+    Args:   fileName (string) : PDF file name
+            pageCount (int) : number of pages
+            pageSize (string) : one of PAGE_SIZE_LIST"""
+    from reportlab.lib import pagesizes
+    from reportlab.pdfgen import canvas
+    width, height = getattr(pagesizes, pageSize)
+    pdfCanvas = canvas.Canvas(fileName, pagesize=(width, height))
+    for page in range(pageCount):
+        pdfCanvas.setFont("Helvetica-Bold", 14)
+        pdfCanvas.drawString(72, height - 60, f"Benchmark template, page {page + 1}")
+        pdfCanvas.setFont("Helvetica", 8)
+        for line in range(int((height - 120) // 14)):
+            y = height - 90 - line * 14
+            pdfCanvas.line(60, y - 3, width - 60, y - 3)
+            pdfCanvas.drawString(62, y, f"Field {line + 1}")
+        pdfCanvas.showPage()
+    pdfCanvas.save()
+
+def makeBenchFiles(folder, recordCount=DEFAULT_RECORDS, rowCount=None, columnCount=DEFAULT_COLUMNS,
+                   pageCount=DEFAULT_PAGES, pageSize=DEFAULT_PAGE_SIZE, password=None):
+    """ Generate a full set of files in folder, with a session file to run main.py
+    Returns: directory: the file names, and the settings used"""
+    rowCount = recordCount if None == rowCount else rowCount
+    columnCount = max(3, columnCount)
+    os.makedirs(folder, exist_ok=True)
+    benchFiles = {"folder": os.path.abspath(folder),
+                  "templateFileName": os.path.abspath(os.path.join(folder, TEMPLATE_FILE_NAME)),
+                  "dataFileName": os.path.abspath(os.path.join(folder, DATA_FILE_NAME)),
+                  "pdfFileName": os.path.abspath(os.path.join(folder, PDF_FILE_NAME)),
+                  "sessionFileName": os.path.abspath(os.path.join(folder, "bench-session.json")),
+                  "password": password,
+                  "settings": {"records": recordCount, "rows": rowCount, "columns": columnCount,
+                               "pages": pageCount, "pageSize": pageSize, "encrypted": not None == password}}
+    makeDataWorkbook(benchFiles["dataFileName"], rowCount, columnCount, password)
+    makeTemplateWorkbook(benchFiles["templateFileName"], recordCount, rowCount, columnCount)
+    makeTemplatePdf(benchFiles["pdfFileName"], pageCount, pageSize)
+    with open(benchFiles["sessionFileName"], 'w') as f:
+        json.dump({"pdfFileName": benchFiles["pdfFileName"], "templateFileName": benchFiles["templateFileName"],
+                   "sourceFiles": [{"name": DATA_FILE_NAME, "path": benchFiles["folder"]}], "sourceCache": False}, f, indent=4)
+    return benchFiles
+
+def main():
+    """Main Function"""
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark files")
+    parser.add_argument("folder", help="folder for the generated files")
+    parser.add_argument("--records", type=int, default=DEFAULT_RECORDS, help="records in the Data sheet")
+    parser.add_argument("--rows", type=int, help="rows in the data workbook (default = records)")
+    parser.add_argument("--columns", type=int, default=DEFAULT_COLUMNS, help="columns in the data workbook")
+    parser.add_argument("--pages", type=int, default=DEFAULT_PAGES, help="pages in the template PDF")
+    parser.add_argument("--page-size", choices=PAGE_SIZE_LIST, default=DEFAULT_PAGE_SIZE, help="page size of the template PDF")
+    parser.add_argument("--password", help="encrypt the data workbook with this password")
+    arguments = parser.parse_args()
+    benchFiles = makeBenchFiles(arguments.folder, arguments.records, arguments.rows, arguments.columns,
+                                arguments.pages, arguments.page_size, arguments.password)
+    print(json.dumps(benchFiles, indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
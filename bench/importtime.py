@@ -0,0 +1,75 @@
+""" Import Time Benchmark
+    bench/importtime.py
+    Measures the start up import time of main.py, and checks that the heavy modules are
+    loaded on first use, not at start up. Exits with 1 when the import time is over the
+    budget or a heavy module is loaded at start up, so it can guard the build.
+    Usage: python bench/importtime.py [--runs 5] [--max-ms 150] [--json result.json]
+    Author: vipulasrilanka@yahoo.com 
+    (c) 2024 """
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+#modules loaded by the functions that use them, they should not be loaded by "import main"
+LAZY_MODULE_LIST = ("tkinter", "openpyxl", "num2words", "msoffcrypto", "cryptography",
+                    "reportlab", "PyPDF2", "zipfile", "multiprocessing")
+DEFAULT_RUNS = 5
+DEFAULT_MAX_MS = 150
+
+def getImportTime(moduleName):
+    """ Import a module in a new python process
+    Args:   moduleName (string) : module to import, from the src folder
+    Returns: tuple: (cumulative import time in us, set of the modules loaded)"""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {moduleName}"],
+                               cwd=SRC_FOLDER, capture_output=True, text=True, check=True)
+    importTime = None
+    moduleSet = set()
+    for line in completed.stderr.splitlines():
+        #import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        loadedModule = fields[2].strip()
+        moduleSet.add(loadedModule)
+        if moduleName == loadedModule:
+            importTime = int(fields[1])
+    return importTime, moduleSet
+
+def main():
+    """Main Function"""
+    parser = argparse.ArgumentParser(description="Start up import time of main.py")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="number of imports to time")
+    parser.add_argument("--max-ms", type=float, default=DEFAULT_MAX_MS, help="budget for the median import time")
+    parser.add_argument("--json", help="write the result to this file")
+    arguments = parser.parse_args()
+    timeList = []
+    eagerModuleSet = set()
+    for run in range(max(1, arguments.runs)):
+        importTime, moduleSet = getImportTime("main")
+        timeList.append(importTime / 1000)
+        #only the top level package is reported
+        eagerModuleSet.update(set(loadedModule.split(".")[0] for loadedModule in moduleSet) & set(LAZY_MODULE_LIST))
+    result = {"module": "main", "runs": len(timeList), "minMs": round(min(timeList), 2),
+              "medianMs": round(statistics.median(timeList), 2), "maxMs": round(max(timeList), 2),
+              "budgetMs": arguments.max_ms, "eagerModules": sorted(eagerModuleSet)}
+    result["pass"] = result["medianMs"] <= arguments.max_ms and 0 == len(eagerModuleSet)
+    print(json.dumps(result, indent=4))
+    if not None == arguments.json:
+        with open(arguments.json, 'w') as f:
+            json.dump(result, f, indent=4)
+    if not result["pass"]:
+        if len(eagerModuleSet) > 0:
+            print("FAIL: loaded at start up", ", ".join(sorted(eagerModuleSet)))
+        else:
+            print("FAIL: import time over the budget of", arguments.max_ms, "ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
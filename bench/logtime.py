@@ -0,0 +1,84 @@
+""" Log Level Benchmark
+    bench/logtime.py
+    Times a batch run of main.py at each log level, and counts the log output. The run
+    uses the test files in test/ unless a session file is given.
+    Usage: python bench/logtime.py [--runs 3] [--session session.json] [--json result.json]
+    Author: vipulasrilanka@yahoo.com 
+    (c) 2024 """
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+MAIN_FILE = os.path.join(ROOT_FOLDER, "src", "main.py")
+TEST_FOLDER = os.path.join(ROOT_FOLDER, "test")
+#passwords of the protected test files, see README.md
+TEST_PASSWORD_LIST = {"EMP01.xlsx": "perdata", "PAY01.xlsx": "saldata"}
+#--log-level values to time, --quiet is the same as WARNING
+LEVEL_LIST = ("DEBUG", "INFO", "WARNING")
+DEFAULT_RUNS = 3
+
+def getTestSession(workFolder):
+    """ Write a session file for the test files, without the source cache, so each run
+        reads the data files."""
+    sessionFileName = os.path.join(workFolder, "bench-session.json")
+    sessionData = {"pdfFileName": os.path.join(TEST_FOLDER, "Master.pdf"),
+                   "templateFileName": os.path.join(TEST_FOLDER, "TEMPLATE.xlsx"),
+                   "sourceFiles": [{"name": name, "path": TEST_FOLDER} for name in TEST_PASSWORD_LIST],
+                   "sourceCache": False}
+    with open(sessionFileName, 'w') as f:
+        json.dump(sessionData, f, indent=4)
+    passwordFileName = os.path.join(workFolder, "bench-passwords.txt")
+    with open(passwordFileName, 'w') as f:
+        f.writelines(f"{name}={password}\n" for name, password in TEST_PASSWORD_LIST.items())
+    return sessionFileName, passwordFileName
+
+def timeRun(sessionFileName, passwordFileName, outputFolder, logLevel):
+    """ Run main.py once. The log is read through a pipe, as a job runner would.
+    Returns: tuple: (seconds, bytes of log output, return code)"""
+    commandLine = [sys.executable, MAIN_FILE, sessionFileName, "--batch", "--output-dir", outputFolder, "--log-level", logLevel]
+    if not None == passwordFileName:
+        commandLine.extend(["--password-file", passwordFileName])
+    startTime = time.perf_counter()
+    completed = subprocess.run(commandLine, capture_output=True)
+    runTime = time.perf_counter() - startTime
+    return runTime, len(completed.stdout) + len(completed.stderr), completed.returncode
+
+def main():
+    """Main Function"""
+    parser = argparse.ArgumentParser(description="Run time of main.py at each log level")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="number of runs at each level")
+    parser.add_argument("--session", help="session file to run, default = the test files")
+    parser.add_argument("--password-file", help="password file of the session")
+    parser.add_argument("--json", help="write the result to this file")
+    arguments = parser.parse_args()
+    resultList = []
+    with tempfile.TemporaryDirectory() as workFolder:
+        sessionFileName, passwordFileName = arguments.session, arguments.password_file
+        if None == sessionFileName:
+            sessionFileName, passwordFileName = getTestSession(workFolder)
+        for logLevel in LEVEL_LIST:
+            timeList = []
+            for run in range(max(1, arguments.runs)):
+                runTime, logSize, returnCode = timeRun(sessionFileName, passwordFileName, os.path.join(workFolder, "out"), logLevel)
+                if not 0 == returnCode:
+                    print("FAIL: main.py returned", returnCode, "at", logLevel)
+                    return 1
+                timeList.append(runTime)
+            resultList.append({"logLevel": logLevel, "runs": len(timeList), "minSeconds": round(min(timeList), 4),
+                               "medianSeconds": round(statistics.median(timeList), 4), "logBytes": logSize})
+    print(json.dumps(resultList, indent=4))
+    if not None == arguments.json:
+        with open(arguments.json, 'w') as f:
+            json.dump(resultList, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
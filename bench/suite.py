@@ -0,0 +1,164 @@
+""" Benchmark Suite
+    bench/suite.py
+    Generates a synthetic batch (see generate.py), times each stage of a record in this
+    process, then times main.py end to end at the default and the quiet log levels. The
+    result is written as JSON, so runs can be compared over time.
+    Stages: template load, source load, lookup, preprocess, layout, merge and write.
+    Usage: python bench/suite.py [--records 1000] [--rows 1000] [--columns 8] [--pages 1]
+                                 [--page-size A4] [--encrypt] [--json result.json]
+    Author: vipulasrilanka@yahoo.com
+    (c) 2024 """
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate import makeBenchFiles, PAGE_SIZE_LIST, DEFAULT_RECORDS, DEFAULT_COLUMNS, DEFAULT_PAGES, DEFAULT_PAGE_SIZE
+
+from constants.errorcodes import ERROR_SUCCESS
+from constants.pdfData import PDF_FIRST_PAGE, PDF_DEFAULT_OVERLAY_WRITER
+from constants.templatedata import TEMPLATE_SHEET_NAME, RECORD_LIST_SHEET_NAME
+
+MAIN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "main.py")
+BENCH_PASSWORD = "bench"
+#log levels of the end to end runs, the default and --quiet
+END_TO_END_LEVEL_LIST = ("INFO", "WARNING")
+STAGE_LIST = ("templateLoad", "sourceLoad", "lookup", "preprocess", "layout", "merge", "write")
+
+def getPeakRss(who=resource.RUSAGE_SELF):
+    """ Peak resident memory in KB. ru_maxrss is in bytes on macOS"""
+    peakRss = resource.getrusage(who).ru_maxrss
+    return peakRss // 1024 if "Darwin" == platform.system() else peakRss
+
+def timeStages(benchFiles, outputFolder, overlayWriter=PDF_DEFAULT_OVERLAY_WRITER):
+    """ Run every record of the batch through the stages one at a time, on this thread,
+        and add up the time of each stage.
+    Returns: directory: seconds and count of each stage, records and peak RSS"""
+    from projectutils.businessfunc import openTemplateFile, closeTemplateFile, loadTemplateData, loadRecordIdList
+    from projectutils.businessfunc import getFilesFromOverlayList, getSourceColumns, getRecordKeySet
+    from projectutils.businessfunc import getStringFromFileObject, concatToOverlay
+    from projectutils.filefunc import loadSourceFile, saveOutputFile
+    from projectutils.pdfFunc import preloadPdfTemplate, getTextLines, getOverlayPdfData, getTextLayout
+    stageTimes = {stage: {"seconds": 0.0, "count": 0} for stage in STAGE_LIST}
+    def addTime(stage, startTime):
+        stageTimes[stage]["seconds"] = stageTimes[stage]["seconds"] + time.perf_counter() - startTime
+        stageTimes[stage]["count"] = stageTimes[stage]["count"] + 1
+
+    startTime = time.perf_counter()
+    templateBook = openTemplateFile(benchFiles["templateFileName"])
+    textOverlayList = loadTemplateData(templateBook, TEMPLATE_SHEET_NAME)
+    recordIdList = loadRecordIdList(templateBook, RECORD_LIST_SHEET_NAME)
+    closeTemplateFile(templateBook)
+    addTime("templateLoad", startTime)
+    fileObjectList = []
+    for sourceFile in getFilesFromOverlayList(textOverlayList):
+        startTime = time.perf_counter()
+        returnValue = loadSourceFile(os.path.join(benchFiles["folder"], sourceFile), getSourceColumns(sourceFile, textOverlayList),
+                                     getRecordKeySet(recordIdList), benchFiles["password"])
+        addTime("sourceLoad", startTime)
+        if not ERROR_SUCCESS == returnValue["error"]:
+            raise RuntimeError(f"Can not load {sourceFile}, error code {returnValue['error']}")
+        fileObjectList.append({"name": sourceFile, "path": benchFiles["folder"], "object": returnValue["object"]})
+    preloadPdfTemplate(benchFiles["pdfFileName"])
+    getTextLayout.cache_clear()
+    for recordId in recordIdList:
+        pdfOverlayList = []
+        for textOverlay in textOverlayList:
+            content = textOverlay.content
+            if "File" == content.type:
+                startTime = time.perf_counter()
+                overlayString = getStringFromFileObject(content.file, fileObjectList, content.sheet, recordId["key"],
+                                                        content.keyCol, content.valueCol)
+                addTime("lookup", startTime)
+            else:
+                overlayString = content.text
+            if not None == textOverlay.preProcess:
+                startTime = time.perf_counter()
+                overlayString = textOverlay.preProcess(overlayString)
+                addTime("preprocess", startTime)
+            if not None == textOverlay.concatTarget:
+                concatToOverlay(pdfOverlayList, textOverlay.concatTarget, overlayString)
+            else:
+                pdfOverlayList.append({"name": textOverlay.name, "string": overlayString, "param": textOverlay.param})
+        for overlay in pdfOverlayList:
+            startTime = time.perf_counter()
+            getTextLines(None, overlay["string"], overlay["param"])
+            addTime("layout", startTime)
+        #draws the text, with the layouts from the cache, and merges it on the template page
+        startTime = time.perf_counter()
+        pdfData = getOverlayPdfData(benchFiles["pdfFileName"], PDF_FIRST_PAGE, pdfOverlayList, overlayWriter)
+        addTime("merge", startTime)
+        startTime = time.perf_counter()
+        saveOutputFile(os.path.join(outputFolder, f"{recordId['key']}-{recordId['identifier']}.pdf"), pdfData)
+        addTime("write", startTime)
+    for stage in stageTimes.values():
+        stage["seconds"] = round(stage["seconds"], 4)
+    totalSeconds = sum(stage["seconds"] for stage in stageTimes.values())
+    return {"records": len(recordIdList), "stages": stageTimes, "seconds": round(totalSeconds, 4),
+            "recordsPerSecond": round(len(recordIdList) / totalSeconds, 2) if totalSeconds > 0 else None,
+            "peakRssKb": getPeakRss()}
+
+def timeEndToEnd(benchFiles, outputFolder, logLevel, extraArguments=()):
+    """ Run main.py on the batch in a new process.
+    Returns: directory: seconds, records per second, log size and peak RSS of the run"""
+    passwordFileName = os.path.join(benchFiles["folder"], "bench-passwords.txt")
+    commandLine = [sys.executable, MAIN_FILE, benchFiles["sessionFileName"], "--batch", "--output-dir", outputFolder,
+                   "--log-level", logLevel] + list(extraArguments)
+    if not None == benchFiles["password"]:
+        with open(passwordFileName, 'w') as f:
+            f.write(f"{os.path.basename(benchFiles['dataFileName'])}={benchFiles['password']}\n")
+        commandLine.extend(["--password-file", passwordFileName])
+    startTime = time.perf_counter()
+    process = subprocess.Popen(commandLine, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    with process.stdout:
+        logSize = len(process.stdout.read())
+    #os.wait4 gives the resource usage of this run only
+    waitStatus, usage = os.wait4(process.pid, 0)[1:]
+    runTime = time.perf_counter() - startTime
+    returnCode = os.waitstatus_to_exitcode(waitStatus)
+    #the process is reaped, Popen does not have to wait for it
+    process.returncode = returnCode
+    recordCount = benchFiles["settings"]["records"]
+    peakRss = usage.ru_maxrss // 1024 if "Darwin" == platform.system() else usage.ru_maxrss
+    return {"logLevel": logLevel, "returnCode": returnCode, "seconds": round(runTime, 4),
+            "recordsPerSecond": round(recordCount / runTime, 2), "logBytes": logSize, "peakRssKb": peakRss}
+
+def main():
+    """Main Function"""
+    parser = argparse.ArgumentParser(description="Benchmark the stages and the end to end run on a synthetic batch")
+    parser.add_argument("--records", type=int, default=DEFAULT_RECORDS, help="records in the batch")
+    parser.add_argument("--rows", type=int, help="rows in the data workbook (default = records)")
+    parser.add_argument("--columns", type=int, default=DEFAULT_COLUMNS, help="columns in the data workbook")
+    parser.add_argument("--pages", type=int, default=DEFAULT_PAGES, help="pages in the template PDF")
+    parser.add_argument("--page-size", choices=PAGE_SIZE_LIST, default=DEFAULT_PAGE_SIZE, help="page size of the template PDF")
+    parser.add_argument("--encrypt", action="store_true", help="password protect the data workbook")
+    parser.add_argument("--no-end-to-end", action="store_true", help="time the stages only")
+    parser.add_argument("--json", help="write the result to this file")
+    arguments = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workFolder:
+        benchFiles = makeBenchFiles(os.path.join(workFolder, "files"), arguments.records, arguments.rows, arguments.columns,
+                                    arguments.pages, arguments.page_size, BENCH_PASSWORD if arguments.encrypt else None)
+        result = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                  "platform": platform.platform(), "settings": benchFiles["settings"]}
+        stageFolder = os.path.join(workFolder, "stages")
+        os.makedirs(stageFolder)
+        result["stages"] = timeStages(benchFiles, stageFolder)
+        result["endToEnd"] = []
+        if not arguments.no_end_to_end:
+            for logLevel in END_TO_END_LEVEL_LIST:
+                result["endToEnd"].append(timeEndToEnd(benchFiles, os.path.join(workFolder, "out-" + logLevel), logLevel))
+    print(json.dumps(result, indent=4))
+    if not None == arguments.json:
+        with open(arguments.json, 'w') as f:
+            json.dump(result, f, indent=4)
+    return 0 if all(0 == run["returnCode"] for run in result["endToEnd"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,4 +14,7 @@ ERROR_GENERAL_FAILIURE = 8
 ERROR_UNKNOWN = 9
 
 #PDF ERRORS
-ERROR_LONG_TEXT = 20
\ No newline at end of file
+ERROR_LONG_TEXT = 20
+
+#RUN ERRORS
+ERROR_MEMORY_LIMIT = 30
@@ -0,0 +1,12 @@
+""" GUI constants
+    Author: vipulasrilanka@yahoo.com 
+    (c) 2024 """
+
+#status window actions, see showStatus
+MESSAGE_NEW = 1
+MESSAGE_ADD = 2
+MESSAGE_CLEAR = 3
+WINDOW_QUIT = 0
+GET_PASSWORD = 4
+WAIT_FOR_PASSWORD = 5
+RETURN_PASSWORD = 6
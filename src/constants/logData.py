@@ -0,0 +1,10 @@
+""" Logging constants
+    Author: vipulasrilanka@yahoo.com 
+    (c) 2024 """
+
+#log levels. The messages below the level are not formatted
+LOG_DEFAULT_LEVEL = "INFO"
+#--quiet, only the warnings and the errors
+LOG_QUIET_LEVEL = "WARNING"
+LOG_LEVEL_LIST = ("DEBUG", "INFO", "WARNING", "ERROR")
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
@@ -0,0 +1,12 @@
+""" Memory constants
+    Author: vipulasrilanka@yahoo.com
+    (c) 2024 """
+
+MEMORY_MB = 1024 * 1024
+#allocations grouped by the line that made them, and the lines listed for each phase
+MEMORY_TRACE_FRAMES = 1
+MEMORY_TOP_COUNT = 10
+#the records are read one at a time above this share of the memory limit
+MEMORY_THROTTLE_FACTOR = 0.8
+#seconds between the memory checks while the intake waits
+MEMORY_THROTTLE_WAIT = 0.05
@@ -7,6 +7,22 @@ PDF_DEFAULT_FONT = "Helvetica"
 PDF_DEFAULT_FONT_SIZE = 12
 PDF_DEFAULT_LINE_SPACE_FACTOR = 1.2
 PDF_DEFAULT_LINE_SPACE = PDF_DEFAULT_FONT_SIZE * PDF_DEFAULT_LINE_SPACE_FACTOR
+PDF_MIN_FONT_SIZE = 6
+PDF_LAYOUT_CACHE_SIZE = 1024
 MM_PER_INCH = 25.4
 PDF_DPI = 72
-PDF_DPMM = PDF_DPI / MM_PER_INCH
\ No newline at end of file
+PDF_DPMM = PDF_DPI / MM_PER_INCH
+#overlay writers
+PDF_OVERLAY_WRITER_REPORTLAB = "reportlab"
+PDF_OVERLAY_WRITER_DIRECT = "direct"
+PDF_DEFAULT_OVERLAY_WRITER = PDF_OVERLAY_WRITER_REPORTLAB
+#fonts used by the direct overlay writer
+PDF_STREAM_FONT_PREFIX = "/OverlayF"
+PDF_STREAM_FONT_ENCODING = "WinAnsiEncoding"
+PDF_STREAM_TEXT_ENCODING = "cp1252"
+#combined output, file name and pages per file (0 = no split)
+PDF_COMBINED_FILE_NAME = "combined.pdf"
+PDF_COMBINED_SPLIT_PAGES = 0
+PDF_COMBINED_INDEX_SUFFIX = "-index.csv"
+#cache name of the template with the static overlays drawn on it
+PDF_STATIC_TEMPLATE_SUFFIX = "#static"
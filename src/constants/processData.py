@@ -0,0 +1,28 @@
+""" Record processing constants
+    Author: vipulasrilanka@yahoo.com 
+    (c) 2024 """
+
+#number of worker threads used to process records
+PROC_DEFAULT_WORKER_COUNT = 4
+#records waiting in the scheduler queue, per worker
+PROC_QUEUE_SIZE_PER_WORKER = 2
+#worker threads of the record pipeline stages that are not set by the session
+PROC_RESOLVE_WORKER_COUNT = 1
+PROC_DEFAULT_WRITER_COUNT = 2
+
+#record processing modes
+PROC_MODE_THREAD = "thread"
+PROC_MODE_PROCESS = "process"
+PROC_DEFAULT_MODE = PROC_MODE_THREAD
+#records handed to a worker process at a time
+PROC_DEFAULT_SHARD_SIZE = 16
+
+#output modes, one PDF file per record or one PDF for the whole batch
+PROC_OUTPUT_FILES = "files"
+PROC_OUTPUT_COMBINED = "combined"
+PROC_OUTPUT_ZIP = "zip"
+PROC_DEFAULT_OUTPUT_MODE = PROC_OUTPUT_FILES
+
+#zip output, one member per record
+PROC_ZIP_FILE_NAME = "output.zip"
+PROC_ZIP_COMPRESS_LEVEL = 6
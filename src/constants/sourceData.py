@@ -0,0 +1,26 @@
+""" Source file constants
+    Author: vipulasrilanka@yahoo.com 
+    (c) 2024 """
+
+#source file types, by file extension. Other files are opened as excel workbooks
+SOURCE_EXT_CSV = ".csv"
+SOURCE_EXT_SQLITE = (".sqlite", ".db")
+#keys in a single SQLite query, below the host parameter limit
+SOURCE_SQLITE_MAX_KEYS = 500
+#snapshot cache of the loaded source columns, see loadSourceSnapshot
+SOURCE_CACHE_ENABLED = True
+SOURCE_CACHE_FOLDER = "snapshot-cache"
+SOURCE_CACHE_LIMIT = 16 #snapshot files kept, the least recently used are removed
+SOURCE_CACHE_EXTENSION = ".snapshot"
+SOURCE_CACHE_VERSION = 2
+#a snapshot holds all the rows of a data file. With fewer record keys than this, only the
+#rows of the records are loaded, without the snapshot, so a small reprint uses little memory
+SOURCE_CACHE_MIN_KEYS = 1000
+#bytes read at a time to hash the content of a data file for the snapshot key
+SOURCE_CACHE_HASH_BLOCK = 1024 * 1024
+#key derivation for the snapshots of password protected files
+SOURCE_CACHE_KDF_ITERATIONS = 200000
+
+#environment variables with the password of a protected source file. The file name is
+#added in upper case, e.g. PDF_OVERLAY_PASSWORD_EMP01, or no name for all the files
+SOURCE_PASSWORD_ENV = "PDF_OVERLAY_PASSWORD"
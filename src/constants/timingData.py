@@ -0,0 +1,22 @@
+""" Timing constants
+    Author: vipulasrilanka@yahoo.com
+    (c) 2024 """
+
+#spans of the run report. draw includes the layout of the text on the canvas
+TIMING_SOURCE_SNAPSHOT = "sourceSnapshot"
+TIMING_SOURCE_LOAD = "sourceLoad"
+TIMING_LOOKUP = "lookup"
+TIMING_PREPROCESS = "preprocess"
+TIMING_LAYOUT = "layout"
+TIMING_DRAW = "draw"
+TIMING_MERGE = "merge"
+TIMING_SERIALIZE = "serialize"
+TIMING_WRITE = "write"
+TIMING_ZIP = "zip"
+
+#percentiles of each span in the report
+TIMING_PERCENTILE_LIST = (50, 95)
+#slowest records kept for each span
+TIMING_OUTLIER_COUNT = 5
+#the report is written as csv for this extension, and as json for any other
+TIMING_CSV_EXTENSION = ".csv"
@@ -1,43 +1,176 @@
-import threading
-import time
+import logging
 import sys
 import os
+import re
+import argparse
+import itertools
+import time
 from constants.templatedata import TEMPLATE_SHEET_NAME, TEMPLATE_FOLDER_NAME, RECORD_LIST_SHEET_NAME
 from constants.errorcodes import ERROR_FILE_NOT_FOUND, ERROR_SUCCESS, ERROR_FILE_ENCRYPTED, ERROR_UNKNOWN, ERROR_ITEM_NOT_FOUND, ERROR_GENERAL_FAILIURE
-from constants.pdfData import PDF_FIRST_PAGE, PDF_DEFAULT_FONT, PDF_DEFAULT_FONT_SIZE, PDF_DEFAULT_LINE_SPACE
-from projectutils.guifunc import WINDOW_QUIT # Import GUI constants, Window
-from projectutils.guifunc import MESSAGE_NEW, MESSAGE_ADD, MESSAGE_CLEAR # Import GUI constants Message
-from projectutils.guifunc import showStatus, getExcelFileName, getPassword, getPdfFileName  # Import GUI functions
-from projectutils.businessfunc import loadTemplateData, getFilesFromOverlayList, loadRecordIdList
-from projectutils.businessfunc import getStringFromFileObject, concatString, preprocess
-from projectutils.filefunc import openExcelFile, createTempFile, removeFiles
-from projectutils.filefunc import saveSessionData, loadSessionData
-from projectutils.pdfFunc import addOverlayToPdf
+from constants.errorcodes import ERROR_MEMORY_LIMIT
+from constants.pdfData import PDF_FIRST_PAGE, PDF_DEFAULT_FONT, PDF_DEFAULT_FONT_SIZE, PDF_DEFAULT_LINE_SPACE, PDF_DEFAULT_OVERLAY_WRITER
+from constants.pdfData import PDF_COMBINED_FILE_NAME, PDF_COMBINED_SPLIT_PAGES, PDF_COMBINED_INDEX_SUFFIX
+from constants.processData import PROC_DEFAULT_MODE, PROC_MODE_PROCESS, PROC_DEFAULT_SHARD_SIZE
+from constants.processData import PROC_RESOLVE_WORKER_COUNT, PROC_DEFAULT_WRITER_COUNT
+from constants.processData import PROC_DEFAULT_OUTPUT_MODE, PROC_OUTPUT_COMBINED, PROC_OUTPUT_ZIP, PROC_ZIP_FILE_NAME
+from constants.sourceData import SOURCE_CACHE_ENABLED, SOURCE_CACHE_FOLDER, SOURCE_CACHE_LIMIT, SOURCE_CACHE_MIN_KEYS, SOURCE_PASSWORD_ENV
+from constants.logData import LOG_DEFAULT_LEVEL, LOG_QUIET_LEVEL, LOG_LEVEL_LIST, LOG_FORMAT
+from constants.timingData import TIMING_SOURCE_SNAPSHOT, TIMING_SOURCE_LOAD, TIMING_LOOKUP, TIMING_PREPROCESS, TIMING_WRITE, TIMING_ZIP
+from constants.guiData import WINDOW_QUIT # Import GUI constants, Window
+from constants.guiData import MESSAGE_NEW, MESSAGE_ADD, MESSAGE_CLEAR # Import GUI constants Message
+#the GUI functions (tkinter) are imported only when a dialog is needed, see getGuiFunctions
+from projectutils.businessfunc import loadTemplateData, getFilesFromOverlayList, loadRecordIdList, iterRecordIdList
+from projectutils.businessfunc import openTemplateFile, closeTemplateFile
+from projectutils.businessfunc import getStringFromFileObject, concatToOverlay, getSourceColumns, getRecordKeySet
+from projectutils.businessfunc import splitStaticOverlays
+from projectutils.filefunc import loadSourceFile
+from projectutils.filefunc import getSnapshotKey, loadSourceSnapshot, saveSourceSnapshot, filterSourceData
+from projectutils.filefunc import saveSessionData, loadSessionData, saveCombinedIndex, saveOutputFile, loadPasswordFile
+from projectutils.filefunc import openZipOutput, addFileToZip, closeZipOutput, saveTimingReport, saveMemoryReport
+from projectutils.pdfFunc import getOverlayPdfData, preloadPdfTemplate, flattenPdfTemplate, getLayoutCacheInfo
+from projectutils.pdfFunc import takeLayoutCacheCounts, mergeLayoutCacheCounts
+from projectutils.pdfFunc import openCombinedPdf, addRecordToCombinedPdf, closeCombinedPdf
+from projectutils.schedulefunc import PipelineStage, runRecordPipeline, runRecordSerial, runRecordProcessPool, getFailedRecords
+from projectutils.timingfunc import enableTiming, isTimingEnabled, setSpanRecord, startSpan, endSpan
+from projectutils.timingfunc import takeTimingSpans, mergeTimingSpans, getTimingReport, logTimingReport
+from projectutils.memoryfunc import setMemoryLimit, checkMemoryLimit, isMemoryExceeded, iterWithMemoryLimit, getMemoryResultFunc
+from projectutils.memoryfunc import getShardIntake, countRecordsRead
+from projectutils.memoryfunc import startMemoryTrace, isMemoryTraced, addMemoryPhase, getMemoryStageFunc, getMemoryReport, logMemoryReport
+
+logger = logging.getLogger(__name__)
+
+def getArgumentParser():
+    """ Command line arguments. With no arguments the files are selected with dialogs."""
+    parser = argparse.ArgumentParser(description="Overlay text on a PDF file based on the TEMPLATE.xlsx")
+    parser.add_argument("session", nargs="?", help="session file (json) with the file names and the session options")
+    parser.add_argument("--template", help="TEMPLATE.xlsx file")
+    parser.add_argument("--pdf", help="template PDF file")
+    parser.add_argument("--source", action="append", default=[], help="data file used by the template, can be repeated")
+    parser.add_argument("--output-dir", help="folder of the output files (default = current folder)")
+    parser.add_argument("--password-file", help="file with a <data file name>=<password> line for each protected data file")
+    parser.add_argument("--log-level", choices=LOG_LEVEL_LIST, help=f"messages to show (default = {LOG_DEFAULT_LEVEL})")
+    parser.add_argument("--quiet", action="store_true", help=f"show only the warnings and the errors, same as --log-level {LOG_QUIET_LEVEL}")
+    parser.add_argument("--timing-report", help="time the stages of each record, and write the report to this file (.json or .csv)")
+    parser.add_argument("--profile", help="run the records on one thread under cProfile, and write the stats to this file")
+    parser.add_argument("--memory-limit", type=float, help="memory limit of the run in MB. The records are read slower near the limit, "
+                                                               "and the run stops over the limit")
+    parser.add_argument("--memory-report", help="trace the memory of each phase of the run, and write the report to this file (json)")
+    parser.add_argument("--batch", action="store_true",
+                        help=f"never open a dialog. A missing file or password fails the run. Passwords are read from "
+                             f"the password file, or {SOURCE_PASSWORD_ENV}_<FILE NAME> / {SOURCE_PASSWORD_ENV}")
+    return parser
+
+def setupLogging(arguments):
+    """ Set the log level of all the modules from the command line arguments. Messages
+        below the level are dropped before they are formatted."""
+    logLevel = LOG_DEFAULT_LEVEL
+    if arguments.quiet:
+        logLevel = LOG_QUIET_LEVEL
+    if not None == arguments.log_level:
+        logLevel = arguments.log_level
+    logging.basicConfig(level=logLevel, format=LOG_FORMAT, stream=sys.stdout, force=True)
+
+def getGuiFunctions():
+    """ Import the GUI functions on first use, so a batch run never loads tkinter"""
+    import projectutils.guifunc as guifunc
+    return guifunc
 
 def getSessionData(argv):
     """ Get the session data including source file names
     Args:   argv (list) command line arguments list
     Returns: (directory) ordered list of stored data """
-    sessionData = {"error": ERROR_SUCCESS, "rootFolder":None, "sessionFileName": None, "pdfFileName": None,"templateFileName": None,"sourceFiles": []}
+    arguments = getArgumentParser().parse_args(argv[1:])
+    setupLogging(arguments)
+    sessionData = {"error": ERROR_SUCCESS, "rootFolder":None, "sessionFileName": None, "savedSession": {}, "pdfFileName": None,"templateFileName": None,"sourceFiles": [],
+                   "interactive": not arguments.batch, "outputFolder": "", "passwords": {},
+                   "timingReport": arguments.timing_report, "profileFile": arguments.profile,
+                   "memoryLimit": None, "memoryReport": arguments.memory_report,
+                   "workerCount": None, "writerCount": PROC_DEFAULT_WRITER_COUNT, "renderMode": PROC_DEFAULT_MODE, "shardSize": PROC_DEFAULT_SHARD_SIZE,
+                   "overlayWriter": PDF_DEFAULT_OVERLAY_WRITER, "outputMode": PROC_DEFAULT_OUTPUT_MODE,
+                   "combinedFileName": PDF_COMBINED_FILE_NAME, "zipFileName": PROC_ZIP_FILE_NAME, "splitPages": PDF_COMBINED_SPLIT_PAGES,
+                   "keyFilter": True, "sourceCache": {"enabled": SOURCE_CACHE_ENABLED, "folder": SOURCE_CACHE_FOLDER, "limit": SOURCE_CACHE_LIMIT, "refresh": False}}
     sessionData["rootFolder"] = os.path.dirname(os.path.abspath(argv[0]))
-    if len(argv) < 2:
-        #no args, Get sessoin data manually
-        #get the PDF template file name from user
-        sessionData["pdfFileName"] = getPdfFileName("Select PDF file",sessionData["rootFolder"])
-        #get the template file name from user
-        sessionData["templateFileName"] = getExcelFileName("Open Template",sessionData["rootFolder"])
-    else:
-        sessionData["sessionFileName"] = argv[1]
-        print("Using Session File => ", sessionData["sessionFileName"])
+    sessionData["sourceCache"]["folder"] = os.path.join(sessionData["rootFolder"], SOURCE_CACHE_FOLDER)
+    if not None == arguments.session:
+        sessionData["sessionFileName"] = arguments.session
+        logger.info("Using Session File => %s", sessionData["sessionFileName"])
         savedSession = loadSessionData(sessionData["sessionFileName"])
         if isinstance(savedSession,dict):
+            sessionData["savedSession"] = savedSession
             sessionData["pdfFileName"] = savedSession["pdfFileName"] 
             sessionData["templateFileName"] = savedSession["templateFileName"]
             sessionData["sourceFiles"] = savedSession["sourceFiles"]
+            sessionData["workerCount"] = savedSession.get("workerCount")
+            sessionData["writerCount"] = savedSession.get("writerCount", PROC_DEFAULT_WRITER_COUNT)
+            sessionData["renderMode"] = savedSession.get("renderMode", PROC_DEFAULT_MODE)
+            sessionData["shardSize"] = savedSession.get("shardSize", PROC_DEFAULT_SHARD_SIZE)
+            sessionData["overlayWriter"] = savedSession.get("overlayWriter", PDF_DEFAULT_OVERLAY_WRITER)
+            sessionData["outputMode"] = savedSession.get("outputMode", PROC_DEFAULT_OUTPUT_MODE)
+            sessionData["combinedFileName"] = savedSession.get("combinedFileName", PDF_COMBINED_FILE_NAME)
+            sessionData["zipFileName"] = savedSession.get("zipFileName", PROC_ZIP_FILE_NAME)
+            sessionData["splitPages"] = savedSession.get("splitPages", PDF_COMBINED_SPLIT_PAGES)
+            sessionData["keyFilter"] = savedSession.get("keyFilter", True)
+            sessionData["outputFolder"] = savedSession.get("outputFolder", "")
+            sessionData["memoryLimit"] = savedSession.get("memoryLimit")
+            sessionData["sourceCache"] = {"enabled": savedSession.get("sourceCache", SOURCE_CACHE_ENABLED),
+                                          "folder": os.path.join(sessionData["rootFolder"], savedSession.get("sourceCacheFolder", SOURCE_CACHE_FOLDER)),
+                                          "limit": savedSession.get("sourceCacheLimit", SOURCE_CACHE_LIMIT),
+                                          "refresh": savedSession.get("refreshSourceCache", False)}
         else:
             sessionData["error"] = ERROR_UNKNOWN
+            return sessionData
+    #the command line arguments replace the session file
+    if not None == arguments.template:
+        sessionData["templateFileName"] = arguments.template
+    if not None == arguments.pdf:
+        sessionData["pdfFileName"] = arguments.pdf
+    for sourceFile in arguments.source:
+        sourceFileName = os.path.basename(sourceFile)
+        sessionData["sourceFiles"] = [fileData for fileData in sessionData["sourceFiles"] if not sourceFileName == fileData["name"]]
+        sessionData["sourceFiles"].append({"name": sourceFileName, "path": os.path.dirname(os.path.abspath(sourceFile))})
+    if not None == arguments.output_dir:
+        sessionData["outputFolder"] = arguments.output_dir
+    if not None == arguments.memory_limit:
+        sessionData["memoryLimit"] = arguments.memory_limit
+    if not None == arguments.password_file:
+        sessionData["passwords"] = loadPasswordFile(arguments.password_file)
+        if isinstance(sessionData["passwords"], int):
+            sessionData["error"] = sessionData["passwords"]
+            return sessionData
+    #the output files are written to the output folder, unless they have a full path
+    sessionData["combinedFileName"] = os.path.join(sessionData["outputFolder"], sessionData["combinedFileName"])
+    sessionData["zipFileName"] = os.path.join(sessionData["outputFolder"], sessionData["zipFileName"])
+    if None == sessionData["pdfFileName"] or None == sessionData["templateFileName"]:
+        if not sessionData["interactive"]:
+            logger.error("ERROR: The template and the PDF file are needed in the batch mode, use --template and --pdf")
+            sessionData["error"] = ERROR_FILE_NOT_FOUND
+            return sessionData
+        #Get sessoin data manually
+        if None == sessionData["pdfFileName"]:
+            #get the PDF template file name from user
+            sessionData["pdfFileName"] = getGuiFunctions().getPdfFileName("Select PDF file",sessionData["rootFolder"])
+        if None == sessionData["templateFileName"]:
+            #get the template file name from user
+            sessionData["templateFileName"] = getGuiFunctions().getExcelFileName("Open Template",sessionData["rootFolder"])
     return sessionData
 
+def getSourcePassword(sourceFile, sessionData):
+    """ Password of a protected source file. Taken from the password file, then from the
+        environment, and asked from the user only in the interactive mode.
+    Args:   sourceFile (string) file name
+            sessionData (directory) see getSessionData
+    Returns: (string) password, or None"""
+    if sourceFile in sessionData["passwords"]:
+        return sessionData["passwords"][sourceFile]
+    fileEnvName = SOURCE_PASSWORD_ENV + "_" + re.sub(r"[^A-Z0-9]", "_", os.path.splitext(sourceFile)[0].upper())
+    for envName in (fileEnvName, SOURCE_PASSWORD_ENV):
+        if envName in os.environ:
+            return os.environ[envName]
+    if not sessionData["interactive"]:
+        logger.error("ERROR: No password for %s Use --password-file, or set %s", sourceFile, fileEnvName)
+        return None
+    return getGuiFunctions().getPassword(sourceFile)
+
 def getSourcePath (sourceFile, sessionData):
     """Get stored path for a given source file
     Args:   sourceFile (string) file name
@@ -52,7 +185,7 @@ def getSourcePath (sourceFile, sessionData):
 def update_message(messageHolder, action, message, isResetId):
     """Update the message in the holder (first element of the list)."""
     if isinstance(message, str):
-        print(message)
+        logger.debug("%s", message)
     if isResetId:
         messageHolder["id"] = 0
     else:
@@ -61,133 +194,484 @@ def update_message(messageHolder, action, message, isResetId):
     messageHolder["message"] = message
 
 
-def processRecord(messageHolder,FileObjectList,recordID,textOverlayList,PdfTemplateName, PdfTemplatePage, outputFileName):
-    """ Main record proccesor thread.
-        This will each overlay for a given record 
-    Args:   messageHolder (directory): contains the process status
-            FileObjectList(list): list of directories with file names and mapping objects
+def buildOverlayList(FileObjectList,recordID,textOverlayList):
+    """ Get the text of each overlay for a given record
+    Args:   FileObjectList(list): list of directories with file names and mapping objects
             recordID (int): Record ID
-            textOverlayList (list): directories with ordered overlay list
-            PdfTemplateName (string) name of the PDF template
-            outputFileName (string) name of the output file"""
-    print("+Fn processRecord : ",recordID["identifier"])
+            textOverlayList (tuple): compiled overlay plan, see loadTemplateData
+    Returns: list: directories with name, string and param, or error code"""
     pdfOverlayList= []
-    update_message(messageHolder, MESSAGE_NEW, "Status updated: Start...",False)
     for textOverlay in textOverlayList:
-        overlayName = textOverlay["name"]
-        if None == overlayName:
-            print("Error - Bad overlay")
-            return ERROR_UNKNOWN
-        if "File" == textOverlay["content"]["Type"]:
+        content = textOverlay.content
+        if "File" == content.type:
             #Not an immidiate string
-            print("Text from File")
-            overlayString = getStringFromFileObject(textOverlay["content"]["File"],FileObjectList,textOverlay["content"]["Sheet"],recordID["key"],textOverlay["content"]["PrimeryKey"],textOverlay["content"]["Value"])
+            logger.debug("Text from File")
+            spanStart = startSpan()
+            overlayString = getStringFromFileObject(content.file,FileObjectList,content.sheet,recordID["key"],content.keyCol,content.valueCol)
+            endSpan(TIMING_LOOKUP, spanStart)
             if not isinstance(overlayString, str):
                 # Error returned by the function
-                print("ERROR: Can not find the primery key.!")
+                logger.error("ERROR: Can not find the primery key.!")
                 return ERROR_ITEM_NOT_FOUND
         else:
             #an immidiate string
-            print("Immidiate string")
-            overlayString = textOverlay["content"]["Text"]
+            logger.debug("Immidiate string")
+            overlayString = content.text
         #check if we have preproc
-        if not None == textOverlay["preProcess"]:
-            overlayString = preprocess(overlayString,textOverlay["preProcess"])
+        if not None == textOverlay.preProcess:
+            spanStart = startSpan()
+            overlayString = textOverlay.preProcess(overlayString)
+            endSpan(TIMING_PREPROCESS, spanStart)
         #is this a text to add to an existing line?
-        if overlayName.startswith("!<CONCAT>"):
-            print("* => Concatnate")
-            concatString(pdfOverlayList,overlayName,overlayString)
+        if not None == textOverlay.concatTarget:
+            logger.debug("* => Concatnate")
+            concatToOverlay(pdfOverlayList,textOverlay.concatTarget,overlayString)
         else:
-            print("overlayString ["+ overlayName +"] = "+ str(overlayString))
-            pdfOverlayList.append({"name":overlayName,"string":overlayString,"param":textOverlay["param"]})
+            logger.debug("overlayString [%s] = %s", textOverlay.name, overlayString)
+            pdfOverlayList.append({"name":textOverlay.name,"string":overlayString,"param":textOverlay.param})
+    return pdfOverlayList
+
+def processRecord(messageHolder,FileObjectList,recordID,textOverlayList,PdfTemplateName, PdfTemplatePage, outputFileName, overlayWriter=PDF_DEFAULT_OVERLAY_WRITER):
+    """ Main record proccesor thread.
+        This will each overlay for a given record 
+    Args:   messageHolder (directory): contains the process status
+            FileObjectList(list): list of directories with file names and mapping objects
+            recordID (int): Record ID
+            textOverlayList (tuple): compiled overlay plan, see loadTemplateData
+            PdfTemplateName (string) name of the PDF template
+            outputFileName (string) name of the output file
+            overlayWriter (string) how the overlay text is written to the page, see addOverlayToPdf"""
+    logger.debug("+Fn processRecord : %s", recordID["identifier"])
+    setRecordSpans(recordID)
+    update_message(messageHolder, MESSAGE_NEW, "Status updated: Start...",False)
+    pdfOverlayList = buildOverlayList(FileObjectList,recordID,textOverlayList)
+    if not isinstance(pdfOverlayList, list):
+        return pdfOverlayList
     update_message(messageHolder, MESSAGE_ADD, "Creating PDF File ",False)
-    if ERROR_SUCCESS == addOverlayToPdf(PdfTemplateName, PdfTemplatePage, outputFileName, pdfOverlayList):
-        print("created PDF", outputFileName)
+    returnValue = getOverlayPdfData(PdfTemplateName, PdfTemplatePage, pdfOverlayList, overlayWriter)
+    if isinstance(returnValue, bytes):
+        spanStart = startSpan()
+        returnValue = saveOutputFile(outputFileName, returnValue)
+        endSpan(TIMING_WRITE, spanStart)
+    if ERROR_SUCCESS == returnValue:
+        logger.debug("created PDF %s", outputFileName)
         update_message(messageHolder, MESSAGE_ADD, "Done..! ",False)
     else:
-        print("ERRROR [processRecord] PDF file creation error.")
+        logger.error("ERRROR [processRecord] PDF file creation error.")
         update_message(messageHolder, MESSAGE_ADD, "PDF file creation error",False)
     update_message(messageHolder, WINDOW_QUIT, None,False)  # This should close the status window
+    return returnValue
+
+def getOutputFileName(recordId):
+    """ Output file name of a record, Primary Key - Identifier"""
+    return str(recordId["key"])+"-"+str(recordId["identifier"])+".pdf"
+
+def setRecordSpans(recordId):
+    """ Name the record of the timing spans on this thread, when the timing is on"""
+    if isTimingEnabled():
+        setSpanRecord(getOutputFileName(recordId))
+
+#data loaded once by each worker process, see initRecordWorker
+workerContext = {}
+
+def initRecordWorker(fileObjectList, textOverlayList, PdfTemplateName, overlayWriter, outputMode, staticOverlayList=(), outputFolder="", timing=None):
+    """ Worker start up. Keep the overlay list and the source indexes, and load the
+        template PDF once for all the records of this process. The static overlays are
+        drawn on the template page here, see splitStaticOverlays. timing turns the timing
+        spans on or off in a worker process, None leaves them as they are."""
+    if not None == timing:
+        #drops the spans copied from the main process
+        enableTiming(timing)
+    workerContext["outputFolder"] = outputFolder
+    workerContext["fileObjectList"] = fileObjectList
+    workerContext["textOverlayList"] = textOverlayList
+    workerContext["staticOverlayList"] = staticOverlayList
+    workerContext["pdfFileName"] = PdfTemplateName
+    workerContext["overlayWriter"] = overlayWriter
+    workerContext["outputMode"] = outputMode
+    preloadPdfTemplate(PdfTemplateName)
+    if len(staticOverlayList) > 0:
+        staticTemplateName = ERROR_UNKNOWN
+        pdfOverlayList = buildOverlayList(fileObjectList, None, staticOverlayList)
+        if isinstance(pdfOverlayList, list):
+            staticTemplateName = flattenPdfTemplate(PdfTemplateName, PDF_FIRST_PAGE, pdfOverlayList, overlayWriter)
+        if isinstance(staticTemplateName, str):
+            workerContext["pdfFileName"] = staticTemplateName
+        else:
+            logger.warning("Warning: Can not draw the static overlays on the template, draw them with each record")
+            workerContext["textOverlayList"] = staticOverlayList + textOverlayList
+            workerContext["staticOverlayList"] = ()
+
+def processRecordWorker(recordId):
+    """ Process a record on a worker thread or process. For the combined output the
+        worker returns the overlay list, and the page is added by the main thread.
+    Returns: (directory) with "record", "error" and "overlayList" """
+    outputFileName = getOutputFileName(recordId)
+    logger.debug("Processing [%s]", outputFileName)
+    setRecordSpans(recordId)
+    result = {"record": recordId, "error": ERROR_SUCCESS, "overlayList": None}
+    try:
+        if PROC_OUTPUT_COMBINED == workerContext["outputMode"]:
+            result["overlayList"] = buildOverlayList(workerContext["fileObjectList"],recordId,workerContext["textOverlayList"])
+            if not isinstance(result["overlayList"], list):
+                result["error"] = result["overlayList"]
+        elif PROC_OUTPUT_ZIP == workerContext["outputMode"]:
+            #the rendered file goes back to the main process, to add to the zip
+            result["error"] = resolveRecordStage(result)
+            if ERROR_SUCCESS == result["error"]:
+                result["error"] = renderRecordStage(result)
+        else:
+            messageHolder = {"id": 0, "action": MESSAGE_CLEAR, "message": None}
+            result["error"] = processRecord(messageHolder,workerContext["fileObjectList"],recordId,workerContext["textOverlayList"],
+                                            workerContext["pdfFileName"],PDF_FIRST_PAGE,
+                                            os.path.join(workerContext["outputFolder"], outputFileName),workerContext["overlayWriter"])
+    except Exception as e:
+        logger.error("Error: %s", e)
+        result["error"] = ERROR_UNKNOWN
+    if isTimingEnabled():
+        #the spans of the worker process are added to the report by the main process
+        result["timing"] = takeTimingSpans()
+    #the layout cache of a worker process is counted by the main process
+    result["layoutCache"] = takeLayoutCacheCounts()
+    return result
+
+def resolveRecordStage(result):
+    """ Pipeline stage: get the overlay text of the record, with the preprocessors applied"""
+    logger.debug("Processing [%s]", getOutputFileName(result["record"]))
+    setRecordSpans(result["record"])
+    result["overlayList"] = buildOverlayList(workerContext["fileObjectList"],result["record"],workerContext["textOverlayList"])
+    if not isinstance(result["overlayList"], list):
+        return result["overlayList"]
     return ERROR_SUCCESS
 
+def renderRecordStage(result):
+    """ Pipeline stage: lay out and draw the overlay text on the template page"""
+    setRecordSpans(result["record"])
+    pdfData = getOverlayPdfData(workerContext["pdfFileName"], PDF_FIRST_PAGE, result.pop("overlayList"), workerContext["overlayWriter"])
+    if not isinstance(pdfData, bytes):
+        logger.error("ERRROR [renderRecordStage] PDF file creation error.")
+        return pdfData
+    result["pdfData"] = pdfData
+    return ERROR_SUCCESS
+
+def writeRecordStage(result):
+    """ Pipeline stage: write the output file of the record. The writers have their own
+        threads, so the render workers do not wait for the output folder."""
+    setRecordSpans(result["record"])
+    spanStart = startSpan()
+    returnValue = saveOutputFile(os.path.join(workerContext["outputFolder"], getOutputFileName(result["record"])), result.pop("pdfData"))
+    endSpan(TIMING_WRITE, spanStart)
+    return returnValue
+
+def getRecordStageList(sessionData):
+    """ Stages of the record pipeline. For the combined output the pages are added
+        by the main thread, in the order of the record list, and for the zip output
+        the main thread adds the rendered files to the zip."""
+    stageList = [PipelineStage("resolve", resolveRecordStage, PROC_RESOLVE_WORKER_COUNT)]
+    if not PROC_OUTPUT_COMBINED == sessionData["outputMode"]:
+        stageList.append(PipelineStage("render", renderRecordStage, sessionData["workerCount"]))
+    if not sessionData["outputMode"] in (PROC_OUTPUT_COMBINED, PROC_OUTPUT_ZIP):
+        stageList.append(PipelineStage("write", writeRecordStage, sessionData["writerCount"]))
+    if isMemoryTraced():
+        stageList = [PipelineStage(stage.name, getMemoryStageFunc(stage.name, stage.stageFunc), stage.workerCount) for stage in stageList]
+    return stageList
+
+def getCombinedResultFunc(combinedPdf, sessionData):
+    """ Returns a result function that adds the pages to the combined output in the
+        order of the record list. Results that complete early wait in a buffer."""
+    pendingResults = {}
+    nextSequence = 0
+    def addCombinedResult(result):
+        nonlocal nextSequence
+        pendingResults[result["record"]["sequence"]] = result
+        while nextSequence in pendingResults:
+            result = pendingResults.pop(nextSequence)
+            nextSequence = nextSequence + 1
+            if ERROR_SUCCESS == result["error"]:
+                setRecordSpans(result["record"])
+                result["error"] = addRecordToCombinedPdf(combinedPdf, result["record"], workerContext["pdfFileName"], PDF_FIRST_PAGE,
+                                                         result["overlayList"], sessionData["overlayWriter"])
+            #the overlay list is not needed any more
+            result["overlayList"] = None
+            reportRecordResult(result)
+    return addCombinedResult
+
+def getZipResultFunc(zipOutput):
+    """ Returns a result function that adds the rendered file of each record to the zip
+        output, as the records complete."""
+    def addZipResult(result):
+        if ERROR_SUCCESS == result["error"]:
+            setRecordSpans(result["record"])
+            spanStart = startSpan()
+            result["error"] = addFileToZip(zipOutput, getOutputFileName(result["record"]), result.pop("pdfData"))
+            endSpan(TIMING_ZIP, spanStart)
+            if not ERROR_SUCCESS == result["error"]:
+                result["stage"] = "zip"
+        reportRecordResult(result)
+    return addZipResult
+
+def getLayoutCacheResultFunc(resultFunc):
+    """ Returns a result function that adds the layout cache hits and misses of a worker
+        process to the counts of this process, and passes the result on to resultFunc."""
+    def addLayoutCacheResult(result):
+        mergeLayoutCacheCounts(result.pop("layoutCache"))
+        resultFunc(result)
+    return addLayoutCacheResult
+
+def getTimingResultFunc(resultFunc):
+    """ Returns a result function that adds the timing spans of a worker process to the
+        spans of this process, and passes the result on to resultFunc."""
+    def addTimingResult(result):
+        mergeTimingSpans(result.pop("timing"))
+        resultFunc(result)
+    return addTimingResult
+
+def saveRunTiming(sessionData, recordCount, failedCount, runSeconds):
+    """ Log the timing report of the run, and save it to the report file"""
+    spanReport = getTimingReport()
+    logTimingReport(spanReport)
+    report = {"records": recordCount, "failed": failedCount, "seconds": round(runSeconds, 6),
+              "renderMode": sessionData["renderMode"], "outputMode": sessionData["outputMode"],
+              "overlayWriter": sessionData["overlayWriter"], "spans": spanReport}
+    if ERROR_SUCCESS == saveTimingReport(sessionData["timingReport"], report):
+        logger.info("Timing report => %s", sessionData["timingReport"])
+    else:
+        logger.error("ERROR: Can not write the timing report %s", sessionData["timingReport"])
+
+def saveRunMemory(sessionData):
+    """ Log the memory report of the run, and save it to the report file"""
+    report = getMemoryReport()
+    logMemoryReport(report)
+    if None == sessionData["memoryReport"]:
+        return
+    if ERROR_SUCCESS == saveMemoryReport(sessionData["memoryReport"], report):
+        logger.info("Memory report => %s", sessionData["memoryReport"])
+    else:
+        logger.error("ERROR: Can not write the memory report %s", sessionData["memoryReport"])
+
+def reportRecordResult(result):
+    """ Print the status of a completed record"""
+    outputFileName = getOutputFileName(result["record"])
+    if ERROR_SUCCESS == result["error"]:
+        logger.info("Done [%s]", outputFileName)
+    else:
+        logger.error("ERROR: Failed [%s] error code %s at %s", outputFileName, result["error"], result.get("stage", "process"))
+
 def main():
     """Main Function"""
     #create place holders for session variables
     sessionData = getSessionData(sys.argv)
     if not sessionData["error"] == ERROR_SUCCESS:
-        print("ERROR: Can not load session data.")
+        logger.error("ERROR: Can not load session data.")
+        exit(ERROR_GENERAL_FAILIURE)
+    if None == sessionData["profileFile"]:
+        return processBatch(sessionData)
+    #loaded only by the profiled runs
+    import cProfile
+    profile = cProfile.Profile()
+    returnValue = profile.runcall(processBatch, sessionData)
+    profile.dump_stats(sessionData["profileFile"])
+    logger.info("Profile => %s", sessionData["profileFile"])
+    return returnValue
+
+def processBatch(sessionData):
+    """ Load the template and the source files, and process the records
+    Args:   sessionData (directory) see getSessionData
+    Returns: int: Error codes"""
+    runStartTime = time.perf_counter()
+    if not None == sessionData["timingReport"]:
+        enableTiming(True)
+    if not None == sessionData["memoryReport"]:
+        startMemoryTrace()
+    if not setMemoryLimit(sessionData["memoryLimit"]) or not sessionData["memoryLimit"]:
+        #no limit (None or 0), or the memory of the run can not be read and the run goes on without it
+        sessionData["memoryLimit"] = None
+    #the template is read once, for the overlay list and the record list
+    templateBook = openTemplateFile(sessionData["templateFileName"])
+    if isinstance(templateBook,int):
+        logger.error("ERROR: Check the template file")
         exit(ERROR_GENERAL_FAILIURE)
-    #get Recoed ID list
-    recordIDList = loadRecordIdList(sessionData["templateFileName"],RECORD_LIST_SHEET_NAME)
     #get the overlay list
-    textOverlayList = loadTemplateData(sessionData["templateFileName"],TEMPLATE_SHEET_NAME)
+    textOverlayList = loadTemplateData(templateBook,TEMPLATE_SHEET_NAME)
     #check errors and exit
-    if isinstance(textOverlayList,int) or  isinstance(recordIDList,int):
-        print("ERROR: Check the template file")
+    if isinstance(textOverlayList,int):
+        logger.error("ERROR: Check the template file")
         exit(ERROR_GENERAL_FAILIURE)
-    if isinstance(recordIDList, list) and len(recordIDList) < 1:
+    #get Recoed ID list. Without the key filter, the records are read while they are processed
+    if sessionData["keyFilter"]:
+        recordIDList = loadRecordIdList(templateBook,RECORD_LIST_SHEET_NAME)
+        #only the rows of the records to process are loaded from the source files
+        recordKeySet = getRecordKeySet(recordIDList)
+    else:
+        recordIDList = iterRecordIdList(templateBook,RECORD_LIST_SHEET_NAME)
+        recordKeySet = None
+    firstRecord = next(iter(recordIDList), None)
+    if None == firstRecord:
         # there are no records to process
-        print("ERROR: can not find records to process. Check the template file")
+        logger.error("ERROR: can not find records to process. Check the template file")
         exit(ERROR_GENERAL_FAILIURE)
+    if not isinstance(recordIDList, list):
+        recordIDList = itertools.chain([firstRecord], recordIDList)
+    if isMemoryTraced():
+        addMemoryPhase("template")
     #get the file list
     fileNameList = getFilesFromOverlayList(textOverlayList)
     #get File Object list
-    tempFileList = []
     fileObjectList = []
-    tempFileIndex = 1 #Keep track on files
+    sourceCache = sessionData["sourceCache"]
+    if not None == recordKeySet and len(recordKeySet) < SOURCE_CACHE_MIN_KEYS:
+        logger.info("Loading the rows of [ %s ] keys without the snapshot cache", len(recordKeySet))
+        sourceCache = None
     for sourceFile in fileNameList:
         #create the variable to save the file path
         sourceFilePath = getSourcePath(sourceFile, sessionData)
         sourceFileFullPath = os.path.join(sourceFilePath,sourceFile)
+        sourceColumns = getSourceColumns(sourceFile, textOverlayList)
+        password = None
+        snapshotKey = getSnapshotKey(sourceCache, sourceFileFullPath, sourceColumns)
+        snapshotMissing = None == snapshotKey
         while(1):
-            returnValue = openExcelFile(sourceFileFullPath)
+            returnValue = {"error": ERROR_FILE_NOT_FOUND, "object": None}
+            if not snapshotMissing:
+                #use the snapshot of the columns if the file did not change since the last run
+                spanStart = startSpan()
+                returnValue = loadSourceSnapshot(sourceCache, snapshotKey, password)
+                if ERROR_FILE_ENCRYPTED == returnValue["error"]:
+                    #the snapshot is loaded again with the password, only that load is timed
+                    password = getSourcePassword(sourceFile, sessionData)
+                    if None == password:
+                        #same as the data file without the snapshot
+                        logger.debug("Fn: Main => No password for %s", sourceFile)
+                        return ERROR_FILE_ENCRYPTED
+                    continue
+                endSpan(TIMING_SOURCE_SNAPSHOT, spanStart, sourceFile)
+                snapshotMissing = not ERROR_SUCCESS == returnValue["error"]
+            if not ERROR_SUCCESS == returnValue["error"]:
+                #a snapshot has all the rows, without the cache only the rows of the records are loaded
+                spanStart = startSpan()
+                returnValue = loadSourceFile(sourceFileFullPath, sourceColumns, recordKeySet if None == snapshotKey else None, password)
+                if not (ERROR_FILE_ENCRYPTED == returnValue["error"] and None == password):
+                    endSpan(TIMING_SOURCE_LOAD, spanStart, sourceFile)
+                if ERROR_SUCCESS == returnValue["error"]:
+                    saveSourceSnapshot(sourceCache, snapshotKey, returnValue["object"], password)
             if ERROR_SUCCESS == returnValue["error"]:
+                if not None == snapshotKey:
+                    returnValue["object"] = filterSourceData(returnValue["object"], recordKeySet)
                 fileObjectList.append({"name": sourceFile, "path": sourceFilePath, "object": returnValue["object"]})
+                #the data files are held for the whole run, stop before the records if they do not fit
+                if not checkMemoryLimit("sourceLoad " + sourceFile):
+                    saveRunMemory(sessionData)
+                    return ERROR_MEMORY_LIMIT
                 break
             elif ERROR_FILE_NOT_FOUND == returnValue["error"]:
-                sourceFileFullPath = getExcelFileName(f"Open {sourceFile}",sessionData["rootFolder"])
+                if not sessionData["interactive"]:
+                    logger.error("ERROR: Can not find %s Use --source to give the path", sourceFileFullPath)
+                    return ERROR_FILE_NOT_FOUND
+                sourceFileFullPath = getGuiFunctions().getExcelFileName(f"Open {sourceFile}",sessionData["rootFolder"])
                 #update the source file path we got from user
                 sourceFilePath = os.path.dirname(os.path.abspath(sourceFileFullPath))
+                snapshotKey = getSnapshotKey(sourceCache, sourceFileFullPath, sourceColumns)
+                snapshotMissing = None == snapshotKey
                 continue
-            elif ERROR_FILE_ENCRYPTED == returnValue["error"]:
-                password = getPassword(sourceFile)
-                tempFileName = "~temp~"+str(tempFileIndex)+".xlsx"
-                if ERROR_SUCCESS != createTempFile(sourceFileFullPath,password,tempFileName):
-                    print("Fn: Main => Can not create file. unknown Error")
-                    return ERROR_UNKNOWN
-                sourceFileFullPath = tempFileName
-                tempFileList.append({"delete":True, "name": tempFileName})
-                tempFileIndex = tempFileIndex + 1
+            elif ERROR_FILE_ENCRYPTED == returnValue["error"] and None == password:
+                #the file is decrypted in memory with the password
+                password = getSourcePassword(sourceFile, sessionData)
+                if None == password:
+                    return ERROR_FILE_ENCRYPTED
                 continue
             else:
                 return ERROR_UNKNOWN
-    #save the settings
-    sessionData["sessionFileName"] = os.path.join(sessionData["rootFolder"],"session.json")
-    if not sessionData["sessionFileName"] == None:
-        #save the session.
-        saveSessionData(sessionData["sessionFileName"], sessionData["pdfFileName"], sessionData["templateFileName"], fileObjectList)
-    print ("Start Processing [", len(recordIDList) , "] records")
-    for recordId in recordIDList:
-        messageHolder = {"id": 0, "action": MESSAGE_CLEAR, "message": None}
-        #update_message(messageHolder,MESSAGE_NEW,templateFileName,True)
-        #windowName = "Status of Record ID = [" + str(recordId["identifier"]) + "]"
-        outputFileName = str(recordId["key"])+"-"+str(recordId["identifier"])+".pdf"
-        print("Processing ["+ outputFileName + "]")
-        # Start a background thread to simulate message updates
-        thread = threading.Thread(target=processRecord, args=(messageHolder,fileObjectList,recordId,textOverlayList,sessionData["pdfFileName"],PDF_FIRST_PAGE,outputFileName))
-        thread.daemon = True  # Daemon thread will close with the main program
-        thread.start()
-        # Run the Tkinter GUI (must run in the main thread)
-        #showStatus(messageHolder, windowName) #disable for now. There is a bug/unknown
-        while thread.is_alive():
-            print("Thread is still running...")
-            time.sleep(1)
-        print("Thread has finished.")
-    #we are done, so delete the temp files.  
-    removeFiles(tempFileList)
+    if isMemoryTraced():
+        addMemoryPhase("sourceLoad")
+    #save the files selected by the user for the next run, the batch runs do not change the session
+    if sessionData["interactive"]:
+        sessionData["sessionFileName"] = os.path.join(sessionData["rootFolder"],"session.json")
+        saveSessionData(sessionData["sessionFileName"], sessionData["savedSession"], sessionData["pdfFileName"], sessionData["templateFileName"], fileObjectList)
+    logger.info("Start Processing [ %s ] records", len(recordIDList) if isinstance(recordIDList, list) else "all")
+    #parse the template PDF once, the records get a copy of the page
+    if not ERROR_SUCCESS == preloadPdfTemplate(sessionData["pdfFileName"]):
+        logger.error("ERROR: Can not open the PDF file %s", sessionData["pdfFileName"])
+        return ERROR_FILE_NOT_FOUND
+    #the overlays that are the same for every record are drawn on the template once
+    staticOverlayList, recordOverlayList = splitStaticOverlays(textOverlayList)
+    initRecordWorker(fileObjectList, recordOverlayList, sessionData["pdfFileName"], sessionData["overlayWriter"],
+                     sessionData["outputMode"], staticOverlayList, sessionData["outputFolder"])
+    workerArgs = (fileObjectList, workerContext["textOverlayList"], sessionData["pdfFileName"], sessionData["overlayWriter"],
+                  sessionData["outputMode"], workerContext["staticOverlayList"], sessionData["outputFolder"], isTimingEnabled())
+    if isMemoryTraced():
+        addMemoryPhase("pdfTemplate")
+    if not "" == sessionData["outputFolder"]:
+        os.makedirs(sessionData["outputFolder"], exist_ok=True)
+    resultFunc = reportRecordResult
+    if PROC_OUTPUT_COMBINED == sessionData["outputMode"]:
+        combinedPdf = openCombinedPdf(sessionData["combinedFileName"], sessionData["splitPages"])
+        resultFunc = getCombinedResultFunc(combinedPdf, sessionData)
+    elif PROC_OUTPUT_ZIP == sessionData["outputMode"]:
+        zipOutput = openZipOutput(sessionData["zipFileName"])
+        if isinstance(zipOutput, int):
+            return ERROR_GENERAL_FAILIURE
+        resultFunc = getZipResultFunc(zipOutput)
+    intakeFunc = None
+    if not None == sessionData["memoryLimit"]:
+        resultFunc = getMemoryResultFunc(resultFunc)
+        if PROC_MODE_PROCESS == sessionData["renderMode"] and None == sessionData["profileFile"]:
+            #the process pool sends the shards of records as the memory of the run allows
+            recordIDList = countRecordsRead(recordIDList)
+            intakeFunc = getShardIntake
+        else:
+            #the records are read as the memory of the run allows
+            recordIDList = iterWithMemoryLimit(recordIDList)
+    try:
+        if not None == sessionData["profileFile"]:
+            #cProfile follows only this thread, so the stages run here one record at a time
+            recordCount, failedList = runRecordSerial(recordIDList, getRecordStageList(sessionData), resultFunc)
+        elif PROC_MODE_PROCESS == sessionData["renderMode"]:
+            if isTimingEnabled():
+                resultFunc = getTimingResultFunc(resultFunc)
+            resultFunc = getLayoutCacheResultFunc(resultFunc)
+            #each worker process gets a copy of the loaded columns and indexes
+            resultList = runRecordProcessPool(recordIDList, processRecordWorker, initRecordWorker, workerArgs,
+                                              sessionData["workerCount"], resultFunc, sessionData["shardSize"], intakeFunc)
+            recordCount, failedList = len(resultList), getFailedRecords(resultList)
+        else:
+            #stream the records through the stages. Only the failed results are kept
+            recordCount, failedList = runRecordPipeline(recordIDList, getRecordStageList(sessionData), resultFunc)
+    except Exception as e:
+        #the stages catch their own errors, this is the record list failing while it is read
+        logger.error("ERROR: Can not read the records, the run is stopped: %s", e)
+        closeTemplateFile(templateBook)
+        return ERROR_GENERAL_FAILIURE
+    if isMemoryTraced():
+        addMemoryPhase("records")
+    #all the records are read
+    closeTemplateFile(templateBook)
+    if PROC_OUTPUT_COMBINED == sessionData["outputMode"]:
+        if not ERROR_SUCCESS == closeCombinedPdf(combinedPdf):
+            logger.error("ERROR: Can not write the combined PDF %s", sessionData["combinedFileName"])
+            return ERROR_GENERAL_FAILIURE
+        indexFileName = os.path.splitext(sessionData["combinedFileName"])[0] + PDF_COMBINED_INDEX_SUFFIX
+        saveCombinedIndex(indexFileName, combinedPdf["index"])
+    elif PROC_OUTPUT_ZIP == sessionData["outputMode"]:
+        if not ERROR_SUCCESS == closeZipOutput(zipOutput):
+            return ERROR_GENERAL_FAILIURE
+    logger.info("Processed [ %s ] records, [ %s ] failed", recordCount, len(failedList))
+    for result in failedList:
+        logger.warning("Failed [ %s ] error code %s at %s", getOutputFileName(result["record"]), result["error"], result.get("stage", "process"))
+    layoutCacheInfo = getLayoutCacheInfo()
+    if layoutCacheInfo.hits + layoutCacheInfo.misses > 0:
+        #the worker processes keep their own layout cache, their counts are added with the results
+        logger.info("Layout cache [ %s ] hits, [ %s ] misses", layoutCacheInfo.hits, layoutCacheInfo.misses)
+    if isTimingEnabled():
+        saveRunTiming(sessionData, recordCount, len(failedList), time.perf_counter() - runStartTime)
+    if isMemoryTraced() or not None == sessionData["memoryLimit"]:
+        saveRunMemory(sessionData)
+    if isMemoryExceeded():
+        return ERROR_MEMORY_LIMIT
+    if len(failedList) > 0:
+        return ERROR_GENERAL_FAILIURE
     return ERROR_SUCCESS
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
@@ -4,24 +4,62 @@
     Author: vipulasrilanka@yahoo.com 
     (c) 2024 """
 
-import openpyxl
+import logging
 import os
 import re
-from num2words import num2words
+from collections import namedtuple
+from functools import partial
 from datetime import datetime
 
 from constants.errorcodes import ERROR_SUCCESS, ERROR_UNKNOWN, ERROR_NULL_STRING, ERROR_FILE_NOT_FOUND
+from projectutils.pdfFunc import compileOverlayParams
 from constants.templatedata import REC_COL_INDEX, REC_COL_KEY, REC_COL_STR_ID
 from constants.templatedata import TEMP_COL_INDEX, TEMP_COL_NAME, TEMP_COL_CONTENT, TEMP_COL_PARAM, TEMP_COL_PRE_PROC
 from constants.templatedata import TEMP_MIN_STR_DATA_LENGTH
 
+logger = logging.getLogger(__name__)
+
+#compiled overlay plan, one item per row of the Overlay sheet. See loadTemplateData
+OverlayPlanItem = namedtuple("OverlayPlanItem", ["name", "content", "param", "preProcess", "concatTarget"])
+#<Type=Text><Text=...> or <Type=File><File=...><Sheet=...><PrimeryKey=...><Value=...>
+OverlayContent = namedtuple("OverlayContent", ["type", "text", "file", "sheet", "keyCol", "valueCol"])
+
+def getKeyString(value):
+    """ Normalize a primary key to the string used for matching. Keys are matched
+        on their str() value, so 101 and "101" match while 101.0 does not.
+    Args: value (any) : key cell value or record key
+    Returns string: normalized key """
+    return str(value)
+
+def getSourceColumns(fileName,textOverlayList):
+    """Get the sheets and columns of a source file that the overlays read, so only
+       those columns are loaded.
+    Args: fileName (string) : name of the source file
+          textOverlayList (tuple) : compiled overlay plan
+    Returns directory: sheet name => {"keys": key columns, "values": value columns} """
+    sourceColumns = {}
+    for textOverlay in textOverlayList:
+        content = textOverlay.content
+        if "File" == content.type and fileName == content.file:
+            sheetColumns = sourceColumns.setdefault(content.sheet, {"keys": [], "values": []})
+            if content.keyCol not in sheetColumns["keys"]:
+                sheetColumns["keys"].append(content.keyCol)
+            if content.valueCol not in sheetColumns["values"]:
+                sheetColumns["values"].append(content.valueCol)
+    return sourceColumns
+
+def getRecordKeySet(recordIdList):
+    """Get the keys of the records to process, so the source files keep only these rows.
+    Args: recordIdList (list) : records from loadRecordIdList
+    Returns frozenset: normalized keys, see getKeyString """
+    return frozenset(getKeyString(recordId["key"]) for recordId in recordIdList)
+
 def getStringFromFileObject(fileName,fileOjectList,fileSheetName,primeryKey,primeryKeyCol,valueCol):
-    """Get the designated text from excel file object. It will look for the file name in the
-       fileOjectList["name"] and get the file object from fileOjectList["object"]. Open the fileSheetName
-       from the object, and search the primeryKeyCol for primeryKey. If it matches, will return the value 
-       in the valueCol. 
+    """Get the designated text from a source file. It will look for the file name in the
+       fileOjectList["name"] and get the lookup index of fileSheetName and primeryKeyCol for the
+       file. If primeryKey is in the index, will return the value in the valueCol.
     Args: fileName (string) : name of the excel workbook
-          fileOjectList (list) : directory withfile object against the name
+          fileOjectList (list) : directory with source data against the name, see loadExcelSource
           fileSheetName (string) : sheet name in the workbook
           primeryKey (string/number) : matching condition to look for
           primeryKeyCol (string) : the column ID to match
@@ -31,27 +69,22 @@ def getStringFromFileObject(fileName,fileOjectList,fileSheetName,primeryKey,prim
     #go through each file object and look for a match.
     for sourceFile in fileOjectList:
         if(fileName == sourceFile["name"]):
-            workBook = sourceFile["object"]
-            print("extract record id ["+str(primeryKey) +"] from ["+fileName+ "]")
-            sheet = workBook[fileSheetName]
-            # Convert the primaryKeyCol and valueCol to numeric indices
-            primeryKeyColIndex = openpyxl.utils.column_index_from_string(primeryKeyCol)
-            valueColIndex = openpyxl.utils.column_index_from_string(valueCol)
-            print("primeryKeyColIndex ["+ str(primeryKeyColIndex) + "] valueColIndex [" + str(valueColIndex) + "]")
-
-            # Loop through the rows, starting from the second row (assuming row 1 is the header)
-            for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row):
-                # Check if the value in the primaryKeyCol matches the given primaryKey
-                matchString = str(row[primeryKeyColIndex - 1].value)
-                print ("Try: match", matchString, "with", primeryKey)
-                if matchString == str(primeryKey):
-                    # Return the value from the valueCol in the matching row
-                    stringValue = str(row[valueColIndex - 1].value)
-                    print("Found", matchString, " => ", stringValue)
-                    return stringValue
-            # If the primary key isn't found, return Error
-            print("ERROR: Can not find primery key")
-            return ERROR_NULL_STRING
+            logger.debug("extract record id [%s] from [%s]", primeryKey, fileName)
+            sourceData = sourceFile["object"]
+            lookupIndex = sourceData["index"].get((fileSheetName,primeryKeyCol))
+            valueList = sourceData["columns"].get((fileSheetName,valueCol))
+            if None == lookupIndex or None == valueList:
+                logger.error("ERROR: Column not loaded [%s][%s][%s]", fileSheetName, primeryKeyCol, valueCol)
+                return ERROR_NULL_STRING
+            rowNumber = lookupIndex.get(getKeyString(primeryKey))
+            if None == rowNumber:
+                # If the primary key isn't found, return Error
+                logger.error("ERROR: Can not find primery key")
+                return ERROR_NULL_STRING
+            # Return the value from the valueCol in the matching row
+            stringValue = valueList[rowNumber]
+            logger.debug("Found %s => %s", primeryKey, stringValue)
+            return stringValue
 
 def concatString(pdfOverlayList,overlayName,overlayString):
     """ Process string concatnation. This function will get a concantation logic,
@@ -61,84 +94,142 @@ def concatString(pdfOverlayList,overlayName,overlayString):
           overlayName (string) name of the overlay to add "overlayString"
           overlayString (string) the text to add.
     Returns: int: Error code """
+    exString = getConcatTarget(overlayName)
+    if None == exString:
+        return ERROR_UNKNOWN
+    return concatToOverlay(pdfOverlayList,exString,overlayString)
+
+def getConcatTarget(overlayName):
+    """ Returns the name of the overlay to concatnate to, from the format !<CONCAT><STRING>,
+        or None if the name is not in that format."""
     # Define the regex pattern to match the format !<CONCAT><STRING>
     pattern = r"^!<CONCAT><(.+)>$"
     # Use re.match to check if the input string matches the pattern
     match = re.match(pattern, overlayName)
     if match:
         # Extract the text between the second <>
-        exString = match.group(1)
-    else:
-        # If the format is incorrect
-        print("ERROR: The input string does not have the correct format: !<CONCAT><STRING>")
-        return ERROR_UNKNOWN
+        return match.group(1)
+    # If the format is incorrect
+    logger.error("ERROR: The input string does not have the correct format: !<CONCAT><STRING>")
+    return None
+
+def concatToOverlay(pdfOverlayList,exString,overlayString):
+    """ Add overlayString at the end of the text of the overlays named exString
+    Args: pdfOverlayList (list) directory that contains the current overlay list 
+          exString (string) name of the overlay to add "overlayString"
+          overlayString (string) the text to add.
+    Returns: int: Error code """
     for pdfOverlay in pdfOverlayList:
         if pdfOverlay["name"] == exString:
             #found the matching location
-            print ("Concat ["+ overlayString + "] to " + pdfOverlay["name"])
+            logger.debug("Concat [%s] to %s", overlayString, pdfOverlay["name"])
             pdfOverlay["string"] = str(pdfOverlay["string"]) + str(overlayString)
     return ERROR_SUCCESS
 
-def loadTemplateData(templateFile,sheetName):
-    """ Reads the text overlays from the template file.
+def openTemplateFile(templateFile):
+    """ Open the template workbook once, for the overlay plan and the record list. The
+        workbook is read only, the sheets are read row by row. Close it when the records
+        are done, see closeTemplateFile.
     Args: templateFile (string): The template file name
+    Returns: workbook, or error code """
+    #check if the file path is valid
+    if( not os.path.exists(templateFile)):
+        logger.error("Error [openTemplateFile]: Tempate file not found")
+        return ERROR_FILE_NOT_FOUND # error 
+    import openpyxl
+    return openpyxl.load_workbook(templateFile, read_only=True, data_only=True)
+
+def closeTemplateFile(templateBook):
+    """ Close the template workbook"""
+    templateBook.close()
+
+def getRowValue(row, column):
+    """ Returns the value of a column in a row of values. Read only rows can be shorter
+        than the sheet, the missing cells are empty."""
+    return row[column] if len(row) > column else None
+
+def loadTemplateData(templateBook,sheetName):
+    """ Reads the text overlays from the template file, and compiles them in to an
+        overlay plan. The params are converted to points and filled with defaults, and the
+        preprocess functions are bound to their params, so a record only has to get the
+        data and draw it.
+    Args: templateBook (workbook): The template workbook, see openTemplateFile
           sheetName (string): The sheet name with data
-    Returns: list: A list of ordered dictionaries, or error code """
+    Returns: tuple: ordered OverlayPlanItem list, or error code """
 
-    print("+ Fn: loadTemplateData")
+    logger.debug("+ Fn: loadTemplateData")
     # variable to return data
     textOverlayList = [] 
-    #check if the file path is valid
-    if( not os.path.exists(templateFile)):
-        print("Error [loadTemplateData]: Tempate file not found")
-        return ERROR_FILE_NOT_FOUND # error 
-    #open template file, and load the sheet
-    templateBook = openpyxl.load_workbook(templateFile)
     textOverlayDataSheet = templateBook[sheetName]
-    print("Debug [loadTemplateData]: Sheet Size",textOverlayDataSheet.dimensions, textOverlayDataSheet.max_row, " Rows ", textOverlayDataSheet.max_column, " columns")
+    logger.debug("Debug [loadTemplateData]: Sheet Size %s Rows %s columns", textOverlayDataSheet.max_row, textOverlayDataSheet.max_column)
     #go through every text overlay item
-    for overlays in textOverlayDataSheet.rows:
+    for overlays in textOverlayDataSheet.iter_rows(values_only=True):
         #Get the index to a string. Empty cells will be string "None"
-        rowIndex = str(overlays[TEMP_COL_INDEX].value).strip() #ignore space
+        rowIndex = str(getRowValue(overlays, TEMP_COL_INDEX)).strip() #ignore space
         # stop if we reach an empty cell
         if("None" == rowIndex):
             break
         # the index has to be always numbers, skip others
         if( not rowIndex.isdigit()):
-            print("Warning [loadTemplateData]: skip Row Index ["+rowIndex+ "]")
+            logger.debug("Warning [loadTemplateData]: skip Row Index [%s]", rowIndex)
             continue
-        content = str(overlays[TEMP_COL_CONTENT].value).strip() #ignore space
+        content = str(getRowValue(overlays, TEMP_COL_CONTENT)).strip() #ignore space
         #user initiated end of loop.
         if("None" == content):
-            print("Warning [loadTemplateData]: User terminated at Index ["+rowIndex+"]")
+            logger.warning("Warning [loadTemplateData]: User terminated at Index [%s]", rowIndex)
             break
         if(not (content.startswith('<') and content.endswith('>') and len(content) > TEMP_MIN_STR_DATA_LENGTH)):
-            print("Error [loadTemplateData]: Data Error at Index ["+rowIndex+"]")
+            logger.error("Error [loadTemplateData]: Data Error at Index [%s]", rowIndex)
             break
-        param = validateParams(str(overlays[TEMP_COL_PARAM].value).strip())
-        preprocess = validateParams(str(overlays[TEMP_COL_PRE_PROC].value).strip())
+        param = validateParams(str(getRowValue(overlays, TEMP_COL_PARAM)).strip())
+        preprocess = validateParams(str(getRowValue(overlays, TEMP_COL_PRE_PROC)).strip())
         content = validateParams(content)
-        textOverlayList.append({"name": str(overlays[TEMP_COL_NAME].value).strip(), 
-                                "content": content,
-                                "param": param,
-                                "preProcess": preprocess})
         #check the item 2, File locked
-        if "Text" == content["Type"]:
-            print(rowIndex, "overlay type > immidiate text =>", content["Text"])
+        if "Text" == content.get("Type"):
+            logger.debug("%s overlay type > immidiate text => %s", rowIndex, content.get("Text"))
             #Save immidiate text data
-        elif "File" == content["Type"]:
-            print(rowIndex, "overlay type > From file => ", content["File"])
+        elif "File" == content.get("Type"):
+            logger.debug("%s overlay type > From file => %s", rowIndex, content.get("File"))
         else:
-            print(rowIndex, "Error: undefined overlay type : ", content["type"])
+            logger.error("%s Error: undefined overlay type : %s", rowIndex, content.get("Type"))
             break
+        overlayPlanItem = compileOverlay(rowIndex, str(getRowValue(overlays, TEMP_COL_NAME)).strip(), content, param, preprocess)
+        if isinstance(overlayPlanItem, int):
+            return overlayPlanItem
+        if not None == overlayPlanItem:
+            textOverlayList.append(overlayPlanItem)
     # Data store is done. return
-    print("- Fn: loadTemplateData")
-    return textOverlayList
+    logger.debug("- Fn: loadTemplateData")
+    return tuple(textOverlayList)
+
+def compileOverlay(rowIndex, name, content, param, preProcess):
+    """ Compile an overlay row of the template in to an OverlayPlanItem.
+    Args: rowIndex (string): row index, for the error messages
+          name (string): overlay name, or !<CONCAT><name> to add to an overlay
+          content (directory): content of the overlay, see OverlayContent
+          param (directory): params of the overlay, None for a concatnation
+          preProcess (directory): preprocess function, or None
+    Returns: OverlayPlanItem, None to skip the overlay, or error code"""
+    concatTarget = None
+    if name.startswith("!<CONCAT>"):
+        concatTarget = getConcatTarget(name)
+        if None == concatTarget:
+            logger.warning("Warning [loadTemplateData]: skip concatnation at Index [%s]", rowIndex)
+            return None
+        compiledParam = None
+    else:
+        compiledParam = compileOverlayParams(param)
+        if not isinstance(compiledParam, tuple):
+            logger.error("Error [loadTemplateData]: Param Error at Index [%s]", rowIndex)
+            return ERROR_UNKNOWN
+    overlayContent = OverlayContent(content.get("Type"), content.get("Text"), content.get("File"), content.get("Sheet"),
+                                    content.get("PrimeryKey"), content.get("Value"))
+    return OverlayPlanItem(name, overlayContent, compiledParam, getPreprocessFunction(preProcess), concatTarget)
 
 def validateParams(paramString):
     """ Get the param data from the file and break it down to param list.
         return: None if there is no param data."""
-    print("+Fn validateParams (", paramString, ")")
+    logger.debug("+Fn validateParams ( %s )", paramString)
     params = {}
     # Use a regular expression to extract all the <key=value> pairs
     pattern = r"<(.*?)=(.*?)>"
@@ -154,71 +245,101 @@ def validateParams(paramString):
     return params
 
 
+def splitStaticOverlays(textOverlayList):
+    """ Split the overlay plan in to the overlays that are the same for every record, and
+        the overlays that need the record data. An overlay is static when it is a Text
+        overlay, and every text concatnated to it is a Text overlay too.
+        Overlays with a font size that is not a whole number use the font of the overlay
+        drawn before them, so the plan is not split when there is such an overlay.
+    Args: textOverlayList (tuple): compiled overlay plan, see loadTemplateData
+    Returns: tuple: (static overlay plan, record overlay plan) """
+    recordNameList = []
+    for textOverlay in textOverlayList:
+        if textOverlay.concatTarget == None:
+            if not isinstance(textOverlay.param.fontSize, int) and None == textOverlay.param.function:
+                return (), textOverlayList
+            name = textOverlay.name
+        else:
+            name = textOverlay.concatTarget
+        if not "Text" == textOverlay.content.type and name not in recordNameList:
+            recordNameList.append(name)
+    staticOverlayList = []
+    recordOverlayList = []
+    for textOverlay in textOverlayList:
+        name = textOverlay.name if textOverlay.concatTarget == None else textOverlay.concatTarget
+        if name in recordNameList:
+            recordOverlayList.append(textOverlay)
+        else:
+            staticOverlayList.append(textOverlay)
+    logger.debug("[splitStaticOverlays] [ %s ] static, [ %s ] record overlays", len(staticOverlayList), len(recordOverlayList))
+    return tuple(staticOverlayList), tuple(recordOverlayList)
+
 def getFilesFromOverlayList(textOverlayList):
     """ Returns a unique list of file names in the overlay 
         Note: having no files in the list is not an error.
-    Args: textOverlayList (list): list of directories
+    Args: textOverlayList (tuple): compiled overlay plan
     Returns: list: A list of file names, strings """
 
-    print("+ Fn: getFilesFromOverlayList")
+    logger.debug("+ Fn: getFilesFromOverlayList")
     fileNameList = []
     #go through each overlay
     for textOverlay in textOverlayList:
-        if "File" == textOverlay["content"]["Type"]:
+        if "File" == textOverlay.content.type:
             # there is a file attribute
-            filename = textOverlay["content"]["File"]
-            print("Fould a file ", filename)
+            filename = textOverlay.content.file
+            logger.debug("Fould a file %s", filename)
             #check if this file is already in the list
             if filename not in fileNameList:
                 fileNameList.append(filename)
-    print("- Fn: getFilesFromOverlayList")
+    logger.debug("- Fn: getFilesFromOverlayList")
     return fileNameList
 
 
-def loadRecordIdList(templateFile,sheetName):
+def loadRecordIdList(templateBook,sheetName):
     """ loadRecordIdList: This will load the records to process 
-    Args:   templateFile (string): Template file name
+    Args:   templateBook (workbook): The template workbook, see openTemplateFile
             sheetName (string): The sheet name with data
-    Returns: list: a list of directories with keys and identifiers of records or error code """
+    Returns: list: a list of directories with keys, identifiers and sequence numbers of records """
+    logger.debug("+ Fn: loadRecordIdList")
+    return list(iterRecordIdList(templateBook,sheetName))
 
-    print("+ Fn: loadRecordIdList")
-    # variable to return data
-    recordIdList = [] 
-    #check if the file path is valid
-    if( not os.path.exists(templateFile)):
-        print("Error [loadRecordIdList]: Tempate file not found")
-        return ERROR_FILE_NOT_FOUND # error code
-    #open template file, and load the sheet
-    templateBook = openpyxl.load_workbook(templateFile, data_only=True)
+def iterRecordIdList(templateBook,sheetName):
+    """ Reads the records to process one row at a time, so the records can be processed
+        while the rest of the sheet is read. The workbook has to stay open until the
+        last record is read.
+    Args:   templateBook (workbook): The template workbook, see openTemplateFile
+            sheetName (string): The sheet name with data
+    Yields: directory: key, identifier and sequence number of a record """
     recordIdDataSheet = templateBook[sheetName]
-    print("Debug [loadRecordIdList]: Sheet Size",recordIdDataSheet.dimensions, recordIdDataSheet.max_row, " Rows ", recordIdDataSheet.max_column, " columns")
+    logger.debug("Debug [loadRecordIdList]: Sheet Size %s Rows %s columns", recordIdDataSheet.max_row, recordIdDataSheet.max_column)
+    sequence = 0
     #go through every text overlay item
-    for record in recordIdDataSheet.rows:
+    for record in recordIdDataSheet.iter_rows(values_only=True):
         #Get the index to a string. Empty cells will be string "None"
-        rowIndex = str(record[REC_COL_INDEX].value)
-        print(rowIndex)
+        rowIndex = str(getRowValue(record, REC_COL_INDEX))
+        logger.debug("%s", rowIndex)
         # stop if we reach an empty cell
         if("None" == rowIndex):
             break
         # the index has to be always numbers, skip others
         if( not rowIndex.isdigit()):
-            print("Warning [loadRecordIdList]: skip Row Index : ", rowIndex)
+            logger.debug("Warning [loadRecordIdList]: skip Row Index : %s", rowIndex)
             continue
-        primeryKey = str(record[REC_COL_KEY].value)
+        primeryKey = str(getRowValue(record, REC_COL_KEY))
         #user initiated end of loop.
         if("None" == primeryKey):
-            print("Warning [loadRecordIdList]: User terminated at Index : ", rowIndex)
+            logger.warning("Warning [loadRecordIdList]: User terminated at Index : %s", rowIndex)
             break
         if not primeryKey.isdigit():
-            print("Error [primeryKey]: Data Error at Index : ",rowIndex)
+            logger.error("Error [primeryKey]: Data Error at Index : %s", rowIndex)
             break
-        recordIdList.append({"key": int(primeryKey), "identifier": str(record[REC_COL_STR_ID].value)})
-    return recordIdList
+        yield {"key": int(primeryKey), "identifier": str(getRowValue(record, REC_COL_STR_ID)), "sequence": sequence}
+        sequence = sequence + 1
 
 def getNumber(text, type):
     """ getNumber extracts a numeric value from a given text string. """
     if isinstance(text,int) or isinstance(text,float):
-        print("Fn getNumber: input is a number")
+        logger.debug("Fn getNumber: input is a number")
     elif isinstance(text,str):
         match = re.search(r"[\d,]+\.\d+|[\d,]+", str(text))    
         if match:
@@ -231,53 +352,64 @@ def getNumber(text, type):
 def preprocess(text,processList):
     #{'function': {'name': 'AddSpace', 'param1': 'None'}}
     """ Preprocess text string based on the process given"""
-    print("+Fn preprocess Text =>[", text,"]", processList)
-    if "Function" in processList:
-        if "NumberToText" == processList["Function"]["name"]:
-            number = None
-            if "Integer" == processList["Function"]["param2"]:
-                #round off to integer
-                number = getNumber(text,round)
-            elif "Floating Point" == processList["Function"]["param2"]:
-                number = getNumber(text,float)
-            else:
-                #default
-                number = getNumber(text,float)
-            #convert the number to text
-            number = num2words(number,to = 'cardinal')
-            #make the first letter capital, and return as text.
-            return number.capitalize()
-        
-        elif "AddSpace" == processList["Function"]["name"]:
-            count = getNumber(processList["Function"]["param2"],int)
-            return str(text)+ (" " * count)
-        elif "FormatDate" == processList["Function"]["name"]:
-            print("[preprocess][FormatDate][param2]", processList["Function"]["param2"], type(processList["Function"]["param2"]))
-            return formatDate(text,processList["Function"]["param2"])
-        elif "NumberToCurrency" == processList["Function"]["name"]:
-            print("[preprocess][NumberToCurrency][param2]", processList["Function"]["param2"], type(processList["Function"]["param2"]))
-            print("[preprocess][NumberToCurrency][param3]", processList["Function"]["param3"], type(processList["Function"]["param3"]))
-            return getCurrencyString(text,processList["Function"]["param2"],processList["Function"]["param3"])
-        elif "FormatNumber" == processList["Function"]["name"]:
-            print("[preprocess][FormatNumber][param2]", processList["Function"]["param2"], type(processList["Function"]["param2"]))
-            print("[preprocess][FormatNumber][param3]", processList["Function"]["param3"], type(processList["Function"]["param3"]))
-            print("[preprocess][FormatNumber][param4]", processList["Function"]["param4"], type(processList["Function"]["param4"]))
-            return getFormattedNumber(text,processList["Function"]["param2"],processList["Function"]["param3"],processList["Function"]["param4"])
-        elif "changeTextCase" == processList["Function"]["name"]:
-            caseType = processList["Function"]["param2"]
-            print("[preprocess][changeTextCase][param2]", caseType, type(caseType))
-            if("lower" == caseType):
-                return text.lower()
-            elif ("UPPER" == caseType):
-                return text.upper()
-            elif ("Title" == caseType):
-                return text.title()
-            else:
-                print("unsupported Case", caseType)
-                return text
-        else:
-            print("Error [preprocess] Unsupported Pre-process function")
-    return text
+    logger.debug("+Fn preprocess Text =>[ %s ] %s", text, processList)
+    preprocessFunction = getPreprocessFunction(processList)
+    if None == preprocessFunction:
+        return text
+    return preprocessFunction(text)
+
+def getPreprocessFunction(processList):
+    """ Returns the preprocess function with its params bound, so it can be called
+        with the text only. Returns None if there is nothing to do."""
+    if None == processList or not "Function" in processList:
+        return None
+    function = processList["Function"]
+    if not isinstance(function, dict):
+        logger.error("Error [preprocess] Unsupported Pre-process function")
+        return None
+    if "NumberToText" == function["name"]:
+        if "Integer" == function.get("param2"):
+            #round off to integer
+            return partial(numberToText, numberType=round)
+        #default, and "Floating Point"
+        return partial(numberToText, numberType=float)
+    elif "AddSpace" == function["name"]:
+        return partial(addSpace, spaceCount=getNumber(function.get("param2"),int))
+    elif "FormatDate" == function["name"]:
+        return partial(formatDate, format=function.get("param2"))
+    elif "NumberToCurrency" == function["name"]:
+        return partial(getCurrencyString, decimalPoints=function.get("param2"), currency=function.get("param3"))
+    elif "FormatNumber" == function["name"]:
+        return partial(getFormattedNumber, decimalPoints=function.get("param2"), prefix=function.get("param3"), suffix=function.get("param4"))
+    elif "changeTextCase" == function["name"]:
+        return partial(changeTextCase, caseType=function.get("param2"))
+    logger.error("Error [preprocess] Unsupported Pre-process function")
+    return None
+
+def numberToText(text, numberType):
+    """ Returns the number in text in words, with the first letter capital"""
+    number = getNumber(text,numberType)
+    #convert the number to text. num2words is loaded only by the runs that spell numbers
+    from num2words import num2words
+    number = num2words(number,to = 'cardinal')
+    #make the first letter capital, and return as text.
+    return number.capitalize()
+
+def addSpace(text, spaceCount):
+    """ Returns the text with spaces at the end"""
+    return str(text)+ (" " * spaceCount)
+
+def changeTextCase(text, caseType):
+    """ Returns the text in lower, UPPER or Title case"""
+    if("lower" == caseType):
+        return text.lower()
+    elif ("UPPER" == caseType):
+        return text.upper()
+    elif ("Title" == caseType):
+        return text.title()
+    else:
+        logger.debug("unsupported Case %s", caseType)
+        return text
 
 def formatDate(date_string,format):
     #$ print(date_string,format)
@@ -296,7 +428,7 @@ def formatDate(date_string,format):
             continue
     if parsed_date is None:
         # the text can not be decoded.
-        print("No matching format found for:", date_string, "format =", format)
+        logger.debug("No matching format found for: %s format = %s", date_string, format)
         return date_string
     # we have a valid date. Return the formatted string
     # print(parsed_date.strftime(format))
@@ -356,5 +488,5 @@ def extractValueFromString(value):
         except ValueError:
             # Otherwise, keep it as a string
             value = str(value)
-    print("Fn [extractValueFromString] => ",value, type(value))
+    logger.debug("Fn [extractValueFromString] => %s %s", value, type(value))
     return value
@@ -4,91 +4,566 @@
     Author: vipulasrilanka@yahoo.com 
     (c) 2024 """
 
-import msoffcrypto
-import openpyxl
+import logging
 import os
 import json
+import csv
+import sqlite3
+import pickle
+import hashlib
+import base64
+import io
+import threading
 from constants.errorcodes import ERROR_FILE_NOT_FOUND, ERROR_SUCCESS, ERROR_FILE_ENCRYPTED, ERROR_UNKNOWN, ERROR_OPEN_FAIL
+from constants.sourceData import SOURCE_EXT_CSV, SOURCE_EXT_SQLITE, SOURCE_SQLITE_MAX_KEYS
+from constants.processData import PROC_ZIP_COMPRESS_LEVEL
+from constants.sourceData import SOURCE_CACHE_EXTENSION, SOURCE_CACHE_VERSION, SOURCE_CACHE_KDF_ITERATIONS, SOURCE_CACHE_HASH_BLOCK
+from constants.timingData import TIMING_CSV_EXTENSION
+
+logger = logging.getLogger(__name__)
 
 # Test Passwords: (1) EMP01 - perdata (2) PAY01 - saldata (3) TEMPLATE - NO PASSWORD
 
-def saveSessionData (sessionFile, pdfFileName, templateFileName, fileObjectList):
-    """ Save the session data to a json file"""
-    settings = {
-        "pdfFileName": pdfFileName,
-        "templateFileName": templateFileName,
-        "sourceFiles": []  # This will store file-specific settings
-    }
+#openpyxl, msoffcrypto and cryptography are imported by the functions that use them, so a
+#run loads only what it needs. See bench/importtime.py
+
+def saveSessionData (sessionFile, savedSession, pdfFileName, templateFileName, fileObjectList):
+    """ Save the session data to a json file. The options of the loaded session are kept,
+        only the file names are replaced.
+    Args: sessionFile (string) : json file name
+          savedSession (directory) : session loaded with loadSessionData, or empty
+          pdfFileName (string) : PDF template file
+          templateFileName (string) : Excel template file
+          fileObjectList (list) : directories with the name and the path of each source file
+    Returns: int : Error code"""
+    settings = dict(savedSession)
+    settings["pdfFileName"] = pdfFileName
+    settings["templateFileName"] = templateFileName
+    settings["sourceFiles"] = []  # This will store file-specific settings
     for sourceFile in fileObjectList:
-        print(sourceFile["name"])
+        logger.debug("%s", sourceFile["name"])
         settings["sourceFiles"].append({"name": sourceFile["name"], "path": sourceFile["path"]})
-    with open(sessionFile, 'w') as f:
-        json.dump(settings, f, indent=4)
+    try:
+        with open(sessionFile, 'w') as f:
+            json.dump(settings, f, indent=4)
+    except OSError as e:
+        logger.warning("Warning: Can not save the session file %s: %s", sessionFile, e)
+        return ERROR_OPEN_FAIL
+    return ERROR_SUCCESS
 
 def loadSessionData (sessionFile):
     """ Load the session data from a json file"""
     if not os.path.exists(sessionFile):
-        print("Error [loadSessiondata]: Invalid session file.")
+        logger.error("Error [loadSessiondata]: Invalid session file.")
         return ERROR_FILE_NOT_FOUND
     with open(sessionFile, 'r') as f:
         return json.load(f)
 
-def createTempFile(sourceFileName,password,tempFileName):
-    """ create a temp data file from a locked excel file"""
-    print("Fn: createTempFile", sourceFileName,"==>",tempFileName)
-    #check if the source file is there
-    if(not os.path.exists(sourceFileName)):
-        print("Error [createTempFile]: Source file not found")
-        return ERROR_FILE_NOT_FOUND # error 
-    try:            
+def saveCombinedIndex(indexFileName, indexList):
+    """ Save the page index of a combined output to a csv file
+    Args: indexFileName (string) : csv file name
+          indexList (list) : directories with key, identifier, file and page
+    Returns: int : Error code"""
+    logger.debug("Fn: saveCombinedIndex %s %s", indexFileName, len(indexList))
+    try:
+        with open(indexFileName, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Primary Key", "Identifier", "File", "Page"])
+            for item in indexList:
+                writer.writerow([item["key"], item["identifier"], item["file"], item["page"]])
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return ERROR_OPEN_FAIL
+    return ERROR_SUCCESS
+
+def saveTimingReport(reportFileName, report):
+    """ Save the timing report of a run. A .csv file gets a row for each span, with the
+        slowest records in the last column, any other file gets the report as json.
+    Args: reportFileName (string) : report file name
+          report (directory) : run details, and the "spans" from getTimingReport
+    Returns: int : Error code"""
+    logger.debug("Fn: saveTimingReport %s", reportFileName)
+    try:
+        with open(reportFileName, 'w', newline='') as f:
+            if TIMING_CSV_EXTENSION == os.path.splitext(reportFileName)[1].lower():
+                writer = csv.writer(f)
+                writer.writerow(["Span", "Count", "Total Seconds", "P50 Seconds", "P95 Seconds", "Max Seconds", "Slowest Records"])
+                for span in report["spans"]:
+                    writer.writerow([span["span"], span["count"], span["totalSeconds"], span["p50Seconds"], span["p95Seconds"], span["maxSeconds"],
+                                     " ".join(f"{outlier['record']}={outlier['seconds']}" for outlier in span["outliers"])])
+            else:
+                json.dump(report, f, indent=4)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return ERROR_OPEN_FAIL
+    return ERROR_SUCCESS
+
+def saveMemoryReport(reportFileName, report):
+    """ Save the memory report of a run to a json file
+    Args: reportFileName (string) : report file name
+          report (directory) : see getMemoryReport
+    Returns: int : Error code"""
+    logger.debug("Fn: saveMemoryReport %s", reportFileName)
+    try:
+        with open(reportFileName, 'w') as f:
+            json.dump(report, f, indent=4)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return ERROR_OPEN_FAIL
+    return ERROR_SUCCESS
+
+def getOfficeFile(file):
+    """ msoffcrypto file object of an open excel file"""
+    import msoffcrypto
+    return msoffcrypto.OfficeFile(file)
+
+def getColumnIndex(column):
+    """ One based index of a column letter, e.g. A = 1"""
+    from openpyxl.utils import column_index_from_string
+    return column_index_from_string(column)
+
+def getExcelOpenError(sourceFileName):
+    """ Find out why an excel file can not be opened
+    Args: sourceFileName (string)
+    Return: int: ERROR_FILE_ENCRYPTED for a password protected file, or ERROR_UNKNOWN"""
+    with open (sourceFileName, 'rb') as excelFile:
+        officeFile = getOfficeFile(excelFile)
+        if officeFile.is_encrypted():
+            logger.debug("Fn [getExcelOpenError]:: File Encrypted.")
+            return ERROR_FILE_ENCRYPTED
+    #This is an unknown error
+    logger.error("Error [getExcelOpenError]: unknown Error")
+    return ERROR_UNKNOWN
+
+def decryptExcelFile(sourceFileName, password):
+    """ Decrypt a password protected excel file in to memory. Nothing is written to disk.
+    Args: sourceFileName (string)
+          password (string)
+    Return: Directory with error code and the decrypted file (BytesIO) if success"""
+    logger.debug("Fn: decryptExcelFile %s", sourceFileName)
+    try:
         with open(sourceFileName, 'rb') as file:
-            officeFile = msoffcrypto.OfficeFile(file)
+            officeFile = getOfficeFile(file)
             officeFile.load_key(password=password)  # Provide the password
-            # Decrypt the file and save it as a temporary file
-            with open(tempFileName, 'wb') as decryptedFile:
-                officeFile.decrypt(decryptedFile)
-        return ERROR_SUCCESS
+            decryptedFile = io.BytesIO()
+            officeFile.decrypt(decryptedFile)
+        decryptedFile.seek(0)
+        return {"error": ERROR_SUCCESS, "object": decryptedFile}
     except Exception as e:
-        print(f"Error: {e}")
-        return ERROR_OPEN_FAIL
+        logger.error("Error: %s", e)
+        return {"error": ERROR_OPEN_FAIL, "object": None}
+
+def loadExcelSource(sourceFileName, sourceColumns, keyFilter=None, password=None):
+    """ Load the columns the overlays read from a source workbook. The workbook is
+        streamed in read only mode and closed, so only the loaded columns stay in memory.
+    Args: sourceFileName (string)
+          sourceColumns (directory) : sheet name => {"keys": key columns, "values": value columns},
+                                      see getSourceColumns
+          keyFilter (set) : keys of the records to process, see getRecordKeySet. Only the rows
+                            with one of these keys are kept. None to keep all the rows
+          password (string) : password of a protected file. The file is decrypted in memory
+    Return: Directory with file error code and source data if success, see addSourceRows"""
+    logger.debug("+Fn: loadExcelSource %s", sourceFileName)
+    if(not os.path.exists(sourceFileName)):
+        logger.debug("Fn [loadExcelSource]: Source file not found")
+        return {"error": ERROR_FILE_NOT_FOUND, "object": None} # error
+    excelFile = sourceFileName
+    if not None == password:
+        returnValue = decryptExcelFile(sourceFileName, password)
+        if not ERROR_SUCCESS == returnValue["error"]:
+            return returnValue
+        excelFile = returnValue["object"]
+    try:
+        import openpyxl
+        workbook = openpyxl.load_workbook(excelFile, read_only=True, data_only=True)
+    except Exception as e:
+        logger.debug("Error: %s", e)
+        #check if this is a password protected file
+        return {"error": getExcelOpenError(sourceFileName), "object": None}
+    sourceData = {"columns": {}, "index": {}}
+    try:
+        for sheetName, sheetColumns in sourceColumns.items():
+            readSourceSheet(workbook[sheetName], sheetName, sheetColumns, sourceData, keyFilter)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        logger.error("Error [loadExcelSource]: Can not read the source columns")
+        return {"error": ERROR_UNKNOWN, "object": None}
+    finally:
+        workbook.close()
+    return {"error": ERROR_SUCCESS, "object": sourceData}
+
+def readSourceSheet(sheet, sheetName, sheetColumns, sourceData, keyFilter=None):
+    """ Read the key and value columns of a worksheet in to sourceData, see addSourceRows"""
+    columnList = getSourceColumnList(sheetColumns)
+    columnIndexList = [getColumnIndex(column) for column in columnList]
+    minCol = columnIndexList[0]
+    # only the cells between the first and the last loaded column are read
+    rows = sheet.iter_rows(min_row=2, min_col=minCol, max_col=columnIndexList[-1], values_only=True)
+    addSourceRows(rows, sheetName, sheetColumns, [columnIndex - minCol for columnIndex in columnIndexList], sourceData, keyFilter)
+
+def getSourceColumnList(sheetColumns):
+    """ Returns the key and value columns of a sheet, in the column order"""
+    return sorted(set(sheetColumns["keys"]) | set(sheetColumns["values"]), key=getColumnIndex)
+
+def addSourceRows(rows, sheetName, sheetColumns, positionList, sourceData, keyFilter=None):
+    """ Add the key and value columns of the rows of a sheet to sourceData. The header row
+        is not in rows. The values are kept as str(value), one tuple per column, so a key
+        matches the getKeyString of a record key. Each key column gets an index of
+        key => row number. The first row of a key is used, same as a top down search.
+        With a keyFilter, a row is kept only if one of its keys is in the filter.
+    Args: rows (iterable) : row values
+          sheetName (string) : sheet name
+          sheetColumns (directory) : {"keys": key columns, "values": value columns}
+          positionList (list) : position in a row of each column, in getSourceColumnList order
+          sourceData (directory) : {"columns": (sheet, column) => tuple of strings,
+                                    "index": (sheet, key column) => {key: row number}}
+          keyFilter (set) : key strings to keep, or None"""
+    columnList = getSourceColumnList(sheetColumns)
+    keyPositionList = [columnList.index(keyCol) for keyCol in sheetColumns["keys"]]
+    columnValues = [[] for column in columnList]
+    rowCount = 0
+    for row in rows:
+        rowCount = rowCount + 1
+        rowValues = [str(row[position]) if len(row) > position else "None" for position in positionList]
+        if not None == keyFilter and not any(rowValues[keyPosition] in keyFilter for keyPosition in keyPositionList):
+            continue
+        for values, value in zip(columnValues, rowValues):
+            values.append(value)
+    for column, values in zip(columnList, columnValues):
+        sourceData["columns"][(sheetName, column)] = tuple(values)
+    for keyCol in sheetColumns["keys"]:
+        sourceData["index"][(sheetName, keyCol)] = getLookupIndex(sourceData["columns"][(sheetName, keyCol)])
+    logger.debug("loaded [%s] %s %s of %s rows", sheetName, columnList, len(columnValues[0]), rowCount)
+
+def getLookupIndex(keyValues):
+    """ Returns key => row number of a key column. The first row of a key is used"""
+    lookupIndex = {}
+    for rowNumber, key in enumerate(keyValues):
+        lookupIndex.setdefault(key, rowNumber)
+    return lookupIndex
+
+def filterSourceData(sourceData, keyFilter):
+    """ Keep the rows of source data loaded in full (e.g. from a snapshot) that have one
+        of the keys of keyFilter, same as loading the rows with the keyFilter.
+    Args: sourceData (directory) : see addSourceRows
+          keyFilter (set) : key strings to keep, or None for all the rows
+    Returns directory: source data with the rows of the filter"""
+    if None == keyFilter:
+        return sourceData
+    filteredData = {"columns": {}, "index": {}}
+    for sheetName in {sheetName for sheetName, column in sourceData["columns"]}:
+        keyColumnList = [sourceData["columns"][indexKey] for indexKey in sourceData["index"] if sheetName == indexKey[0]]
+        rowList = [rowNumber for rowNumber, keys in enumerate(zip(*keyColumnList)) if any(key in keyFilter for key in keys)]
+        for (columnSheet, column), values in sourceData["columns"].items():
+            if sheetName == columnSheet:
+                filteredData["columns"][(sheetName, column)] = tuple(values[rowNumber] for rowNumber in rowList)
+        for indexSheet, keyCol in sourceData["index"]:
+            if sheetName == indexSheet:
+                filteredData["index"][(sheetName, keyCol)] = getLookupIndex(filteredData["columns"][(sheetName, keyCol)])
+    return filteredData
+
+def loadCsvSource(sourceFileName, sourceColumns, keyFilter=None, password=None):
+    """ Load the columns the overlays read from a csv file. A csv file has a single sheet,
+        so every Sheet name of the overlays reads the same rows. Row 1 is the header.
+    Args: see loadExcelSource
+    Return: Directory with file error code and source data if success"""
+    logger.debug("+Fn: loadCsvSource %s", sourceFileName)
+    if(not os.path.exists(sourceFileName)):
+        logger.debug("Fn [loadCsvSource]: Source file not found")
+        return {"error": ERROR_FILE_NOT_FOUND, "object": None} # error
+    sourceData = {"columns": {}, "index": {}}
+    try:
+        for sheetName, sheetColumns in sourceColumns.items():
+            with open(sourceFileName, 'r', newline='', encoding='utf-8-sig') as f:
+                rows = csv.reader(f)
+                next(rows, None) # skip the header
+                positionList = [getColumnIndex(column) - 1 for column in getSourceColumnList(sheetColumns)]
+                addSourceRows(rows, sheetName, sheetColumns, positionList, sourceData, keyFilter)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        logger.error("Error [loadCsvSource]: Can not read the source columns")
+        return {"error": ERROR_OPEN_FAIL, "object": None}
+    return {"error": ERROR_SUCCESS, "object": sourceData}
 
-def openExcelFile(sourceFileName):
-    """ Open an excel file and return the file object
-    Args: sourceFileName (string) 
-    Return: Directory with file error code and object if success"""
-    print ("+Fn: openSourceFile",sourceFileName)
+def loadSqliteSource(sourceFileName, sourceColumns, keyFilter=None, password=None):
+    """ Load the columns the overlays read from a SQLite database. The Sheet name is the
+        table name, and the columns A, B, C.. are the table columns in their order.
+        With a keyFilter, the rows are selected with the keys, so an index on the key
+        column is used and the other rows are not read.
+    Args: see loadExcelSource
+    Return: Directory with file error code and source data if success"""
+    logger.debug("+Fn: loadSqliteSource %s", sourceFileName)
     if(not os.path.exists(sourceFileName)):
-        print("Fn [openExcelFile]: Source file not found")
+        logger.debug("Fn [loadSqliteSource]: Source file not found")
         return {"error": ERROR_FILE_NOT_FOUND, "object": None} # error
-    else:
-        try:
-            workbook = openpyxl.load_workbook(sourceFileName, data_only=True)
-        except Exception as e:
-            print(f"Error: {e}")
-            #check if this is a password protected file
-            with open (sourceFileName, 'rb') as excelFile:
-                officeFile = msoffcrypto.OfficeFile(excelFile)
-                if officeFile.is_encrypted():
-                    print("Fn [openExcelFile]:: File Encrypted.")
-                    return {"error": ERROR_FILE_ENCRYPTED, "object": None}
-                else:
-                    #This is an unknown error
-                    print("Error [openExcelFile]: unknown Error")
-                    return {"error": ERROR_UNKNOWN, "object": None} # error
-    return {"error": ERROR_SUCCESS, "object": workbook}
-
-def removeFiles(fileList):
-    """Remove Files
-    Args: fileList (list) : Dictionary of temp file name list
-    Returns: int : error count"""
-    print("+Fn: removeFiles")
-    errorCount = 0
-    for files in fileList:
-        if(files["delete"] & os.path.exists(files["name"])):
-            os.remove(files["name"])
-            print(f"Temporary files deleted.")
-        else:
-            print(f"ERROR: File not found.")
-            print(files["name"])
-            errorCount = errorCount + 1
-    return errorCount
+    sourceData = {"columns": {}, "index": {}}
+    try:
+        from urllib.request import pathname2url
+        connection = sqlite3.connect("file:" + pathname2url(os.path.abspath(sourceFileName)) + "?mode=ro", uri=True)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return {"error": ERROR_OPEN_FAIL, "object": None}
+    try:
+        for sheetName, sheetColumns in sourceColumns.items():
+            rows = getSqliteRows(connection, sheetName, sheetColumns, keyFilter)
+            addSourceRows(rows, sheetName, sheetColumns, range(len(getSourceColumnList(sheetColumns))), sourceData, keyFilter)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        logger.error("Error [loadSqliteSource]: Can not read the source columns")
+        return {"error": ERROR_OPEN_FAIL, "object": None}
+    finally:
+        connection.close()
+    return {"error": ERROR_SUCCESS, "object": sourceData}
+
+def getSqliteRows(connection, tableName, sheetColumns, keyFilter=None):
+    """ Select the key and value columns of a table, in the order the rows are read. The
+        rowid is not used, so the views and the WITHOUT ROWID tables can be read too.
+    Args: connection (sqlite3.Connection) : open database
+          tableName (string) : table name, the Sheet name of the overlays
+          sheetColumns (directory) : {"keys": key columns, "values": value columns}
+          keyFilter (set) : key strings to select, or None for all the rows
+    Returns list: row values, in getSourceColumnList order"""
+    tableColumnList = [column[1] for column in connection.execute("PRAGMA table_info(" + getSqlName(tableName) + ")")]
+    if len(tableColumnList) < 1:
+        raise ValueError("table not found: " + tableName)
+    def getSqlColumn(column):
+        return getSqlName(tableColumnList[getColumnIndex(column) - 1])
+    selectSql = "SELECT " + ", ".join(getSqlColumn(column) for column in getSourceColumnList(sheetColumns)) + " FROM " + getSqlName(tableName)
+    if None == keyFilter:
+        return list(connection.execute(selectSql))
+    #the key column may hold numbers, so look for the number and the text of a key
+    keyList = []
+    for key in keyFilter:
+        keyList.append(key)
+        if key.lstrip("-").isdigit():
+            keyList.append(int(key))
+    keyColumnList = list(sheetColumns["keys"])
+    if len(keyColumnList) < 1:
+        return []
+    #a row is selected once for all its key columns. The rows of a key are in one chunk,
+    #so they keep the read order and the first row read for a key is used
+    chunkSize = max(1, SOURCE_SQLITE_MAX_KEYS // len(keyColumnList))
+    rowList = []
+    for start in range(0, len(keyList), chunkSize):
+        keyChunk = keyList[start:start + chunkSize]
+        whereSql = " WHERE " + " OR ".join(getSqlColumn(keyCol) + " IN (" + ", ".join("?" * len(keyChunk)) + ")" for keyCol in keyColumnList)
+        rowList.extend(connection.execute(selectSql + whereSql, keyChunk * len(keyColumnList)))
+    return rowList
+
+def getSqlName(name):
+    """ Quote a table or a column name for SQL"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+#source file loaders, by file extension. Other files are opened as excel workbooks
+SOURCE_LOADER_LIST = {SOURCE_EXT_CSV: loadCsvSource}
+SOURCE_LOADER_LIST.update({extension: loadSqliteSource for extension in SOURCE_EXT_SQLITE})
+
+def loadSourceFile(sourceFileName, sourceColumns, keyFilter=None, password=None):
+    """ Load the columns the overlays read from a source file, with the loader for the
+        file extension. Every loader returns the same source data, see addSourceRows.
+    Args: see loadExcelSource
+    Return: Directory with file error code and source data if success"""
+    extension = os.path.splitext(sourceFileName)[1].lower()
+    sourceLoader = SOURCE_LOADER_LIST.get(extension, loadExcelSource)
+    return sourceLoader(sourceFileName, sourceColumns, keyFilter, password)
+
+def getSnapshotKey(sourceCache, sourceFileName, sourceColumns):
+    """ Returns the snapshot cache key of a source file. The key changes when the file path,
+        size, modified time or content, or the loaded columns change. The content is
+        hashed as well, the modified time alone misses the files copied or synced with
+        their old time, and the coarse times of FAT and SMB shares. A snapshot holds all the rows,
+        so any record list can use it, see filterSourceData. SQLite sources are not cached,
+        they are read by key, which is faster than loading the snapshot of a whole table.
+    Args: sourceCache (directory) : {"enabled", "folder", "limit", "refresh"}, see getSessionData
+          sourceFileName (string) : source file, before decryption
+          sourceColumns (directory) : see loadExcelSource
+    Returns string: key, or None if the cache is not used for this file"""
+    if None == sourceCache or not sourceCache["enabled"] or not os.path.exists(sourceFileName):
+        return None
+    if os.path.splitext(sourceFileName)[1].lower() in SOURCE_EXT_SQLITE:
+        return None
+    fileStat = os.stat(sourceFileName)
+    snapshotHash = hashlib.sha256()
+    snapshotHash.update(repr((SOURCE_CACHE_VERSION, os.path.abspath(sourceFileName), fileStat.st_size, fileStat.st_mtime_ns)).encode())
+    with open(sourceFileName, 'rb') as f:
+        for block in iter(lambda: f.read(SOURCE_CACHE_HASH_BLOCK), b""):
+            snapshotHash.update(block)
+    columnList = sorted((sheetName, tuple(sorted(columns["keys"])), tuple(sorted(columns["values"]))) for sheetName, columns in sourceColumns.items())
+    snapshotHash.update(repr(columnList).encode())
+    return snapshotHash.hexdigest()
+
+def getSnapshotFileName(sourceCache, snapshotKey):
+    """ Returns the snapshot file name of a key"""
+    return os.path.join(sourceCache["folder"], snapshotKey + SOURCE_CACHE_EXTENSION)
+
+def getSnapshotCipher(password, salt):
+    """ Returns the cipher for the snapshot of a password protected source file"""
+    from cryptography.fernet import Fernet
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    keyFunction = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=SOURCE_CACHE_KDF_ITERATIONS)
+    return Fernet(base64.urlsafe_b64encode(keyFunction.derive(str(password).encode())))
+
+def loadSourceSnapshot(sourceCache, snapshotKey, password=None):
+    """ Load the source data of a file from the snapshot cache.
+    Args: sourceCache (directory) : see getSnapshotKey
+          snapshotKey (string) : from getSnapshotKey, or None
+          password (string) : password of the source file, if it is protected
+    Return: Directory with error code and source data if success. ERROR_FILE_NOT_FOUND
+            if there is no snapshot, ERROR_FILE_ENCRYPTED if the snapshot needs the password"""
+    if None == snapshotKey or sourceCache["refresh"]:
+        return {"error": ERROR_FILE_NOT_FOUND, "object": None}
+    snapshotFileName = getSnapshotFileName(sourceCache, snapshotKey)
+    if not os.path.exists(snapshotFileName):
+        return {"error": ERROR_FILE_NOT_FOUND, "object": None}
+    try:
+        with open(snapshotFileName, 'rb') as f:
+            snapshot = pickle.load(f)
+        snapshotData = snapshot["data"]
+        if not None == snapshot["salt"]:
+            if None == password:
+                return {"error": ERROR_FILE_ENCRYPTED, "object": None}
+            from cryptography.fernet import InvalidToken
+            try:
+                snapshotData = getSnapshotCipher(password, snapshot["salt"]).decrypt(snapshotData)
+            except InvalidToken:
+                logger.warning("Fn [loadSourceSnapshot]: Wrong password for the snapshot")
+                return {"error": ERROR_OPEN_FAIL, "object": None}
+        sourceData = pickle.loads(snapshotData)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return {"error": ERROR_OPEN_FAIL, "object": None}
+    #mark the snapshot as recently used
+    os.utime(snapshotFileName)
+    logger.debug("Fn [loadSourceSnapshot]: loaded %s", snapshotFileName)
+    return {"error": ERROR_SUCCESS, "object": sourceData}
+
+def saveSourceSnapshot(sourceCache, snapshotKey, sourceData, password=None):
+    """ Save the source data of a file to the snapshot cache, and remove the least recently
+        used snapshots over the limit. The snapshot of a password protected file is
+        encrypted with the password.
+    Args: sourceCache (directory) : see getSnapshotKey
+          snapshotKey (string) : from getSnapshotKey, or None
+          sourceData (directory) : see addSourceRows
+          password (string) : password of the source file, if it is protected
+    Returns: int : Error code"""
+    if None == snapshotKey:
+        return ERROR_SUCCESS
+    snapshotData = pickle.dumps(sourceData, protocol=pickle.HIGHEST_PROTOCOL)
+    salt = None
+    if not None == password:
+        salt = os.urandom(16)
+        snapshotData = getSnapshotCipher(password, salt).encrypt(snapshotData)
+    snapshotFileName = getSnapshotFileName(sourceCache, snapshotKey)
+    try:
+        os.makedirs(sourceCache["folder"], exist_ok=True)
+        #write to a temp file first, so a reader never sees a part of a snapshot
+        with open(snapshotFileName + ".tmp", 'wb') as f:
+            pickle.dump({"salt": salt, "data": snapshotData}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(snapshotFileName + ".tmp", snapshotFileName)
+        logger.debug("Fn [saveSourceSnapshot]: saved %s", snapshotFileName)
+        removeOldSnapshots(sourceCache)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return ERROR_OPEN_FAIL
+    return ERROR_SUCCESS
+
+def removeOldSnapshots(sourceCache):
+    """ Remove the least recently used snapshots, to keep sourceCache["limit"] files"""
+    snapshotList = [os.path.join(sourceCache["folder"], fileName) for fileName in os.listdir(sourceCache["folder"])
+                    if fileName.endswith(SOURCE_CACHE_EXTENSION)]
+    snapshotList.sort(key=os.path.getmtime, reverse=True)
+    for snapshotFileName in snapshotList[max(0, sourceCache["limit"]):]:
+        logger.debug("Fn [removeOldSnapshots]: remove %s", snapshotFileName)
+        os.remove(snapshotFileName)
+
+def loadPasswordFile(passwordFileName):
+    """ Load the passwords of the protected source files. Each line of the file is
+        <source file name>=<password>. Empty lines and lines starting with # are skipped.
+    Args: passwordFileName (string) : file name
+    Returns: directory : password of each file name, or error code"""
+    passwordList = {}
+    try:
+        with open(passwordFileName, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip("\r\n")
+                if "" == line.strip() or line.lstrip().startswith("#"):
+                    continue
+                if not "=" in line:
+                    logger.error("Error [loadPasswordFile]: bad line in %s", passwordFileName)
+                    return ERROR_OPEN_FAIL
+                sourceFile, password = line.split("=", 1)
+                passwordList[sourceFile.strip()] = password
+    except FileNotFoundError:
+        logger.error("Error [loadPasswordFile]: file not found %s", passwordFileName)
+        return ERROR_FILE_NOT_FOUND
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return ERROR_OPEN_FAIL
+    return passwordList
+
+def saveOutputFile(outputFileName, fileData):
+    """ Write an output file. The data is written to a temp file in the same folder and
+        renamed to outputFileName, so a part written file is never left with that name.
+    Args: outputFileName (string) : file name
+          fileData (bytes) : file content
+    Returns: int : Error code"""
+    #a temp name for each writer, the same record can be written by two writers
+    tempFileName = f"{outputFileName}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(tempFileName, 'wb') as f:
+            f.write(fileData)
+        os.replace(tempFileName, outputFileName)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        logger.error("Error [saveOutputFile]: Can not write %s", outputFileName)
+        if os.path.exists(tempFileName):
+            os.remove(tempFileName)
+        return ERROR_OPEN_FAIL
+    return ERROR_SUCCESS
+
+def openZipOutput(zipFileName):
+    """ Start a zip output, that stores the output file of every record in one zip file.
+        The zip is written to a temp name, and renamed by closeZipOutput.
+    Args: zipFileName (string) : zip file name
+    Returns: directory : the zip output state, or error code"""
+    logger.debug("+Fn openZipOutput %s", zipFileName)
+    import zipfile
+    tempFileName = zipFileName + ".tmp"
+    try:
+        zipFile = zipfile.ZipFile(tempFileName, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=PROC_ZIP_COMPRESS_LEVEL)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        logger.error("Error [openZipOutput]: Can not write %s", zipFileName)
+        return ERROR_OPEN_FAIL
+    return {"fileName": zipFileName, "tempFileName": tempFileName, "zipFile": zipFile, "memberSet": set()}
+
+def addFileToZip(zipOutput, memberName, fileData):
+    """ Add an output file to the zip. Call from one thread at a time.
+    Args: zipOutput (directory) : from openZipOutput
+          memberName (string) : file name in the zip
+          fileData (bytes) : file content
+    Returns: int : Error code"""
+    if memberName in zipOutput["memberSet"]:
+        logger.warning("Warning [addFileToZip]: duplicate file name %s", memberName)
+    try:
+        zipOutput["zipFile"].writestr(memberName, fileData)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        logger.error("Error [addFileToZip]: Can not add %s", memberName)
+        return ERROR_OPEN_FAIL
+    zipOutput["memberSet"].add(memberName)
+    return ERROR_SUCCESS
+
+def closeZipOutput(zipOutput):
+    """ Write the zip directory, and rename the zip to its file name.
+    Returns: int : Error code"""
+    try:
+        zipOutput["zipFile"].close()
+        os.replace(zipOutput["tempFileName"], zipOutput["fileName"])
+    except Exception as e:
+        logger.error("Error: %s", e)
+        logger.error("Error [closeZipOutput]: Can not write %s", zipOutput["fileName"])
+        return ERROR_OPEN_FAIL
+    logger.debug("-Fn closeZipOutput %s %s files", zipOutput["fileName"], len(zipOutput["memberSet"]))
+    return ERROR_SUCCESS
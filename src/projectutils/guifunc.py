@@ -3,17 +3,14 @@
     This file contains the functions with graphical user interfaces
     Author: vipulasrilanka@yahoo.com 
     (c) 2024 """
+import logging
 import tkinter as tk
 from tkinter import filedialog, simpledialog
 from constants.errorcodes import ERROR_SUCCESS
+from constants.guiData import MESSAGE_NEW, MESSAGE_ADD, MESSAGE_CLEAR, WINDOW_QUIT
+from constants.guiData import GET_PASSWORD, WAIT_FOR_PASSWORD, RETURN_PASSWORD
 
-MESSAGE_NEW = 1
-MESSAGE_ADD = 2
-MESSAGE_CLEAR = 3
-WINDOW_QUIT = 0
-GET_PASSWORD = 4
-WAIT_FOR_PASSWORD = 5
-RETURN_PASSWORD = 6
+logger = logging.getLogger(__name__)
 
 def getPdfFileName(dialogTitle, initDir):
     """Select a PDF File"""
@@ -33,7 +30,7 @@ def getPdfFileName(dialogTitle, initDir):
     return filePath
 
 def getExcelFileName(dialogTitle, initDir):
-    """Select an Excel file"""
+    """Select an Excel file, or a csv / SQLite source file"""
     # Create a root window (but hide it)
     root = tk.Tk()
     root.withdraw()  # Hide the root window
@@ -41,7 +38,7 @@ def getExcelFileName(dialogTitle, initDir):
     # Open file dialog and allow user to select a file
     filePath = filedialog.askopenfilename(
         title=dialogTitle, 
-        filetypes=[("Microsoft Excel file", "*.xlsx")],
+        filetypes=[("Microsoft Excel file", "*.xlsx"), ("CSV file", "*.csv"), ("SQLite database", "*.sqlite *.db")],
         initialdir=initDir 
         )
     #destroy the window. (quit does not work here)
@@ -68,7 +65,7 @@ def getPassword(fileName):
 
 def showStatus(messageHolder, windowName):
     """Pop up a GUI with a read-only text box displaying messageHolder."""
-    print("+Fn showStatus")
+    logger.debug("+Fn showStatus")
     lastAction = str(None)
     def messageProcesser():
         """Update the text box with the latest value of the message."""
@@ -110,7 +107,7 @@ def showStatus(messageHolder, windowName):
         elif action == MESSAGE_ADD:
             text_box.insert(tk.END, "\n"+ str(messageId) + " " + message)
         else:
-            print("Message box = Clear")
+            logger.debug("Message box = Clear")
         text_box.config(state=tk.DISABLED)  # Make text box read-only again
         root.after(500, messageProcesser)  # Call this function again after 1 second (1000 ms)
     # Create the main window
@@ -134,5 +131,5 @@ def showStatus(messageHolder, windowName):
     # Start the Tkinter event loop
     root.mainloop()
     #return
-    print("-Fn showStatus")
+    logger.debug("-Fn showStatus")
     return ERROR_SUCCESS
\ No newline at end of file
@@ -0,0 +1,269 @@
+""" Memory Functions
+    src/projectutils/memoryfunc.py
+    This file contains the memory checks of a run: the memory (RSS, or PSS with worker processes) of the run,
+    the memory limit that slows or stops the record intake, and the memory report with
+    the top allocators (tracemalloc) of each phase of the run.
+    Author: vipulasrilanka@yahoo.com
+    (c) 2024 """
+
+import logging
+import os
+import sys
+import threading
+import time
+from constants.memoryData import MEMORY_MB, MEMORY_TRACE_FRAMES, MEMORY_TOP_COUNT, MEMORY_THROTTLE_FACTOR, MEMORY_THROTTLE_WAIT
+
+logger = logging.getLogger(__name__)
+
+#tracemalloc is imported only by the runs with a memory report
+memoryState = {"limit": None, "exceeded": None, "peak": 0, "fed": 0, "done": 0, "throttleCount": 0, "throttleSeconds": 0.0, "waitStart": None,
+               "tracing": False, "snapshot": None, "phases": [], "stages": {}}
+memoryLock = threading.Lock()
+
+def getProcessRss(pid):
+    """ Resident memory of a process in bytes, from /proc. None when not available"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def getProcessPss(pid):
+    """ Proportional memory of a process in bytes, from /proc: the pages shared with the
+        other processes (e.g. copy on write after a fork) are split between them, so the
+        memory of the processes can be added. None when not available"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    return None
+
+def getPeakRss():
+    """ Peak resident memory of this process in bytes, None when not available"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and in KB on the others
+    return peakRss if "darwin" == sys.platform else peakRss * 1024
+
+def getRss():
+    """ Memory of the run in bytes. The resident memory of this process, or with worker
+        processes the proportional memory (PSS) of this process and the workers, so the
+        pages the workers share with this process are counted once. Without /proc
+        (e.g. macOS) the peak of this process is used, which does not go down, so the
+        intake stays slow once it is over the limit.
+    Returns: int: bytes, or None when not available"""
+    rss = getProcessRss("self")
+    if None == rss:
+        return getPeakRss()
+    #only the runs in the process mode load multiprocessing
+    childList = sys.modules["multiprocessing"].active_children() if "multiprocessing" in sys.modules else []
+    if len(childList) > 0:
+        #without smaps_rollup (before Linux 4.14) the shared pages are counted in each process
+        getChildMemory = getProcessRss
+        runPss = getProcessPss("self")
+        if not None == runPss:
+            rss = runPss
+            getChildMemory = lambda pid: getProcessPss(pid) or getProcessRss(pid)
+        for child in childList:
+            childRss = getChildMemory(child.pid)
+            if not None == childRss:
+                rss = rss + childRss
+    #the peak of this process does not count the worker processes
+    memoryState["peak"] = max(memoryState["peak"], rss)
+    return rss
+
+def getRunPeakRss():
+    """ Highest memory of the run seen by getRss, or the peak of this process if higher"""
+    return max(memoryState["peak"], getPeakRss() or 0) or None
+
+def toMb(size):
+    """ Bytes to MB, rounded for the report"""
+    return None if None == size else round(size / MEMORY_MB, 1)
+
+def setMemoryLimit(limitMb):
+    """ Set the memory limit of the run, in MB. None or 0 for no limit
+    Returns: bool: False when the memory of the run can not be read"""
+    memoryState["limit"] = int(limitMb * MEMORY_MB) if limitMb else None
+    if not None == memoryState["limit"] and None == getRss():
+        logger.warning("Warning: Can not read the memory of the run, the memory limit is not used")
+        memoryState["limit"] = None
+        return False
+    return True
+
+def checkMemoryLimit(where, rss=None):
+    """ Check the memory of the run against the limit. The first time it is over the
+        limit, where and the memory are kept for the report.
+    Args:   where (string) : phase or stage of the run, for the report
+            rss (int) : memory of the run, None to read it
+    Returns: bool: False when the memory is over the limit"""
+    if None == memoryState["limit"]:
+        return True
+    if None == rss:
+        rss = getRss()
+    if rss <= memoryState["limit"]:
+        return True
+    with memoryLock:
+        if None == memoryState["exceeded"]:
+            memoryState["exceeded"] = {"where": where, "rssMb": toMb(rss), "records": memoryState["done"]}
+    return False
+
+def isMemoryExceeded():
+    """ True when the run went over the memory limit"""
+    return not None == memoryState["exceeded"]
+
+def iterWithMemoryLimit(recordList):
+    """ Read the records while the run is within the memory limit. Above
+        MEMORY_THROTTLE_FACTOR of the limit, a record is read only when the records
+        before it are done. Over the limit, the reading stops, so the records in the
+        pipeline complete and the run fails early, see isMemoryExceeded.
+    Args:   recordList (iterable) : records to process
+    Returns: generator: the records"""
+    if None == memoryState["limit"]:
+        yield from recordList
+        return
+    throttleLimit = memoryState["limit"] * MEMORY_THROTTLE_FACTOR
+    for record in recordList:
+        while True:
+            rss = getRss()
+            if not checkMemoryLimit("records", rss):
+                endThrottleWait()
+                logger.error("ERROR: Over the memory limit, no more records are read")
+                return
+            if rss <= throttleLimit or memoryState["fed"] <= memoryState["done"]:
+                break
+            startThrottleWait()
+            time.sleep(MEMORY_THROTTLE_WAIT)
+        endThrottleWait()
+        memoryState["fed"] = memoryState["fed"] + 1
+        yield record
+
+def getShardIntake(pendingCount, pendingLimit):
+    """ Number of record shards the process pool can hold within the memory limit, see
+        runRecordProcessPool. The pool reads the records only when it sends a shard, so
+        the shards are held back here, not the records. Above MEMORY_THROTTLE_FACTOR of
+        the limit, a shard is sent only when the shards before it are done. Over the
+        limit, no more shards are sent and the run fails early, see isMemoryExceeded.
+    Args:   pendingCount (int) : shards in the pool
+            pendingLimit (int) : shards the pool holds without the limit
+    Returns: int: shards the pool can hold, 0 to stop reading the records"""
+    if None == memoryState["limit"]:
+        return pendingLimit
+    rss = getRss()
+    if not checkMemoryLimit("records", rss):
+        endThrottleWait()
+        logger.error("ERROR: Over the memory limit, no more records are read")
+        return 0
+    if rss <= memoryState["limit"] * MEMORY_THROTTLE_FACTOR:
+        endThrottleWait()
+        return pendingLimit
+    if 0 == pendingCount:
+        endThrottleWait()
+    else:
+        startThrottleWait()
+    return 1
+
+def countRecordsRead(recordList):
+    """ Count the records as they are read, for the report, when the records are not
+        read through iterWithMemoryLimit"""
+    for record in recordList:
+        memoryState["fed"] = memoryState["fed"] + 1
+        yield record
+
+def startThrottleWait():
+    """ The record intake waits for the memory of the run, see endThrottleWait"""
+    if None == memoryState["waitStart"]:
+        memoryState["waitStart"] = time.perf_counter()
+        memoryState["throttleCount"] = memoryState["throttleCount"] + 1
+
+def endThrottleWait():
+    """ The record intake reads again, add the time it waited to the report"""
+    if not None == memoryState["waitStart"]:
+        memoryState["throttleSeconds"] = memoryState["throttleSeconds"] + time.perf_counter() - memoryState["waitStart"]
+        memoryState["waitStart"] = None
+
+def getMemoryResultFunc(resultFunc):
+    """ Returns a result function that counts the completed records for the intake, see
+        iterWithMemoryLimit, and passes the result on to resultFunc."""
+    def addMemoryResult(result):
+        with memoryLock:
+            memoryState["done"] = memoryState["done"] + 1
+        resultFunc(result)
+    return addMemoryResult
+
+def startMemoryTrace():
+    """ Start tracing the allocations of this process, for the memory report"""
+    import tracemalloc
+    tracemalloc.start(MEMORY_TRACE_FRAMES)
+    memoryState["tracing"] = True
+    memoryState["snapshot"] = tracemalloc.take_snapshot()
+
+def isMemoryTraced():
+    """ True when the run makes a memory report"""
+    return memoryState["tracing"]
+
+def addMemoryPhase(phaseName):
+    """ Close a phase of the run: keep the memory of the run, and the lines that
+        allocated the memory held since the previous phase. The peak of the traced
+        memory is measured again from here.
+    Args:   phaseName (string) : name of the phase that ends, e.g. sourceLoad"""
+    import tracemalloc
+    snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    tracedSize, tracedPeak = tracemalloc.get_traced_memory()
+    topList = snapshot.compare_to(memoryState["snapshot"], "lineno")[:MEMORY_TOP_COUNT]
+    memoryState["snapshot"] = snapshot
+    memoryState["phases"].append({"phase": phaseName, "rssMb": toMb(getRss()), "peakRssMb": toMb(getPeakRss()),
+                                  "tracedMb": toMb(tracedSize), "tracedPeakMb": toMb(tracedPeak),
+                                  "top": [{"line": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                                           "sizeKb": round(stat.size_diff / 1024, 1), "count": stat.count_diff} for stat in topList]})
+    tracemalloc.reset_peak()
+
+def getMemoryStageFunc(stageName, stageFunc):
+    """ Returns a pipeline stage function that keeps the highest memory of the run seen
+        at the end of the stage. The stages run at the same time, so the memory is the
+        memory of the run when the stage completed, not the memory of the stage."""
+    def runMemoryStage(result):
+        returnValue = stageFunc(result)
+        rss = getRss()
+        with memoryLock:
+            stage = memoryState["stages"].setdefault(stageName, {"stage": stageName, "count": 0, "maxRssMb": 0.0})
+            stage["count"] = stage["count"] + 1
+            stage["maxRssMb"] = max(stage["maxRssMb"], toMb(rss) or 0.0)
+        return returnValue
+    return runMemoryStage
+
+def getMemoryReport():
+    """ Memory report of the run.
+    Returns: directory: the limit, the peak, the intake waits, and the phases and stages"""
+    return {"limitMb": toMb(memoryState["limit"]), "peakRssMb": toMb(getRunPeakRss()), "exceeded": memoryState["exceeded"],
+            "recordsRead": memoryState["fed"], "throttleCount": memoryState["throttleCount"],
+            "throttleSeconds": round(memoryState["throttleSeconds"], 3),
+            "phases": memoryState["phases"], "stages": list(memoryState["stages"].values())}
+
+def logMemoryReport(report):
+    """ Log the memory of each phase and stage, and the top allocators when the run went
+        over the limit"""
+    for phase in report["phases"]:
+        logger.info("Memory [ %s ] RSS %s MB, peak %s MB, traced %s MB, traced peak %s MB", phase["phase"], phase["rssMb"],
+                    phase["peakRssMb"], phase["tracedMb"], phase["tracedPeakMb"])
+    for stage in report["stages"]:
+        logger.info("Memory [ %s ] highest RSS %s MB after %s records", stage["stage"], stage["maxRssMb"], stage["count"])
+    if not None == report["limitMb"]:
+        logger.info("Memory limit %s MB, peak RSS %s MB", report["limitMb"], report["peakRssMb"])
+    if report["throttleCount"] > 0:
+        logger.warning("Warning: The record intake waited %s times, %s seconds, above %s%% of the memory limit",
+                       report["throttleCount"], report["throttleSeconds"], int(MEMORY_THROTTLE_FACTOR * 100))
+    if not None == report["exceeded"]:
+        logger.error("ERROR: Memory limit %s MB exceeded at [ %s ] with RSS %s MB, after %s records. Peak RSS %s MB",
+                     report["limitMb"], report["exceeded"]["where"], report["exceeded"]["rssMb"],
+                     report["exceeded"]["records"], report["peakRssMb"])
+        if 0 == len(report["phases"]):
+            logger.error("ERROR: Run with --memory-report for the lines that hold the memory")
+        for phase in report["phases"]:
+            for top in phase["top"][:3]:
+                logger.error("ERROR: [ %s ] %s KB held by %s", phase["phase"], top["sizeKb"], top["line"])
@@ -4,124 +4,545 @@
     Author: vipulasrilanka@yahoo.com 
     (c) 2024 """
 
-from PyPDF2 import PdfWriter, PdfReader
+import logging
+from collections import namedtuple
+from functools import lru_cache
 import io
-import re #consider moving to a business function
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, legal, A4
-from reportlab.pdfgen.textobject import PDFTextObject 
+import math
+import os
+import threading
 from constants.errorcodes import ERROR_SUCCESS, ERROR_UNKNOWN, ERROR_LONG_TEXT
 from constants.pdfData import PDF_FIRST_PAGE, PDF_DEFAULT_LINE_SPACE, PDF_DEFAULT_LINE_SPACE_FACTOR, PDF_DEFAULT_FONT, PDF_DEFAULT_FONT_SIZE
-from constants.pdfData import  PDF_DPI, PDF_DPMM
+from constants.pdfData import  PDF_DPI, PDF_DPMM, PDF_MIN_FONT_SIZE, PDF_LAYOUT_CACHE_SIZE
+from constants.pdfData import PDF_OVERLAY_WRITER_DIRECT, PDF_DEFAULT_OVERLAY_WRITER, PDF_COMBINED_SPLIT_PAGES, PDF_STATIC_TEMPLATE_SUFFIX
+from constants.pdfData import PDF_STREAM_FONT_PREFIX, PDF_STREAM_FONT_ENCODING, PDF_STREAM_TEXT_ENCODING
+from constants.timingData import TIMING_LAYOUT, TIMING_DRAW, TIMING_MERGE, TIMING_SERIALIZE, TIMING_WRITE
+from projectutils.timingfunc import startSpan, endSpan
+#PyPDF2 and reportlab are imported by the functions that use them, so they are loaded
+#only when the first PDF is read or drawn. See bench/importtime.py
 
-def addOverlayToPdf(PdfTemplateName, PdfTemplatePage, outputFileName, pdfOverlayList):
+logger = logging.getLogger(__name__)
+
+#parsed template PDF files, by file name. Each process parses a template only once
+pdfTemplateCache = {}
+#PdfReader is not thread safe, copying pages from a cached template is done one at a time
+pdfTemplateLock = threading.Lock()
+#font dictionaries of the content stream writer, by font name
+streamFontCache = {}
+
+#Type 1 font character widths at size 1000, by font name and character
+glyphWidthCache = {}
+#layout cache hits and misses of the worker processes, and the counts of this process
+#already sent to the main process, see takeLayoutCacheCounts
+layoutCacheState = {"hits": 0, "misses": 0, "takenHits": 0, "takenMisses": 0}
+layoutCacheLock = threading.Lock()
+
+#compiled params of an overlay, see compileOverlayParams. x, y and the measures are in points
+OverlayParam = namedtuple("OverlayParam", ["x", "y", "font", "fontSize", "lineHeight", "function"])
+#compiled text function, e.g. SrinkToFit(width, maxLines, indent)
+TextFunction = namedtuple("TextFunction", ["name", "width", "maxLines", "indent"])
+#a line of text laid out by getTextLines. fontSize, lineSpace and setCursor are None when not changed
+TextLine = namedtuple("TextLine", ["text", "fontSize", "lineSpace", "setCursor"])
+
+def loadPdfTemplate(PdfTemplateName):
+    """ Returns the parsed template PDF, parse and cache it if this is the first use.
+        The file is read in to memory and closed, the reader does not keep it open.
+    Args:   PdfTemplateName (string) : Template PDF file name
+    Returns: PdfReader: the parsed template"""
+    from PyPDF2 import PdfReader
+    with pdfTemplateLock:
+        if not PdfTemplateName in pdfTemplateCache:
+            logger.debug("Open PDF template %s", PdfTemplateName)
+            with open(PdfTemplateName, "rb") as templateFile:
+                pdfTemplateCache[PdfTemplateName] = PdfReader(io.BytesIO(templateFile.read()))
+        return pdfTemplateCache[PdfTemplateName]
+
+def preloadPdfTemplate(PdfTemplateName):
+    """ Parse the template PDF file in to the cache before the records are processed.
+    Args:   PdfTemplateName (string) : Template PDF file name
+    Returns: int: Error codes"""
+    try:
+        loadPdfTemplate(PdfTemplateName)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return ERROR_UNKNOWN
+    return ERROR_SUCCESS
+
+def flattenPdfTemplate(PdfTemplateName, PdfTemplatePage, pdfOverlayList, overlayWriter=PDF_DEFAULT_OVERLAY_WRITER):
+    """ Draw the overlays that are the same for every record on the template page once,
+        and cache the result as a new template. The records only draw their own data.
+    Args:   PdfTemplateName (string) : Template PDF file name
+            PdfTemplatePage (int) : Zero based template page number
+            pdfOverlayList (list) : List of directories with name, string and param
+            overlayWriter (string) : see addOverlayToPdf
+    Returns: string: name of the new template in the cache, or error code"""
+    from PyPDF2 import PdfWriter, PdfReader
+    staticTemplateName = PdfTemplateName + PDF_STATIC_TEMPLATE_SUFFIX
+    with pdfTemplateLock:
+        if staticTemplateName in pdfTemplateCache:
+            return staticTemplateName
+    logger.debug("+Fn flattenPdfTemplate %s %s overlays", PdfTemplateName, len(pdfOverlayList))
+    try:
+        templatePdf = loadPdfTemplate(PdfTemplateName)
+        output = PdfWriter()
+        for pageNumber in range(len(templatePdf.pages)):
+            if pageNumber == PdfTemplatePage:
+                returnValue = addOverlayPage(output, PdfTemplateName, PdfTemplatePage, pdfOverlayList, overlayWriter)
+                if not ERROR_SUCCESS == returnValue:
+                    return returnValue
+            else:
+                with pdfTemplateLock:
+                    output.add_page(templatePdf.pages[pageNumber])
+        staticByteIO = io.BytesIO()
+        output.write(staticByteIO)
+        with pdfTemplateLock:
+            pdfTemplateCache[staticTemplateName] = PdfReader(io.BytesIO(staticByteIO.getvalue()))
+    except Exception as e:
+        logger.error("Error: %s", e)
+        logger.error("ERROR [- Fn flattenPdfTemplate]")
+        return ERROR_UNKNOWN
+    return staticTemplateName
+
+def addTemplatePage(outputPdf, PdfTemplateName, PdfTemplatePage, overlayPage):
+    """ Merge overlayPage on to a copy of a template page, and add it to outputPdf.
+        The copy shares the parsed objects of the cached template, and the template
+        page itself is not changed, so it can be used for the next record.
+    Args:   outputPdf (PdfWriter) : PDF to add the page to
+            PdfTemplateName (string) : Template PDF file name
+            PdfTemplatePage (int) : Zero based template page number
+            overlayPage (PageObject) : page to merge on the template page
+    Returns: PageObject: the page in outputPdf"""
+    from PyPDF2 import PageObject
+    templatePdf = loadPdfTemplate(PdfTemplateName)
+    with pdfTemplateLock:
+        page = PageObject(templatePdf)
+        page.update(templatePdf.pages[PdfTemplatePage])
+        page.merge_page(overlayPage)
+        return outputPdf.add_page(page)
+
+def addOverlayToPdf(PdfTemplateName, PdfTemplatePage, outputFileName, pdfOverlayList, overlayWriter=PDF_DEFAULT_OVERLAY_WRITER):
     """ Create a new PDF from PdfTemplateName, with overlay text. Please note the output
         page is always a single page. <TODO> Add support for multipage documents
     Args:   PdfTemplateName (string) : Template PDF file name
             PdfTemplatePage (int) : Zero based template page number
             outputFileName (string) : output file name
             pdfOverlayList (list) : List of directories
+            overlayWriter (string) : PDF_OVERLAY_WRITER_DIRECT to write the text straight in to
+                                     the page content, or PDF_OVERLAY_WRITER_REPORTLAB
     Returns: int: Error codes"""
 
-    print("+Fn addOverlayToPdf", PdfTemplateName,outputFileName)
+    logger.debug("+Fn addOverlayToPdf %s %s", PdfTemplateName, outputFileName)
+    pdfData = getOverlayPdfData(PdfTemplateName, PdfTemplatePage, pdfOverlayList, overlayWriter)
+    if not isinstance(pdfData, bytes):
+        return pdfData
+    try:
+        # finally, write "output" to a real file
+        logger.debug("Open Output file")
+        with open(outputFileName, "wb") as outPutFile:
+            logger.debug("Write to File..")
+            outPutFile.write(pdfData)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        logger.error("ERROR [- Fn addOverlayToPdf]")
+        return ERROR_UNKNOWN
+    logger.debug("-Fn addOverlayToPdf")
+    return ERROR_SUCCESS
+
+def getOverlayPdfData(PdfTemplateName, PdfTemplatePage, pdfOverlayList, overlayWriter=PDF_DEFAULT_OVERLAY_WRITER):
+    """ Create a new PDF from PdfTemplateName with overlay text, in memory.
+    Args:   see addOverlayToPdf
+    Returns: bytes: the PDF file, or error code"""
+    from PyPDF2 import PdfWriter
+    try:
+        output = PdfWriter()
+        returnValue = addOverlayPage(output, PdfTemplateName, PdfTemplatePage, pdfOverlayList, overlayWriter)
+        if not ERROR_SUCCESS == returnValue:
+            return returnValue
+        spanStart = startSpan()
+        outputByteIO = io.BytesIO()
+        output.write(outputByteIO)
+        endSpan(TIMING_SERIALIZE, spanStart)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        logger.error("ERROR [- Fn getOverlayPdfData]")
+        return ERROR_UNKNOWN
+    return outputByteIO.getvalue()
+
+def addOverlayPage(outputPdf, PdfTemplateName, PdfTemplatePage, pdfOverlayList, overlayWriter=PDF_DEFAULT_OVERLAY_WRITER):
+    """ Add a copy of the template page with the overlay text to outputPdf.
+    Args:   outputPdf (PdfWriter) : PDF to add the page to
+            PdfTemplateName (string) : Template PDF file name
+            PdfTemplatePage (int) : Zero based template page number
+            pdfOverlayList (list) : List of directories with name, string and param (OverlayParam)
+            overlayWriter (string) : see addOverlayToPdf
+    Returns: int: Error codes"""
+    if PDF_OVERLAY_WRITER_DIRECT == overlayWriter and isStreamWritable(pdfOverlayList):
+        return addOverlayStreamPage(outputPdf, PdfTemplateName, PdfTemplatePage, pdfOverlayList)
+    return addOverlayCanvasPage(outputPdf, PdfTemplateName, PdfTemplatePage, pdfOverlayList)
+
+def openCombinedPdf(outputFileName, splitPages=PDF_COMBINED_SPLIT_PAGES):
+    """ Start a combined output, that adds the page of every record to one PDF file.
+    Args:   outputFileName (string) : output file name
+            splitPages (int) : start a new file after this many pages, 0 for one file
+    Returns: directory: the combined output state"""
+    from PyPDF2 import PdfWriter
+    logger.debug("+Fn openCombinedPdf %s %s", outputFileName, splitPages)
+    return {"fileName": outputFileName, "splitPages": splitPages, "writer": PdfWriter(),
+            "part": 1, "pageCount": 0, "index": [], "fileList": []}
+
+def getCombinedPartName(combinedPdf):
+    """ File name of the current part. Parts are numbered only when the output is split."""
+    if not combinedPdf["splitPages"]:
+        return combinedPdf["fileName"]
+    baseName, extension = os.path.splitext(combinedPdf["fileName"])
+    return "%s-%04d%s" % (baseName, combinedPdf["part"], extension)
+
+def writeCombinedPart(combinedPdf):
+    """ Write the pages of the current part to disk, and start the next part."""
+    from PyPDF2 import PdfWriter
+    if combinedPdf["pageCount"] < 1:
+        return ERROR_SUCCESS
+    partName = getCombinedPartName(combinedPdf)
+    logger.info("Write combined PDF %s %s pages", partName, combinedPdf["pageCount"])
+    spanStart = startSpan()
+    with open(partName, "wb") as outPutFile:
+        combinedPdf["writer"].write(outPutFile)
+    endSpan(TIMING_WRITE, spanStart, partName)
+    combinedPdf["fileList"].append(partName)
+    combinedPdf["writer"] = PdfWriter()
+    combinedPdf["part"] = combinedPdf["part"] + 1
+    combinedPdf["pageCount"] = 0
+    return ERROR_SUCCESS
+
+def addRecordToCombinedPdf(combinedPdf, recordId, PdfTemplateName, PdfTemplatePage, pdfOverlayList, overlayWriter=PDF_DEFAULT_OVERLAY_WRITER):
+    """ Add the page of a record to the combined output, and to the page index.
+    Args:   combinedPdf (directory) : combined output state, from openCombinedPdf
+            recordId (directory) : record with "key" and "identifier"
+            PdfTemplateName (string) : Template PDF file name
+            PdfTemplatePage (int) : Zero based template page number
+            pdfOverlayList (list) : List of directories
+            overlayWriter (string) : see addOverlayToPdf
+    Returns: int: Error codes"""
+    try:
+        returnValue = addOverlayPage(combinedPdf["writer"], PdfTemplateName, PdfTemplatePage, pdfOverlayList, overlayWriter)
+        if not ERROR_SUCCESS == returnValue:
+            return returnValue
+        combinedPdf["pageCount"] = combinedPdf["pageCount"] + 1
+        combinedPdf["index"].append({"key": recordId["key"], "identifier": recordId["identifier"],
+                                     "file": getCombinedPartName(combinedPdf), "page": combinedPdf["pageCount"]})
+        if combinedPdf["splitPages"] and combinedPdf["pageCount"] >= combinedPdf["splitPages"]:
+            return writeCombinedPart(combinedPdf)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        logger.error("ERROR [- Fn addRecordToCombinedPdf]")
+        return ERROR_UNKNOWN
+    return ERROR_SUCCESS
+
+def closeCombinedPdf(combinedPdf):
+    """ Write the remaining pages of the combined output.
+    Returns: int: Error codes"""
+    try:
+        returnValue = writeCombinedPart(combinedPdf)
+    except Exception as e:
+        logger.error("Error: %s", e)
+        logger.error("ERROR [- Fn closeCombinedPdf]")
+        return ERROR_UNKNOWN
+    logger.debug("-Fn closeCombinedPdf %s", combinedPdf["fileList"])
+    return returnValue
+
+def addOverlayCanvasPage(outputPdf, PdfTemplateName, PdfTemplatePage, pdfOverlayList):
+    """ Draw the overlay on a reportlab canvas, and merge it on a copy of the template page.
+    Args:   outputPdf (PdfWriter) : PDF to add the page to
+            PdfTemplateName (string) : Template PDF file name
+            PdfTemplatePage (int) : Zero based template page number
+            pdfOverlayList (list) : List of directories, with compiled params
+    Returns: int: Error codes"""
+    from PyPDF2 import PdfReader
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen.textobject import PDFTextObject
     #create a canvas and add the overlay data
+    spanStart = startSpan()
     overlayByteIO = io.BytesIO()
     overlayCanvas = canvas.Canvas(overlayByteIO, pagesize=letter)
     #process multiline if any
     for overlay in pdfOverlayList :
-        #mandatory fields
-        overlay = validateParams(overlay)
-        if (None == overlay["param"]["X"] or None == overlay["param"]["Y"]):
-            print("ERROR [- Fn addOverlayToPdf]: invalid coordinates: Bad arguments")
-            return ERROR_UNKNOWN
-        print(overlay["param"]["X"], overlay["param"]["Y"], overlay["string"])
         #process the text Line
         textObj = getTextObj(overlayCanvas,overlay["string"],overlay["param"])
         if not isinstance(textObj, PDFTextObject):
-            print("ERROR [- Fn addOverlayToPdf]: Can not find the text Object: Bad arguments")
+            logger.error("ERROR [- Fn addOverlayToPdf]: Can not find the text Object: Bad arguments")
             return ERROR_UNKNOWN
         else:
             overlayCanvas.drawText(textObj)
     overlayCanvas.save()
     #move to the beginning of the StringIO buffer
     overlayByteIO.seek(0)
-    print("create a blank PDF with overlay")
+    logger.debug("create a blank PDF with overlay")
+    # create a new PDF with text overlay
+    overlayPdf = PdfReader(overlayByteIO)
+    endSpan(TIMING_DRAW, spanStart)
+    # add the "watermark" (which is the new pdf) on a copy of the template page
+    logger.debug("Merge the overlay now..!")
+    spanStart = startSpan()
+    addTemplatePage(outputPdf, PdfTemplateName, PdfTemplatePage, overlayPdf.pages[PDF_FIRST_PAGE]) #overlayPdf has only one page
+    endSpan(TIMING_MERGE, spanStart)
+    return ERROR_SUCCESS
+
+def getStreamFont(fontName):
+    """ Returns the resource name and the font dictionary of a standard font, for the
+        overlay content stream. The dictionaries are created once and shared by all pages.
+    Args:   fontName (string) : standard font name, e.g. Helvetica
+    Returns: tuple: (resource name, DictionaryObject)"""
+    from PyPDF2.generic import DictionaryObject, NameObject
+    with pdfTemplateLock:
+        if not fontName in streamFontCache:
+            fontDict = DictionaryObject()
+            fontDict[NameObject("/Type")] = NameObject("/Font")
+            fontDict[NameObject("/Subtype")] = NameObject("/Type1")
+            fontDict[NameObject("/BaseFont")] = NameObject("/" + fontName)
+            fontDict[NameObject("/Encoding")] = NameObject("/" + PDF_STREAM_FONT_ENCODING)
+            resourceName = PDF_STREAM_FONT_PREFIX + str(len(streamFontCache) + 1)
+            streamFontCache[fontName] = (resourceName, fontDict)
+        return streamFontCache[fontName]
+
+def isStreamFont(fontName):
+    """ True if the font is a standard font with WinAnsi encoding, that the content
+        stream writer can use without embedding."""
+    from reportlab.pdfbase import pdfmetrics
+    return fontName in pdfmetrics.standardFonts and PDF_STREAM_FONT_ENCODING == pdfmetrics.getFont(fontName).encoding.name
+
+def isStreamWritable(pdfOverlayList):
+    """ True if the content stream writer can write every overlay in the list. Other fonts
+        and text that is not in the WinAnsi character set go through reportlab."""
+    for overlay in pdfOverlayList:
+        if not isStreamFont(overlay["param"].font):
+            return False
+        try:
+            str(overlay["string"]).encode(PDF_STREAM_TEXT_ENCODING)
+        except UnicodeEncodeError:
+            return False
+    return True
+
+def getOverlayStream(pdfOverlayList):
+    """ Write the text operators (BT/Tf/Td/Tj) of the overlay list, the same way
+        getTextObj and canvas.drawText would.
+    Args:   pdfOverlayList (list) : List of directories, with compiled params
+    Returns: tuple: (content stream bytes, list of font names used) or error code"""
+    from reportlab.lib.rl_accel import fp_str, escapePDF
+    streamCode = []
+    fontList = []
+    #reportlab starts each page with the default font, and the font stays until it is changed
+    fontState = [PDF_DEFAULT_FONT, PDF_DEFAULT_FONT_SIZE]
+    def setFont(fontName, fontSize):
+        fontState[0] = fontName
+        fontState[1] = fontSize
+        if not fontName in fontList:
+            fontList.append(fontName)
+        streamCode.append("%s %s Tf" % (getStreamFont(fontName)[0], fp_str(fontSize)))
+    for overlay in pdfOverlayList:
+        params = overlay["param"]
+        textLines = getTextLines(None, overlay["string"], params)
+        if not isinstance(textLines, tuple):
+            logger.error("ERROR [getOverlayStream]. Can not print emplty line")
+            return ERROR_UNKNOWN
+        if not None == params.function:
+            #SrinkToFit leaves the canvas font at the size it picked
+            fontState[0] = params.font
+            fontState[1] = textLines[0].fontSize if len(textLines) > 0 else params.fontSize
+        lineSpace = params.lineHeight
+        streamCode.append("BT 1 0 0 1 %s Tm" % fp_str(params.x, params.y))
+        setFont(fontState[0], fontState[1])
+        for textLine in textLines:
+            if isinstance(textLine.fontSize,int):
+                setFont(params.font, textLine.fontSize)
+            if isinstance(textLine.lineSpace,int):
+                lineSpace = textLine.lineSpace
+            if isinstance(textLine.setCursor,int):
+                streamCode.append("%s Td" % fp_str(textLine.setCursor, -lineSpace))
+            streamCode.append("(%s) Tj" % escapePDF(str(textLine.text).encode(PDF_STREAM_TEXT_ENCODING)))
+        streamCode.append("ET")
+    return ("\n".join(streamCode).encode("latin-1"), fontList)
+
+def addOverlayStreamPage(outputPdf, PdfTemplateName, PdfTemplatePage, pdfOverlayList):
+    """ Add a copy of the template page to outputPdf, and append the overlay text as a
+        content stream. This skips drawing on a reportlab canvas and parsing it back.
+    Args:   outputPdf (PdfWriter) : PDF to add the page to
+            PdfTemplateName (string) : Template PDF file name
+            PdfTemplatePage (int) : Zero based template page number
+            pdfOverlayList (list) : List of directories, with compiled params
+    Returns: int: Error codes"""
+    from PyPDF2.generic import ArrayObject, DictionaryObject, NameObject
+    spanStart = startSpan()
+    overlayStream = getOverlayStream(pdfOverlayList)
+    endSpan(TIMING_DRAW, spanStart)
+    if not isinstance(overlayStream, tuple):
+        return ERROR_UNKNOWN
+    streamData, fontList = overlayStream
+    spanStart = startSpan()
+    templatePdf = loadPdfTemplate(PdfTemplateName)
+    with pdfTemplateLock:
+        #add_page copies the template page, the cached template is not changed
+        page = outputPdf.add_page(templatePdf.pages[PdfTemplatePage])
+    #keep the template graphics state away from the overlay, same as merge_page
+    contentList = ArrayObject([getStreamObject(outputPdf, b"q\n")])
+    if "/Contents" in page:
+        if isinstance(page["/Contents"], ArrayObject):
+            contentList.extend(page["/Contents"])
+        else:
+            contentList.append(page.raw_get("/Contents"))
+    contentList.append(getStreamObject(outputPdf, b"\nQ\n" + streamData))
+    page[NameObject("/Contents")] = contentList
+    #add the fonts to a copy of the page resources
+    resources = DictionaryObject()
+    if "/Resources" in page:
+        resources.update(page["/Resources"])
+    fontResources = DictionaryObject()
+    if "/Font" in resources:
+        fontResources.update(resources["/Font"])
+    for fontName in fontList:
+        resourceName, fontDict = getStreamFont(fontName)
+        fontResources[NameObject(resourceName)] = fontDict
+    resources[NameObject("/Font")] = fontResources
+    page[NameObject("/Resources")] = resources
+    endSpan(TIMING_MERGE, spanStart)
+    return ERROR_SUCCESS
+
+def getStreamObject(outputPdf, data):
+    """ Returns a reference to a new compressed stream object in outputPdf"""
+    from PyPDF2.generic import DecodedStreamObject
+    streamObject = DecodedStreamObject()
+    streamObject.set_data(data)
+    return outputPdf._add_object(streamObject.flate_encode())
+
+def compileOverlayParams(param):
+    """ Compile the params of an overlay from the template. X,Y can be from any measure.
+        We support pix, mm and inch only. Here we cconvert them all to pix to be used in PDF.
+        Some of the parameters are optional in the template, but mandatory for the
+        textObject. So set them to default.
+    Args:   param (directory) : params from the template
+    Returns: OverlayParam, or error code"""
+    from reportlab.pdfbase import pdfmetrics
+    if not isinstance(param, dict):
+        logger.error("ERROR [compileOverlayParams]: missing params")
+        return ERROR_UNKNOWN
+    x = getpixelCount(param.get("X"))
+    y = getpixelCount(param.get("Y"))
+    if (None == x or None == y):
+        logger.error("ERROR [compileOverlayParams]: invalid coordinates: Bad arguments")
+        return ERROR_UNKNOWN
+    font = param.get("Font", PDF_DEFAULT_FONT)
     try:
-        # create a new PDF with text overlay
-        overlayPdf = PdfReader(overlayByteIO)
-        # read your existing PDF
-        print("Open PDF template")
-        templatePdf = PdfReader(open(PdfTemplateName, "rb"))
-        output = PdfWriter()
-        # add the "watermark" (which is the new pdf) on the existing page
-        page = templatePdf.pages[PdfTemplatePage]
-        print("Merge the overlay now..!")
-        page.merge_page(overlayPdf.pages[PDF_FIRST_PAGE]) #overlayPdf has only one page
-        print("Add the page to ourputFile..")
-        output.add_page(page)
-        # finally, write "output" to a real file
-        print("Open Output file")
-        outPutFile = open(outputFileName, "wb")
-        print("Write to File..")
-        output.write(outPutFile)
-        outPutFile.close()
+        pdfmetrics.getFont(font)
     except Exception as e:
-        print(f"Error: {e}")
-        print("ERROR [- Fn addOverlayToPdf]")
+        logger.error("Error: %s", e)
+        logger.error("ERROR [compileOverlayParams]: unknown font %s", font)
         return ERROR_UNKNOWN
-    print("-Fn addOverlayToPdf")
-    return ERROR_SUCCESS
+    fontSize = param.get("FontSize", PDF_DEFAULT_FONT_SIZE)
+    lineSpace = param.get("LineSpace", PDF_DEFAULT_LINE_SPACE)
+    function = compileTextFunction(param.get("Function"))
+    if isinstance(function, int):
+        return function
+    return OverlayParam(x, y, font, fontSize, getLineHeight(fontSize, lineSpace), function)
 
+def compileTextFunction(function):
+    """ Compile the text function of an overlay, with the measures in points.
+    Args:   function (directory) : function name and params, or None
+    Returns: TextFunction, None if there is no function, or error code"""
+    if None == function:
+        return None
+    if not isinstance(function, dict) or not "SrinkToFit" == function["name"]:
+        # Not a supported function
+        logger.error("Error: [compileTextFunction] not a supported Function %s", function)
+        return ERROR_UNKNOWN
+    width = getpixelCount(function.get("param1")) #input can be in mm, inch or pix
+    if None == width:
+        logger.error("Error: [compileTextFunction] unsupported width %s", function.get("param1"))
+        return ERROR_UNKNOWN
+    #set the indentation for the first line if defined.
+    indent = getpixelCount(function.get("param3"))
+    if(None == indent):
+        #unsupported param #3
+        logger.debug("unsupported Indentation, SKIP set cursor function.")
+        indent = 0
+    return TextFunction(function["name"], width, int(function["param2"]), indent)
 
-def validateParams(overlay):
-    """ X,Y can be from any measure. We support pix, mm and inch
-        only. Here we cconvert them all to pix to be used in PDF"""    
-    overlay["param"]["X"] = getpixelCount(overlay["param"]["X"])
-    overlay["param"]["Y"] = getpixelCount(overlay["param"]["Y"])
-    """ Some of the parameters are optional in the template, but
-        mandatory for the textObject. So set them to default"""
-    if not "param" in overlay:
+def getTextLines(canvas, text, params):
+    """ Breaks the text in to lines, based on the text function in params.
+        canvas can be None when the text is not drawn on a reportlab canvas.
+    Returns: tuple: TextLine items, or error code"""
+    if None == params.function:
+        logger.debug("[addOverlayToPdf] No extra text proccesisng")
+        return (TextLine(str(text), params.fontSize, params.lineHeight, None),)
+    #Breaks the text in to lines and adjust font for each line based on rules
+    logger.debug("[addOverlayToPdf] Call text proccesing")
+    spanStart = startSpan()
+    textLines = getTextLayout(str(text), params.font, params.fontSize, params.function)
+    endSpan(TIMING_LAYOUT, spanStart)
+    if not isinstance(textLines,tuple):
+        logger.error("ERROR [getTextObj]. Can not print emplty line")
         return ERROR_UNKNOWN
-    if not "Font" in overlay["param"]:
-        overlay["param"]["Font"] = PDF_DEFAULT_FONT
-    if not "FontSize" in overlay["param"]:
-        overlay["param"]["FontSize"] = PDF_DEFAULT_FONT_SIZE
-    if not "LineSpace" in overlay["param"]:
-        overlay["param"]["LineSpace"] = PDF_DEFAULT_LINE_SPACE
-    if not "Function" in overlay["param"]:
-        overlay["param"]["Function"] = None
+    # Set the font to the size that fits
+    if not None == canvas:
+        canvas.setFont(params.font, textLines[0].fontSize if len(textLines) > 0 else params.fontSize)
+    return textLines
+
+@lru_cache(maxsize=PDF_LAYOUT_CACHE_SIZE, typed=True)
+def getTextLayout(text, font, fontSize, function):
+    """ Returns the lines of the text from processFunc. The same addresses and clauses
+        repeat in a batch, so the last PDF_LAYOUT_CACHE_SIZE layouts are kept. The cache
+        is typed, a FontSize of 12 and 12.0 are laid out separately, as the line font
+        sizes keep the type of fontSize.
+    Args:   text (string) : text to lay out
+            font (string) : font name
+            fontSize (int) : font size
+            function (TextFunction) : compiled text function
+    Returns: tuple: TextLine items, or error code"""
+    return processFunc(None, text, font, fontSize, function)
+
+def getLayoutCacheInfo():
+    """ Returns the hits, misses and size of the layout cache of this process. The hits
+        and misses of the worker processes added with mergeLayoutCacheCounts are included"""
+    cacheInfo = getTextLayout.cache_info()
+    return cacheInfo._replace(hits=cacheInfo.hits + layoutCacheState["hits"], misses=cacheInfo.misses + layoutCacheState["misses"])
+
+def takeLayoutCacheCounts():
+    """ Hits and misses of the layout cache of this process since the last call, e.g. to
+        send them from a worker process to the main process, see mergeLayoutCacheCounts
+    Returns: tuple: hits, misses"""
+    cacheInfo = getTextLayout.cache_info()
+    with layoutCacheLock:
+        layoutCounts = (cacheInfo.hits - layoutCacheState["takenHits"], cacheInfo.misses - layoutCacheState["takenMisses"])
+        layoutCacheState["takenHits"] = cacheInfo.hits
+        layoutCacheState["takenMisses"] = cacheInfo.misses
+    return layoutCounts
 
-    return overlay
+def mergeLayoutCacheCounts(layoutCounts):
+    """ Add the hits and misses taken with takeLayoutCacheCounts to the layout cache info"""
+    with layoutCacheLock:
+        layoutCacheState["hits"] = layoutCacheState["hits"] + layoutCounts[0]
+        layoutCacheState["misses"] = layoutCacheState["misses"] + layoutCounts[1]
 
 def getTextObj(canvas,text, params):
     """ returns a text object with the data given. The text object has the capability of 
         holding multiple lines with different formats."""
-    print("Fn getTextLine")
-    textLines = []
-    lineSpace = getLineHeight(params["FontSize"], params["LineSpace"])
-    if None == params["Function"]:
-        print("[addOverlayToPdf] No extra text proccesisng")
-        textLines.append({"text": str(text), "fontSize": params["FontSize"], "lineSpace": lineSpace, "set_cursor": None})
-    else:
-        #Breaks the text in to lines and adjust font for each line based on rules
-        print("[addOverlayToPdf] Call text proccesing")
-        textLines = processFunc(canvas,text, params["Font"], params["FontSize"], params["Function"])
-        if not isinstance(textLines,list):
-            print ("ERROR [getTextObj]. Can not print emplty line")
-            return ERROR_UNKNOWN
-    textObj = canvas.beginText( params["X"],  params["Y"])
+    logger.debug("Fn getTextLine")
+    lineSpace = params.lineHeight
+    textLines = getTextLines(canvas, text, params)
+    if not isinstance(textLines,tuple):
+        return ERROR_UNKNOWN
+    textObj = canvas.beginText( params.x,  params.y)
     #store text lines based on rules
     for textLine in textLines:
-        if isinstance(textLine["fontSize"],int):
-            textObj.setFont(params["Font"],textLine["fontSize"])
-        if isinstance(textLine["lineSpace"],int):
-            lineSpace = textLine["lineSpace"]
-        if isinstance(textLine["set_cursor"],int):
-            textObj.moveCursor(textLine["set_cursor"], lineSpace)
+        if isinstance(textLine.fontSize,int):
+            textObj.setFont(params.font,textLine.fontSize)
+        if isinstance(textLine.lineSpace,int):
+            lineSpace = textLine.lineSpace
+        if isinstance(textLine.setCursor,int):
+            textObj.moveCursor(textLine.setCursor, lineSpace)
         else:
-            print("[getTextObj] not moving curser.!")
-        print (type(textLine["text"]), textLine["text"])
-        textObj.textOut(textLine["text"])
+            logger.debug("[getTextObj] not moving curser.!")
+        logger.debug("%s %s", type(textLine.text), textLine.text)
+        textObj.textOut(textLine.text)
     return textObj
 
 
@@ -141,69 +562,105 @@ def getLineHeight(fontSize, lineSpace):
         
 def processFunc(canvas, text, font, fontSize, function):
     """ Function to alter the text, and return multi lines to process """
-    if "SrinkToFit" == function["name"]:
-        global cursorPosition # Declare global
-        cursorPosition = 0 # initiate Absolute Cursor Position
-        # internal Function to get the width of the text
-        def getTextWidth(text, fontSize):
-            return canvas.stringWidth(text, font, fontSize)
-        #main code starts here.
-        def getCursorMove(newPosition):
-            global cursorPosition #Access global
-            cursorMove = newPosition - cursorPosition
-            cursorPosition = newPosition # rememnber the new posision
-            return cursorMove
-        def getWidth(width,indent):
-            return width - indent
-        width = getpixelCount(function["param1"]) #input can be in mm, inch or pix
-        #set the indentation for the first line if defined.
-        indent = getpixelCount(function.get("param3"))
-        if(None == indent):
-            #unsupported param #3
-            print("unsupported Indentation, SKIP set cursor function.")
-            indent = 0
-        maxLines = int(function["param2"])
-        textLines = []
+    if "SrinkToFit" == function.name:
+        #measures are in points, see compileTextFunction
+        width = function.width
+        indent = function.indent
+        maxLines = function.maxLines
         words = str(text).split(' ')
-        # Try reducing font size until the text fits
-        while True:
-            set_cursor = getCursorMove(indent)
-            # Set the font to the current size
-            canvas.setFont(font, fontSize)
-            lineWidth = getWidth(width,indent)
-            currentLine = ""
-            # Loop through words to form lines that fit within the width
-            for word in words:
-                testLine = currentLine + (" " + word if currentLine else word)
-                if getTextWidth(testLine, fontSize) <= lineWidth:
-                    currentLine = testLine
+        wordWidths = getWordWidths(words, font)
+        # Try the font sizes from fontSize down to the minimum, 1 pt at a time. Smaller
+        # fonts never need more lines, so look for the largest size that fits with a binary search
+        sizeCount = 1 + max(0, math.floor(fontSize - PDF_MIN_FONT_SIZE))
+        textLines = wrapWords(words, wordWidths, font, fontSize, width, indent)
+        if len(textLines) > maxLines:
+            textLines = ERROR_LONG_TEXT
+            low, high = 1, sizeCount - 1
+            while low <= high:
+                sizeStep = (low + high) // 2
+                testLines = wrapWords(words, wordWidths, font, fontSize - sizeStep, width, indent)
+                if len(testLines) <= maxLines:
+                    textLines = testLines
+                    high = sizeStep - 1
                 else:
-                    textLines.append({"text": (currentLine), "fontSize": fontSize, "lineSpace": None, "set_cursor": set_cursor})
-                    set_cursor = getCursorMove(0) # Return cursor to 0 from next line onwards
-                    lineWidth = getWidth(width,0) # reset the width
-                    currentLine = word
-
-            # Append the last line, regardless of how many lines have been created
-            if currentLine:
-                textLines.append({"text": (currentLine), "fontSize": fontSize, "lineSpace": None, "set_cursor": set_cursor})
-
-            # Check if the number of lines is less than or equal to the allowed number of lines
-            if len(textLines) <= maxLines:
-                break
-
-            # Reduce the font size if the text still doesn't fit
-            fontSize -= 1
-            textLines = []
-            if fontSize < 6:  # Set a minimum font size limit
-                print ("ERROR [constWidth]. The text line is too long to fit to [" + str(width) + "] pixels x [" + str(maxLines) + "] lines")
-                return ERROR_LONG_TEXT
-            #end of While (true)
+                    low = sizeStep + 1
+        if not isinstance(textLines, tuple):
+            logger.error("ERROR [constWidth]. The text line is too long to fit to [%s] pixels x [%s] lines", width, maxLines)
+            return ERROR_LONG_TEXT
+        # Set the font to the size that fits
+        if not None == canvas:
+            canvas.setFont(font, textLines[0].fontSize if len(textLines) > 0 else fontSize)
         return textLines # we get here only if there is a good decode.
     else:
         # Not a supported function
-        print("Error: [processFunc] not a supported Function ")
+        logger.error("Error: [processFunc] not a supported Function ")
         return text
 
+def wrapWords(words, wordWidths, font, fontSize, width, indent):
+    """ Break the words in to lines that fit in the width, at the given font size.
+        The first line is indented, and the cursor moves back to 0 from the next line.
+    Args:   words (list) : words of the text
+            wordWidths (list) : width of each word at size 1000 from getWordWidths, or
+                                None to measure each line with reportlab
+            font (string) : font name
+            fontSize (int) : font size
+            width (int) : line width in points
+            indent (int) : first line indent in points
+    Returns: tuple: TextLine items"""
+    from reportlab.pdfbase import pdfmetrics
+    textLines = []
+    set_cursor = indent
+    lineWidth = width - indent
+    currentLine = ""
+    currentWidth = 0
+    if not None == wordWidths:
+        spaceWidth = getGlyphWidth(font, " ")
+    # Loop through words to form lines that fit within the width
+    for wordIndex, word in enumerate(words):
+        testLine = currentLine + (" " + word if currentLine else word)
+        if None == wordWidths:
+            fits = pdfmetrics.stringWidth(testLine, font, fontSize) <= lineWidth
+        else:
+            #same sum and scaling as reportlab stringWidth, so the line breaks do not change
+            testWidth = currentWidth + (spaceWidth + wordWidths[wordIndex] if currentLine else wordWidths[wordIndex])
+            fits = testWidth * 0.001 * fontSize <= lineWidth
+        if fits:
+            currentLine = testLine
+            if not None == wordWidths:
+                currentWidth = testWidth
+        else:
+            textLines.append(TextLine(currentLine, fontSize, None, set_cursor))
+            set_cursor = 0 - set_cursor if 0 == len(textLines) - 1 else 0 # Return cursor to 0 from next line onwards
+            lineWidth = width # reset the width
+            currentLine = word
+            if not None == wordWidths:
+                currentWidth = wordWidths[wordIndex]
+    # Append the last line, regardless of how many lines have been created
+    if currentLine:
+        textLines.append(TextLine(currentLine, fontSize, None, set_cursor))
+    return tuple(textLines)
+
+def getGlyphWidth(font, glyph):
+    """ Returns the width of a character at font size 1000, from the cached width table."""
+    from reportlab.pdfbase import pdfmetrics
+    fontWidths = glyphWidthCache.get(font)
+    if None == fontWidths:
+        fontWidths = glyphWidthCache.setdefault(font, {})
+    glyphWidth = fontWidths.get(glyph)
+    if None == glyphWidth:
+        #Type 1 font widths are whole numbers at size 1000
+        glyphWidth = round(pdfmetrics.stringWidth(glyph, font, 1000))
+        fontWidths[glyph] = glyphWidth
+    return glyphWidth
+
+def getWordWidths(words, font):
+    """ Returns the width of each word at font size 1000, or None if the font widths
+        can not be added up exactly (TrueType fonts are measured with reportlab)."""
+    from reportlab.pdfbase import pdfmetrics
+    if pdfmetrics.getFont(font)._dynamicFont:
+        return None
+    return [sum(getGlyphWidth(font, glyph) for glyph in word) for word in words]
+
 
 def getpixelCount(measure):
     """get measure in pixels"""
@@ -0,0 +1,202 @@
+""" Scheduler Functions 
+    src/projectutils/schedulefunc.py 
+    This file contains the functions that run records on worker threads.
+    Author: vipulasrilanka@yahoo.com 
+    (c) 2024 """
+
+import itertools
+import logging
+import os
+import queue
+import threading
+from collections import deque, namedtuple
+from constants.errorcodes import ERROR_SUCCESS, ERROR_UNKNOWN
+from constants.processData import PROC_DEFAULT_WORKER_COUNT, PROC_QUEUE_SIZE_PER_WORKER, PROC_DEFAULT_SHARD_SIZE
+
+logger = logging.getLogger(__name__)
+
+#marks the end of the record list in the work queue
+END_OF_RECORDS = None
+
+#a stage of the record pipeline, see runRecordPipeline. stageFunc is called with the
+#result directory of a record, and returns an error code
+PipelineStage = namedtuple("PipelineStage", ["name", "stageFunc", "workerCount"])
+
+def recordFeeder(recordList, workQueue, workerCount, feederState):
+    """ Feeder thread. Puts the records on the work queue, followed by one end
+        marker per worker. If the record list fails, e.g. a Data sheet read while the
+        records are processed, the exception is kept in feederState["error"]."""
+    try:
+        for record in recordList:
+            workQueue.put(record)
+    except Exception as e:
+        logger.error("Error: Can not read the records: %s", e)
+        feederState["error"] = e
+    finally:
+        # always release the workers, even if the record list fails
+        for worker in range(workerCount):
+            workQueue.put(END_OF_RECORDS)
+
+def runPipelineStage(stage, result):
+    """ Run a stage on a result. Records that failed in an earlier stage are left as they are.
+    Args:   stage (PipelineStage) : the stage to run
+            result (directory) : "record" and "error". "stage" is set if the stage fails"""
+    if not ERROR_SUCCESS == result["error"]:
+        return
+    try:
+        result["error"] = stage.stageFunc(result)
+    except Exception as e:
+        logger.error("Error: [%s] %s", stage.name, e)
+        result["error"] = ERROR_UNKNOWN
+    if not ERROR_SUCCESS == result["error"]:
+        #report the stage the record failed in
+        result["stage"] = stage.name
+
+def stageWorker(stage, inQueue, outQueue, stageState, nextWorkerCount):
+    """ Worker thread of a pipeline stage. Runs the stage on each result from inQueue and
+        passes it on to outQueue. Records that failed in an earlier stage are passed on
+        as they are. The last worker of the stage to finish releases the next stage.
+    Args:   stage (PipelineStage) : the stage to run
+            inQueue (queue) : results from the previous stage
+            outQueue (queue) : results for the next stage
+            stageState (directory) : "lock" and the "running" worker count of the stage
+            nextWorkerCount (int) : number of workers of the next stage"""
+    while True:
+        result = inQueue.get()
+        if END_OF_RECORDS is result:
+            break
+        runPipelineStage(stage, result)
+        # blocks while the next stage is behind
+        outQueue.put(result)
+    with stageState["lock"]:
+        stageState["running"] = stageState["running"] - 1
+        if 0 == stageState["running"]:
+            for worker in range(nextWorkerCount):
+                outQueue.put(END_OF_RECORDS)
+
+def runRecordPipeline(recordList, stageList, resultFunc=None):
+    """ Stream the records through a list of stages, e.g. resolve, render and write. Each
+        stage has its own worker threads, and the stages are joined by bounded queues, so
+        a record moves on as soon as a stage is done with it. The slowest stage sets the
+        pace, and the records waiting in memory are limited by the queue sizes.
+    Args:   recordList (iterable) : records to process. Read as the pipeline has room
+            stageList (list) : PipelineStage items, in order. workerCount None for the default
+            resultFunc (function) : optional, called with each result directory, in completion order
+    Returns: tuple: (number of records, list of the results that failed, with the name of
+                     the "stage" they failed in)
+    Raises: the exception of the record list, if it fails while it is read"""
+    logger.debug("+Fn runRecordPipeline %s", [(stage.name, stage.workerCount) for stage in stageList])
+    workerCountList = [max(1, int(PROC_DEFAULT_WORKER_COUNT if None == stage.workerCount else stage.workerCount))
+                       for stage in stageList]
+    queueList = [queue.Queue(maxsize=workerCount * PROC_QUEUE_SIZE_PER_WORKER) for workerCount in workerCountList]
+    #the results of the last stage come back to this thread
+    queueList.append(queue.Queue(maxsize=PROC_QUEUE_SIZE_PER_WORKER))
+    resultSource = ({"record": record, "error": ERROR_SUCCESS} for record in recordList)
+    feederState = {"error": None}
+    threadList = [threading.Thread(target=recordFeeder, args=(resultSource, queueList[0], workerCountList[0], feederState), daemon=True)]
+    for stageIndex, stage in enumerate(stageList):
+        stageState = {"lock": threading.Lock(), "running": workerCountList[stageIndex]}
+        nextWorkerCount = workerCountList[stageIndex + 1] if stageIndex + 1 < len(stageList) else 1
+        threadList.extend(threading.Thread(target=stageWorker, daemon=True,
+                                           args=(stage, queueList[stageIndex], queueList[stageIndex + 1], stageState, nextWorkerCount))
+                          for worker in range(workerCountList[stageIndex]))
+    for thread in threadList:
+        thread.start()
+    recordCount = 0
+    failedList = []
+    while True:
+        # blocks until a record comes out of the last stage
+        result = queueList[-1].get()
+        if END_OF_RECORDS is result:
+            break
+        recordCount = recordCount + 1
+        if not None == resultFunc:
+            resultFunc(result)
+        if not ERROR_SUCCESS == result["error"]:
+            failedList.append(result)
+    for thread in threadList:
+        thread.join()
+    if not None == feederState["error"]:
+        #the records after the failure were not processed, the run has to fail
+        raise feederState["error"]
+    logger.debug("-Fn runRecordPipeline")
+    return recordCount, failedList
+
+def runRecordSerial(recordList, stageList, resultFunc=None):
+    """ Run the stages of runRecordPipeline on this thread, one record at a time. Used when
+        the run is profiled, as cProfile follows only the thread that enabled it.
+    Args:   see runRecordPipeline. The workerCount of the stages is not used
+    Returns: tuple: see runRecordPipeline"""
+    logger.debug("+Fn runRecordSerial %s", [stage.name for stage in stageList])
+    recordCount = 0
+    failedList = []
+    for record in recordList:
+        result = {"record": record, "error": ERROR_SUCCESS}
+        for stage in stageList:
+            runPipelineStage(stage, result)
+        recordCount = recordCount + 1
+        if not None == resultFunc:
+            resultFunc(result)
+        if not ERROR_SUCCESS == result["error"]:
+            failedList.append(result)
+    logger.debug("-Fn runRecordSerial")
+    return recordCount, failedList
+
+def runRecordShard(recordFunc, shard):
+    """ Process a shard of records in a worker process, see runRecordProcessPool"""
+    return [recordFunc(record) for record in shard]
+
+def runRecordProcessPool(recordList, recordFunc, initFunc, initArgs, workerCount=None, resultFunc=None, shardSize=PROC_DEFAULT_SHARD_SIZE,
+                         intakeFunc=None):
+    """ Process the records on a pool of worker processes. Each process runs initFunc
+        once at startup to load the shared data, then renders shards of shardSize
+        records. recordFunc and initFunc have to be module level functions.
+        The records are read a shard at a time, when the pool has room for the shard:
+        PROC_QUEUE_SIZE_PER_WORKER shards per worker, or fewer if intakeFunc says so.
+    Args:   recordList (iterable) : records to process
+            recordFunc (function) : called with a record in the worker, returns a directory
+                                    with "record" and "error"
+            initFunc (function) : called once in each worker process with initArgs
+            initArgs (tuple) : arguments for initFunc
+            workerCount (int) : number of worker processes, None for one per CPU
+            resultFunc (function) : optional, called with each result directory
+            shardSize (int) : number of records sent to a worker at a time
+            intakeFunc (function) : optional, called with the shards in the pool and the
+                                    room of the pool before a shard is read. Returns the
+                                    number of shards the pool can hold, 0 to stop reading
+    Returns: list: directories with "record" and "error", in the order of the shards"""
+    logger.debug("+Fn runRecordProcessPool workers = %s", workerCount)
+    #loaded only by the runs in the process mode
+    import multiprocessing
+    resultList = []
+    recordIter = iter(recordList)
+    shardSize = max(1, int(shardSize))
+    pendingLimit = (workerCount or os.cpu_count() or 1) * PROC_QUEUE_SIZE_PER_WORKER
+    pendingList = deque()
+    reading = True
+    with multiprocessing.Pool(workerCount, initializer=initFunc, initargs=initArgs) as pool:
+        while reading or len(pendingList) > 0:
+            if reading:
+                shardLimit = pendingLimit if None == intakeFunc else intakeFunc(len(pendingList), pendingLimit)
+                if 0 == shardLimit:
+                    reading = False
+                elif len(pendingList) < shardLimit:
+                    shard = list(itertools.islice(recordIter, shardSize))
+                    if 0 == len(shard):
+                        reading = False
+                    else:
+                        pendingList.append(pool.apply_async(runRecordShard, (recordFunc, shard)))
+                    continue
+                if 0 == len(pendingList):
+                    continue
+            #the pool is full, wait for the oldest shard
+            for result in pendingList.popleft().get():
+                resultList.append(result)
+                if not None == resultFunc:
+                    resultFunc(result)
+    logger.debug("-Fn runRecordProcessPool")
+    return resultList
+
+def getFailedRecords(resultList):
+    """ Returns the results of the records that did not complete successfully"""
+    return [result for result in resultList if not ERROR_SUCCESS == result["error"]]
@@ -0,0 +1,122 @@
+""" Timing Functions
+    src/projectutils/timingfunc.py
+    This file contains the timing spans of the record stages, and the run report.
+    A span is started with startSpan and ended with endSpan. When the timing is off
+    startSpan returns None and endSpan returns at once, so the spans can stay in the code.
+    Author: vipulasrilanka@yahoo.com
+    (c) 2024 """
+
+import heapq
+import logging
+import math
+import threading
+import time
+from array import array
+from constants.timingData import TIMING_PERCENTILE_LIST, TIMING_OUTLIER_COUNT
+
+logger = logging.getLogger(__name__)
+
+#durations of each span, and the slowest records of each span (min heaps)
+timingState = {"enabled": False, "spans": {}, "outliers": {}}
+timingLock = threading.Lock()
+#name of the record each thread is working on, see setSpanRecord
+spanRecord = threading.local()
+
+def enableTiming(enabled=True):
+    """ Turn the timing on or off, and drop the spans recorded so far"""
+    with timingLock:
+        timingState["enabled"] = enabled
+        timingState["spans"] = {}
+        timingState["outliers"] = {}
+
+def isTimingEnabled():
+    """ True when the spans are recorded"""
+    return timingState["enabled"]
+
+def setSpanRecord(recordName):
+    """ Name the record of the spans that end on this thread, for the outliers"""
+    spanRecord.name = recordName
+
+def startSpan():
+    """ Returns: float: start time of a span, or None when the timing is off"""
+    if timingState["enabled"]:
+        return time.perf_counter()
+    return None
+
+def endSpan(spanName, startTime, recordName=None):
+    """ Add the time since startTime to the span.
+    Args:   spanName (string) : name of the span, see constants/timingData.py
+            startTime (float) : from startSpan. None does nothing
+            recordName (string) : record of the span, None for the record of this thread"""
+    if None == startTime:
+        return
+    duration = time.perf_counter() - startTime
+    if None == recordName:
+        recordName = getattr(spanRecord, "name", None)
+    with timingLock:
+        addSpan(spanName, duration, recordName)
+
+def addSpan(spanName, duration, recordName):
+    """ Add a duration to a span. Call with timingLock held"""
+    if not spanName in timingState["spans"]:
+        timingState["spans"][spanName] = array("d")
+        timingState["outliers"][spanName] = []
+    timingState["spans"][spanName].append(duration)
+    if not None == recordName:
+        addOutlier(timingState["outliers"][spanName], duration, recordName)
+
+def takeTimingSpans():
+    """ Take the spans recorded by this process, e.g. to send them from a worker
+        process to the main process, see mergeTimingSpans
+    Returns: directory: "spans" and "outliers" """
+    with timingLock:
+        timingSpans = {"spans": timingState["spans"], "outliers": timingState["outliers"]}
+        timingState["spans"] = {}
+        timingState["outliers"] = {}
+    return timingSpans
+
+def mergeTimingSpans(timingSpans):
+    """ Add the spans taken with takeTimingSpans to the spans of this process"""
+    with timingLock:
+        for spanName, durationList in timingSpans["spans"].items():
+            if not spanName in timingState["spans"]:
+                timingState["spans"][spanName] = array("d")
+                timingState["outliers"][spanName] = []
+            timingState["spans"][spanName].extend(durationList)
+        for spanName, outlierList in timingSpans["outliers"].items():
+            for duration, recordName in outlierList:
+                addOutlier(timingState["outliers"][spanName], duration, recordName)
+
+def addOutlier(outlierList, duration, recordName):
+    """ Keep the TIMING_OUTLIER_COUNT slowest records in outlierList"""
+    if len(outlierList) < TIMING_OUTLIER_COUNT:
+        heapq.heappush(outlierList, (duration, recordName))
+    elif duration > outlierList[0][0]:
+        heapq.heapreplace(outlierList, (duration, recordName))
+
+def getPercentile(sortedList, percentile):
+    """ Nearest rank percentile of a sorted list"""
+    return sortedList[max(0, math.ceil(percentile / 100 * len(sortedList)) - 1)]
+
+def getTimingReport():
+    """ Summary of each span: count, total, the percentiles, max and the slowest records.
+    Returns: list: a directory for each span, in the order the spans were first seen"""
+    with timingLock:
+        spanList = [(spanName, sorted(durationList), sorted(timingState["outliers"][spanName], reverse=True))
+                    for spanName, durationList in timingState["spans"].items()]
+    report = []
+    for spanName, durationList, outlierList in spanList:
+        spanReport = {"span": spanName, "count": len(durationList), "totalSeconds": round(sum(durationList), 6)}
+        for percentile in TIMING_PERCENTILE_LIST:
+            spanReport[f"p{percentile}Seconds"] = round(getPercentile(durationList, percentile), 6)
+        spanReport["maxSeconds"] = round(durationList[-1], 6)
+        spanReport["outliers"] = [{"record": recordName, "seconds": round(duration, 6)} for duration, recordName in outlierList]
+        report.append(spanReport)
+    return report
+
+def logTimingReport(report):
+    """ Log one line for each span of the report"""
+    for spanReport in report:
+        logger.info("Timing [ %s ] count %s total %.3fs p50 %.2fms p95 %.2fms max %.2fms", spanReport["span"], spanReport["count"],
+                    spanReport["totalSeconds"], spanReport["p50Seconds"] * 1000, spanReport["p95Seconds"] * 1000,
+                    spanReport["maxSeconds"] * 1000)